@@ -0,0 +1,212 @@
+"""Headless attendance from recorded video files and image folders.
+
+Usage: python batch.py [--workers N] [--output results.csv] [--record] <video or folder> ...
+
+Inputs are split into tasks (one per video, chunks of images per folder) and
+processed by a pool of worker processes, each of which loads the model once.
+Faces in videos are followed with a FaceTracker, so a person is reported
+once per appearance. Images are recognized independently. Results are
+written to a CSV file and, with --record, recorded as attendance at the
+time they were filmed: a video is taken to have ended when its file was
+last modified, and an image to have been taken at its modification time.
+"""
+import argparse
+import csv
+import datetime
+import multiprocessing
+import os
+import time
+import cv2
+from config.db_config import MODEL_FILE, INDEX_FILE, GALLERY_INDEX_ENABLED, RECOGNITION_THRESHOLD
+from db.attendance_writer import AttendanceWriter
+from db.database import initialize_database
+from face.detector import FaceDetector
+from face.matcher import LBPHMatcher
+from face.model_store import load_model
+from face.tracker import FaceTracker, UNKNOWN
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+IMAGE_CHUNK_SIZE = 64
+
+# Loaded once in every worker process by init_worker
+_detector = None
+_matcher = None
+
+def init_worker(model_file):
+    """Load the detector and the model in a worker process"""
+    global _detector, _matcher
+    _detector = FaceDetector()
+    _matcher = LBPHMatcher(load_model(model_file), GALLERY_INDEX_ENABLED, model_file, INDEX_FILE)
+
+def filmed_at(timestamp):
+    """Local time of a POSIX timestamp, as written to the results"""
+    return datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+def process_video(path, frame_step=1):
+    """Recognize the people appearing in a video, returning (rows, frames processed)"""
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        print(f"Cannot open video {path}")
+        return [], 0
+
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    # Recordings are written as they are filmed, so the file was last modified at the end of the video
+    started = os.path.getmtime(path) - max(cap.get(cv2.CAP_PROP_FRAME_COUNT), 0) / fps
+    # Faces of the previous video say nothing about where they are in this one
+    _detector.reset()
+    tracker = FaceTracker()
+    reported = set()
+    rows = []
+    frame_index = -1
+    frames = 0
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frame_index += 1
+        if frame_index % frame_step:
+            continue
+        frames += 1
+
+        gray, faces = _detector.detect_faces(frame)
+        tracks = tracker.update(faces)
+        pending = [i for i, track in enumerate(tracks) if tracker.needs_recognition(track)]
+        if pending:
+            user_ids, confidences = _matcher.match(_matcher.normalizer.crop(gray, [faces[i] for i in pending]))
+            for i, (user_id,), (confidence,) in zip(pending, user_ids, confidences):
+                if confidence >= RECOGNITION_THRESHOLD:
+                    user_id = UNKNOWN
+                tracker.add_prediction(tracks[i], int(user_id), float(confidence))
+
+        # Report each track once, when its identity is first trusted
+        for track in tracks:
+            if track.committed and track.identity != UNKNOWN and track.track_id not in reported:
+                reported.add(track.track_id)
+                rows.append((path, frame_index, round(frame_index / fps, 2),
+                             str(track.identity), round(track.distance, 2),
+                             filmed_at(started + frame_index / fps)))
+    cap.release()
+    return rows, frames
+
+def process_images(paths):
+    """Recognize the faces in a list of images, returning (rows, images processed)"""
+    rows = []
+    frames = 0
+    for path in paths:
+        frame = cv2.imread(path)
+        if frame is None:
+            print(f"Cannot read image {path}")
+            continue
+        frames += 1
+
+        # Images are unrelated to each other, so every one is scanned in full
+        _detector.reset()
+        gray, faces = _detector.detect_faces(frame)
+        user_ids, confidences = _matcher.match(_matcher.normalizer.crop(gray, faces))
+        for (user_id,), (confidence,) in zip(user_ids, confidences):
+            if confidence < RECOGNITION_THRESHOLD:
+                rows.append((path, 0, 0.0, str(user_id), round(float(confidence), 2),
+                             filmed_at(os.path.getmtime(path))))
+    return rows, frames
+
+def run_task(task):
+    """Process one task in a worker, returning (rows, frames, CPU seconds)"""
+    kind, payload, frame_step = task
+    start = time.process_time()
+    try:
+        if kind == 'video':
+            rows, frames = process_video(payload, frame_step)
+        else:
+            rows, frames = process_images(payload)
+    except Exception as e:
+        print(f"Error processing {payload if kind == 'video' else os.path.dirname(payload[0])}: {e}")
+        rows, frames = [], 0
+    return rows, frames, time.process_time() - start
+
+def collect_tasks(inputs, frame_step=1):
+    """Split the inputs into video tasks and chunks of images"""
+    tasks = []
+    for path in inputs:
+        if os.path.isdir(path):
+            images = sorted(os.path.join(root, name)
+                            for root, _, names in os.walk(path)
+                            for name in names if name.lower().endswith(IMAGE_EXTENSIONS))
+            for start in range(0, len(images), IMAGE_CHUNK_SIZE):
+                tasks.append(('images', images[start:start+IMAGE_CHUNK_SIZE], frame_step))
+        elif os.path.isfile(path):
+            tasks.append(('video', path, frame_step))
+        else:
+            print(f"Skipping {path}: not a file or directory")
+    return tasks
+
+def record_results(rows):
+    """Record attendance for every recognized user when they were filmed, returning False if the database is unavailable"""
+    if not initialize_database():
+        print("Could not connect to database. Attendance not recorded.")
+        return False
+
+    # The writer keeps the earliest recognition of a user on each day
+    writer = AttendanceWriter()
+    writer.start()
+    for row in rows:
+        writer.submit(row[3], timestamp=datetime.datetime.strptime(row[5], "%Y-%m-%d %H:%M:%S"))
+    writer.stop()
+    return True
+
+def run_batch(inputs, workers=None, output='results.csv', record=False, frame_step=1, model_file=MODEL_FILE):
+    """Recognize faces in videos and image folders with a process pool"""
+    if not os.path.exists(model_file):
+        print(f"No trained model found at {model_file}. Please add users first.")
+        return False
+
+    tasks = collect_tasks(inputs, frame_step)
+    if not tasks:
+        print("Nothing to process.")
+        return False
+
+    workers = workers or os.cpu_count() or 1
+    rows = []
+    frames = 0
+    cpu_seconds = 0.0
+    start = time.perf_counter()
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(model_file,)) as pool:
+        for task_rows, task_frames, task_seconds in pool.imap_unordered(run_task, tasks):
+            rows.extend(task_rows)
+            frames += task_frames
+            cpu_seconds += task_seconds
+    elapsed = time.perf_counter() - start
+
+    rows.sort()
+    try:
+        with open(output, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(['Source', 'Frame', 'Seconds', 'User ID', 'Confidence', 'Filmed At'])
+            writer.writerows(rows)
+        print(f"{len(rows)} recognitions written to {output}")
+    except Exception as e:
+        print(f"Error writing results: {e}")
+
+    print(f"Processed {frames} frames in {elapsed:.1f} s with {workers} workers: "
+          f"{frames / elapsed:.1f} frames/s overall, "
+          f"{frames / cpu_seconds if cpu_seconds else 0:.1f} frames/s per core")
+
+    if record:
+        record_results(rows)
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description="Recognize faces in video files and image folders")
+    parser.add_argument('inputs', nargs='+', help="video files or folders of images")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument('--output', default='results.csv', help="CSV file for the results")
+    parser.add_argument('--record', action='store_true', help="record attendance for recognized users")
+    parser.add_argument('--frame-step', type=int, default=1, help="process every n-th video frame")
+    args = parser.parse_args()
+
+    try:
+        run_batch(args.inputs, args.workers, args.output, args.record, max(1, args.frame_step))
+    except KeyboardInterrupt:
+        print("\nProgram interrupted. Exiting...")
+
+if __name__ == "__main__":
+    main()
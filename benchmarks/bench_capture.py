@@ -0,0 +1,136 @@
+"""Compare saving every captured face with quality-filtered, deduplicated capture.
+
+Run from the repository root:
+    python -m benchmarks.bench_capture [frames per user]
+
+Each sample user is "captured" from a synthetic webcam stream made of their
+photos with small shifts and noise, as between consecutive frames, and some
+frames blurred by motion or with the head turned. The old capture saved
+the first CAPTURE_SAMPLES faces; the selector keeps sharp, frontal and
+distinct ones. A gallery captured each way is then searched with the
+photos that were held out of the streams, and an inflated gallery is
+compacted with compact_faces.
+"""
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+import cv2
+import numpy as np
+from benchmarks.common import load_samples
+from config.db_config import CAPTURE_SAMPLES
+from face.matcher import LBPHMatcher
+from face.model_store import load_model
+from face.preprocess import FaceNormalizer
+from face.quality import SampleSelector, compact_faces
+from face.trainer import FaceTrainer
+
+FRAMES_PER_USER = 120
+SEED = 0
+
+def shake(face, rng):
+    """Shift a face by a pixel or two and add sensor noise, like the next frame of a webcam"""
+    h, w = face.shape
+    shift = np.float32([[1, 0, rng.uniform(-2, 2)], [0, 1, rng.uniform(-2, 2)]])
+    frame = cv2.warpAffine(face, shift, (w, h), borderMode=cv2.BORDER_REPLICATE).astype(np.float32)
+    return np.clip(frame * rng.uniform(0.95, 1.05) + rng.normal(0, 2, frame.shape), 0, 255).astype(np.uint8)
+
+def motion_blur(face, length=15):
+    kernel = np.full((1, length), 1 / length, dtype=np.float32)
+    return cv2.filter2D(face, -1, kernel)
+
+def turn(face, amount=0.3):
+    """Warp a face as if the head were turned to one side"""
+    h, w = face.shape
+    d = amount * w
+    src = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
+    dst = np.float32([[0, 0], [w - d, d / 2], [w - d, h - d / 2], [0, h]])
+    return cv2.warpPerspective(face, cv2.getPerspectiveTransform(src, dst), (w, h), borderMode=cv2.BORDER_REPLICATE)
+
+def stream(photos, num_frames, rng):
+    """Webcam frames of one user: mostly slight variations of their photos in order, some blurred or turned"""
+    frames = []
+    for i in range(num_frames):
+        face = shake(photos[i * len(photos) // num_frames], rng)
+        kind = rng.random()
+        if kind < 0.15:
+            face = motion_blur(face)
+        elif kind < 0.3:
+            face = turn(face)
+        frames.append(face)
+    return frames
+
+def save_faces(faces_dir, user_id, face_imgs):
+    user_dir = os.path.join(faces_dir, str(user_id))
+    os.makedirs(user_dir, exist_ok=True)
+    for i, face_img in enumerate(face_imgs):
+        cv2.imwrite(os.path.join(user_dir, f'face_{i}.jpg'), face_img)
+
+def evaluate(faces_dir, model_file, queries, labels):
+    """Train on a faces directory and return (samples, ms per face, accuracy) on the queries"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        FaceTrainer(faces_dir, model_file).train_face_recognizer(force=True)
+    matcher = LBPHMatcher(load_model(model_file))
+    face_imgs = [matcher.normalizer.normalize(query) for query in queries]
+    matcher.match(face_imgs[:1])
+    start = time.perf_counter()
+    predicted = [matcher.predict(face_img)[0] for face_img in face_imgs]
+    ms = (time.perf_counter() - start) / len(face_imgs) * 1000
+    return len(matcher.active), ms, float(np.mean(np.array(predicted) == np.array(labels)))
+
+def run(frames_per_user=FRAMES_PER_USER):
+    faces, ids = load_samples()
+    normalizer = FaceNormalizer()
+    rng = np.random.default_rng(SEED)
+
+    # Even photos make up the capture streams, odd ones are held out as queries
+    users = sorted(set(ids))
+    user_faces = {user: [face for face, label in zip(faces, ids) if label == user] for user in users}
+    photos = {user: user_faces[user][::2] for user in users}
+    queries = [face for user in users for face in user_faces[user][1::2]]
+    query_labels = [user for user in users for _ in user_faces[user][1::2]]
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        old_dir = os.path.join(work_dir, 'old')
+        new_dir = os.path.join(work_dir, 'new')
+        inflated_dir = os.path.join(work_dir, 'inflated')
+        skipped = Counter()
+        score_ms = []
+        for user in users:
+            frames = [normalizer.normalize(frame) for frame in stream(photos[user], frames_per_user, rng)]
+            save_faces(old_dir, user, frames[:CAPTURE_SAMPLES])
+            save_faces(inflated_dir, user, frames)
+
+            selector = SampleSelector(CAPTURE_SAMPLES)
+            for frame in frames:
+                if selector.full:
+                    break
+                start = time.perf_counter()
+                problem = selector.add(frame)
+                score_ms.append((time.perf_counter() - start) * 1000)
+                if problem:
+                    skipped[problem] += 1
+            save_faces(new_dir, user, selector.faces)
+
+        print(f"{len(users)} users, {frames_per_user} webcam frames each, {len(queries)} held-out queries")
+        print(f"Scoring a face: {np.median(score_ms):.2f} ms; skipped "
+              + ", ".join(f"{count} {reason}" for reason, count in skipped.items()))
+
+        model_file = os.path.join(work_dir, 'trainer.lbph')
+        print(f"\n{'Gallery':<36} {'Samples':>8} {'ms/face':>8} {'Accuracy':>9}")
+        for name, faces_dir in (("first faces of the stream (old)", old_dir),
+                                ("quality-filtered capture", new_dir),
+                                ("every frame", inflated_dir)):
+            samples, ms, accuracy = evaluate(faces_dir, model_file, queries, query_labels)
+            print(f"{name:<36} {samples:>8} {ms:>8.2f} {accuracy:>9.1%}")
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            compact_faces(inflated_dir, model_file)
+        samples, ms, accuracy = evaluate(inflated_dir, model_file, queries, query_labels)
+        print(f"{'every frame, compacted':<36} {samples:>8} {ms:>8.2f} {accuracy:>9.1%}")
+
+if __name__ == "__main__":
+    run(*[int(n) for n in sys.argv[1:2]])
@@ -0,0 +1,78 @@
+"""Compare detection rate and speed of the FaceDetector modes on synthetic 1080p video.
+
+Run from the repository root:
+    python -m benchmarks.bench_detection [number of frames]
+"""
+import sys
+import time
+import cv2
+import numpy as np
+from benchmarks.common import load_samples
+from face.detector import FaceDetector
+from face.tracker import box_iou
+
+FRAME_SIZE = (1080, 1920)
+FACE_SIZES = [360, 280, 200]
+NUM_FRAMES = 60
+SEED = 0
+
+# (name, FaceDetector arguments)
+MODES = [
+    ("full resolution", dict(max_width=0)),
+    ("max width 960", dict(max_width=960)),
+    ("max width 640", dict(max_width=640)),
+    ("max width 480", dict(max_width=480)),
+    ("640, min face 150", dict(max_width=640, min_face_size=150)),
+    ("640, ROI, full scan every 5", dict(max_width=640, full_scan_interval=5)),
+    ("640, ROI, full scan every 15", dict(max_width=640, full_scan_interval=15)),
+]
+
+def synthetic_video(faces, num_frames, rng):
+    """Frames with a few faces drifting across a noisy background, with their true boxes"""
+    background = cv2.GaussianBlur(rng.integers(80, 160, FRAME_SIZE, dtype=np.uint8), (15, 15), 0)
+    picks = rng.integers(0, len(faces), len(FACE_SIZES))
+    starts = [(200 + i * 600, 150 + 150 * i) for i in range(len(FACE_SIZES))]
+    velocities = rng.integers(-6, 7, (len(FACE_SIZES), 2))
+
+    frames = []
+    truths = []
+    for t in range(num_frames):
+        frame = background.copy()
+        boxes = []
+        for (x, y), (vx, vy), size, pick in zip(starts, velocities, FACE_SIZES, picks):
+            x = int(np.clip(x + vx * t, 0, FRAME_SIZE[1] - size))
+            y = int(np.clip(y + vy * t, 0, FRAME_SIZE[0] - size))
+            frame[y:y+size, x:x+size] = cv2.resize(faces[pick], (size, size))
+            boxes.append((x, y, size, size))
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+        truths.append(boxes)
+    return frames, truths
+
+def evaluate(detector, frames, truths):
+    """Return (detection rate, false positives per frame, frames per second)"""
+    found = 0
+    false_positives = 0
+    start = time.perf_counter()
+    detections = [detector.detect_faces(frame)[1] for frame in frames]
+    elapsed = time.perf_counter() - start
+
+    for faces, boxes in zip(detections, truths):
+        matched = [any(box_iou(face, box) >= 0.3 for box in boxes) for face in faces]
+        false_positives += matched.count(False)
+        found += sum(any(box_iou(face, box) >= 0.3 for face in faces) for box in boxes)
+    total = sum(len(boxes) for boxes in truths)
+    return found / total, false_positives / len(frames), len(frames) / elapsed
+
+def run(num_frames=NUM_FRAMES):
+    rng = np.random.default_rng(SEED)
+    faces, _ = load_samples()
+    frames, truths = synthetic_video(faces, num_frames, rng)
+
+    print(f"{num_frames} frames of {FRAME_SIZE[1]}x{FRAME_SIZE[0]} with {len(FACE_SIZES)} faces each")
+    print(f"{'Mode':<30} {'Detection rate':>15} {'False pos/frame':>16} {'FPS':>8}")
+    for name, options in MODES:
+        rate, false_positives, fps = evaluate(FaceDetector(**options), frames, truths)
+        print(f"{name:<30} {rate:>15.3f} {false_positives:>16.2f} {fps:>8.1f}")
+
+if __name__ == "__main__":
+    run(*[int(n) for n in sys.argv[1:2]])
@@ -0,0 +1,81 @@
+"""Compare face detector backends on the bundled sample faces.
+
+Run from the repository root:
+    python -m benchmarks.bench_detectors [--lbp lbpcascade_frontalface.xml] [--dnn face_detection_yunet.onnx]
+
+The Haar cascades shipped with OpenCV are always compared. LBP cascades and
+DNN models are not bundled, so those backends are only included when a
+local model file is given.
+"""
+import argparse
+import time
+import cv2
+import numpy as np
+from benchmarks.common import load_samples, synthetic_frame
+from face.detector import FaceDetector, CascadeBackend, DNNBackend, HAAR_CASCADE_FILE
+from face.tracker import box_iou
+
+FACES_PER_FRAME = 3
+NUM_FRAMES = 20
+SEED = 0
+
+def padded_samples(faces):
+    """Put every sample face on a plain border so it is not cut off at the image edge"""
+    return [cv2.cvtColor(cv2.copyMakeBorder(face, 60, 60, 60, 60, cv2.BORDER_REPLICATE), cv2.COLOR_GRAY2BGR)
+            for face in faces]
+
+def synthetic_frames(faces, rng):
+    """Frames with several faces and their true boxes, as laid out by bench_suite.synthetic_frame"""
+    frames = [synthetic_frame(faces, FACES_PER_FRAME, rng) for _ in range(NUM_FRAMES)]
+    height, width = frames[0].shape[:2]
+    size = 150
+    gap = (width - FACES_PER_FRAME * size) // (FACES_PER_FRAME + 1)
+    boxes = [(gap + i * (size + gap), (height - size) // 2, size, size) for i in range(FACES_PER_FRAME)]
+    return frames, [boxes] * len(frames)
+
+def evaluate(detector, samples, frames, truths):
+    """Return sample detection rate, frame detection rate, ms per frame and frames per second"""
+    sample_hits = sum(len(detector.detect_faces(sample)[1]) > 0 for sample in samples)
+
+    found = 0
+    start = time.perf_counter()
+    detections = [detector.detect_faces(frame)[1] for frame in frames]
+    elapsed = time.perf_counter() - start
+    for faces, boxes in zip(detections, truths):
+        found += sum(any(box_iou(face, box) >= 0.3 for face in faces) for box in boxes)
+
+    total = sum(len(boxes) for boxes in truths)
+    return sample_hits / len(samples), found / total, elapsed / len(frames) * 1000, len(frames) / elapsed
+
+def run(lbp_file=None, dnn_file=None):
+    rng = np.random.default_rng(SEED)
+    faces, _ = load_samples()
+    samples = padded_samples(faces)
+    frames, truths = synthetic_frames(faces, rng)
+
+    backends = [
+        ("haar default", lambda: CascadeBackend(HAAR_CASCADE_FILE)),
+        ("haar alt2", lambda: CascadeBackend(cv2.data.haarcascades + 'haarcascade_frontalface_alt2.xml')),
+    ]
+    if lbp_file:
+        backends.append(("lbp", lambda: CascadeBackend(lbp_file)))
+    if dnn_file:
+        backends.append(("dnn (YuNet)", lambda: DNNBackend(dnn_file)))
+
+    print(f"{len(samples)} sample faces, {len(frames)} frames with {FACES_PER_FRAME} faces each")
+    print(f"{'Backend':<16} {'Samples found':>14} {'Frame faces found':>18} {'ms/frame':>9} {'Frames/s':>9}")
+    for name, create in backends:
+        try:
+            backend = create()
+        except Exception as e:
+            print(f"{name:<16} could not be loaded: {e}")
+            continue
+        sample_rate, frame_rate, latency, throughput = evaluate(FaceDetector(backend), samples, frames, truths)
+        print(f"{name:<16} {sample_rate:>14.3f} {frame_rate:>18.3f} {latency:>9.1f} {throughput:>9.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare face detector backends")
+    parser.add_argument('--lbp', help="LBP cascade XML file")
+    parser.add_argument('--dnn', help="YuNet ONNX model file")
+    args = parser.parse_args()
+    run(args.lbp, args.dnn)
@@ -0,0 +1,45 @@
+"""Compare full retraining against incremental enrollment as the gallery grows.
+
+Run from the repository root:
+    python -m benchmarks.bench_enrollment
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from benchmarks.common import SAMPLE_FACES_DIR, FIRST_USER_ID, build_gallery, sample_users
+from face.trainer import FaceTrainer
+
+GALLERY_SIZES = [5, 10, 20, 40]
+
+def run(gallery_sizes=GALLERY_SIZES):
+    """Time a full retrain and a single incremental enrollment for each gallery size"""
+    print(f"{'Users':>6} {'Full retrain (s)':>18} {'Incremental add (s)':>20}")
+    for num_users in gallery_sizes:
+        work_dir = tempfile.mkdtemp()
+        try:
+            faces_dir = os.path.join(work_dir, 'faces')
+            model_file = os.path.join(work_dir, 'trainer.lbph')
+            build_gallery(faces_dir, num_users)
+
+            trainer = FaceTrainer(faces_dir, model_file)
+            start = time.perf_counter()
+            trainer.train_face_recognizer()
+            full_time = time.perf_counter() - start
+
+            # Enroll one more user on top of the existing model
+            new_user = str(FIRST_USER_ID + num_users)
+            shutil.copytree(os.path.join(SAMPLE_FACES_DIR, sample_users()[0]),
+                            os.path.join(faces_dir, new_user))
+            trainer = FaceTrainer(faces_dir, model_file)
+            start = time.perf_counter()
+            trainer.add_user_faces(new_user)
+            add_time = time.perf_counter() - start
+
+            print(f"{num_users:>6} {full_time:>18.3f} {add_time:>20.3f}")
+        finally:
+            shutil.rmtree(work_dir)
+
+if __name__ == "__main__":
+    run([int(n) for n in sys.argv[1:]] or GALLERY_SIZES)
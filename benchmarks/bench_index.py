@@ -0,0 +1,74 @@
+"""Measure the recall-vs-latency tradeoff of the gallery index against exact search.
+
+Recall is the fraction of queries whose nearest sample found through the
+index is the same as the one found by exact search.
+
+Run from the repository root:
+    python -m benchmarks.bench_index [gallery size]
+"""
+import sys
+import time
+import cv2
+import numpy as np
+from benchmarks.common import load_samples
+from face.index import GalleryIndex
+from face.matcher import LBPHMatcher
+from face.model_store import LBPHModel
+
+PROBES = [1, 2, 4, 8, 16]
+CANDIDATES = [10, 30]
+NUM_QUERIES = 100
+# Faces matched together, as in a moderately crowded frame
+BATCH_SIZE = 4
+
+def jitter(face, rng):
+    """Randomly rotate, scale, shift and relight a face to synthesize another sample"""
+    h, w = face.shape
+    rotation = cv2.getRotationMatrix2D((w / 2, h / 2), rng.uniform(-12, 12), rng.uniform(0.9, 1.1))
+    rotation[:, 2] += rng.uniform(-0.05, 0.05, 2) * (w, h)
+    face = cv2.warpAffine(face, rotation, (w, h), borderMode=cv2.BORDER_REFLECT)
+    return cv2.convertScaleAbs(face, alpha=rng.uniform(0.8, 1.2), beta=rng.uniform(-20, 20))
+
+def timed_match(matcher, queries):
+    """Match queries in frame-sized batches, returning the labels and the seconds per query"""
+    start = time.perf_counter()
+    labels = np.concatenate([matcher.match_histograms(queries[i:i+BATCH_SIZE])[0]
+                             for i in range(0, len(queries), BATCH_SIZE)])
+    return labels, (time.perf_counter() - start) / len(queries)
+
+def run(gallery_size=5000, seed=0):
+    rng = np.random.default_rng(seed)
+    faces, ids = load_samples()
+    matcher = LBPHMatcher(LBPHModel(np.zeros((0, 16384), dtype=np.float32), []))
+
+    print(f"Synthesizing {gallery_size} gallery samples...")
+    picks = rng.integers(0, len(faces), gallery_size)
+    histograms = np.concatenate([
+        matcher.compute_histograms([jitter(faces[i], rng) for i in picks[start:start+256]])
+        for start in range(0, gallery_size, 256)])
+    model = LBPHModel(histograms, np.arange(gallery_size))
+    queries = matcher.compute_histograms([jitter(faces[i], rng)
+                                          for i in rng.integers(0, len(faces), NUM_QUERIES)])
+
+    exact_matcher = LBPHMatcher(model)
+    exact_matcher.match_histograms(queries[:1])
+    expected, exact_time = timed_match(exact_matcher, queries)
+
+    start = time.perf_counter()
+    index = GalleryIndex().build(histograms)
+    print(f"Index built in {time.perf_counter() - start:.2f} s")
+
+    indexed_matcher = LBPHMatcher(model)
+    indexed_matcher.index = index
+    print(f"{'Probes':>8} {'Candidates':>11} {'Recall@1':>10} {'ms/query':>10}")
+    print(f"{'exact':>8} {'all':>11} {1.0:>10.3f} {exact_time * 1000:>10.2f}")
+    for candidates in CANDIDATES:
+        for probes in PROBES:
+            index.num_probes = probes
+            index.num_candidates = candidates
+            found, elapsed = timed_match(indexed_matcher, queries)
+            recall = np.mean(found[:, 0] == expected[:, 0])
+            print(f"{probes:>8} {candidates:>11} {recall:>10.3f} {elapsed * 1000:>10.2f}")
+
+if __name__ == "__main__":
+    run(*[int(n) for n in sys.argv[1:2]])
@@ -0,0 +1,80 @@
+"""Check LBPHMatcher against LBPHFaceRecognizer.predict and compare their throughput.
+
+Run from the repository root:
+    python -m benchmarks.bench_matcher
+"""
+import sys
+import time
+import cv2
+import numpy as np
+from benchmarks.common import load_samples
+from face.matcher import LBPHMatcher
+from face.model_store import LBPHModel
+
+FACES_PER_FRAME = [1, 4, 8, 16]
+
+def augment(face, variant):
+    """Derive a different but similar face image so synthetic galleries have no exact duplicates"""
+    h, w = face.shape
+    shift = 1 + variant % 7
+    scale = 0.8 + 0.05 * (variant % 5)
+    face = face[shift:h-shift, shift:w-shift]
+    face = cv2.resize(face, (int(w * scale), int(h * scale)))
+    if variant % 2:
+        face = cv2.flip(face, 1)
+    return face
+
+def build_models(faces, ids, copies=1):
+    """Train an OpenCV LBPH recognizer and the equivalent LBPHMatcher on the same faces"""
+    gallery = [augment(face, c) if c else face for c in range(copies) for face in faces]
+    labels = np.array([label for c in range(copies) for label in ids])
+
+    face_recognizer = cv2.face.LBPHFaceRecognizer_create()
+    face_recognizer.train(gallery, labels)
+    histograms = np.array([h.ravel() for h in face_recognizer.getHistograms()], dtype=np.float32)
+    return face_recognizer, LBPHMatcher(LBPHModel(histograms, labels))
+
+def check_accuracy(faces, ids):
+    """Compare predictions on held-out and augmented faces, returning the number of mismatches"""
+    face_recognizer, matcher = build_models(faces[::2], ids[::2])
+    queries = faces[1::2] + [augment(face, 7) for face in faces[1::2]]
+
+    expected = [face_recognizer.predict(face) for face in queries]
+    labels, distances = matcher.match(queries)
+    mismatches = 0
+    for (label, distance), got_label, got_distance in zip(expected, labels[:, 0], distances[:, 0]):
+        if label != got_label or abs(distance - got_distance) > 1e-4:
+            mismatches += 1
+    print(f"Predictions compared: {len(queries)}, mismatches: {mismatches}")
+    return mismatches
+
+def measure_throughput(faces, ids, copies, faces_per_frame=FACES_PER_FRAME, repeats=5):
+    """Print faces per second for per-face predict and batched matching"""
+    face_recognizer, matcher = build_models(faces, ids, copies)
+    print(f"\nGallery of {len(faces) * copies} samples")
+    print(f"{'Faces/frame':>12} {'predict (faces/s)':>18} {'matcher (faces/s)':>18}")
+    for num_faces in faces_per_frame:
+        frame_faces = [augment(faces[(i * 7) % len(faces)], 11 + i) for i in range(num_faces)]
+        matcher.match(frame_faces)
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for face in frame_faces:
+                face_recognizer.predict(face)
+        predict_rate = repeats * num_faces / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            matcher.match(frame_faces)
+        matcher_rate = repeats * num_faces / (time.perf_counter() - start)
+
+        print(f"{num_faces:>12} {predict_rate:>18.1f} {matcher_rate:>18.1f}")
+
+def run(copies=10):
+    faces, ids = load_samples()
+    mismatches = check_accuracy(faces, ids)
+    measure_throughput(faces, ids, copies)
+    return mismatches
+
+if __name__ == "__main__":
+    sys.exit(1 if run(*[int(n) for n in sys.argv[1:2]]) else 0)
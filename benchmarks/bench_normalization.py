@@ -0,0 +1,76 @@
+"""Measure recognition accuracy and per-face cost with and without face normalization.
+
+Run from the repository root:
+    python -m benchmarks.bench_normalization
+
+Half of the bundled sample faces of every user are enrolled and the other
+half are recognized, as captured and after changes of distance, lighting
+and head tilt.
+"""
+import time
+import cv2
+import numpy as np
+from benchmarks.common import load_samples
+from face.matcher import LBPHMatcher
+from face.model_store import LBPHModel
+from face.preprocess import FaceNormalizer
+
+# (name, FaceNormalizer arguments)
+SETTINGS = [
+    ("as detected", dict(size=0, equalize=False, align=False)),
+    ("resize 100", dict(size=100, equalize=False, align=False)),
+    ("resize 100, equalize", dict(size=100, equalize=True, align=False)),
+    ("resize 100, equalize, align", dict(size=100, equalize=True, align=True)),
+    ("resize 128, equalize", dict(size=128, equalize=True, align=False)),
+]
+
+def rotate(face, angle):
+    h, w = face.shape
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    return cv2.warpAffine(face, matrix, (w, h), borderMode=cv2.BORDER_REPLICATE)
+
+# (name, change applied to a query face)
+CONDITIONS = [
+    ("captured", lambda face: face),
+    ("0.5x", lambda face: cv2.resize(face, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)),
+    ("1.5x", lambda face: cv2.resize(face, None, fx=1.5, fy=1.5)),
+    ("darker", lambda face: cv2.convertScaleAbs(face, alpha=0.6, beta=-10)),
+    ("washed", lambda face: cv2.convertScaleAbs(face, alpha=0.5, beta=110)),
+    ("tilt 10", lambda face: rotate(face, 10)),
+]
+
+def evaluate(normalizer, gallery, gallery_ids, queries, query_ids):
+    """Return accuracy per condition and the mean and spread of milliseconds per face"""
+    model = LBPHModel(None, np.array(gallery_ids))
+    matcher = LBPHMatcher(LBPHModel(np.zeros((0, model.hist_size), dtype=np.float32), []))
+    model.histograms = matcher.compute_histograms([normalizer.normalize(face) for face in gallery])
+    matcher = LBPHMatcher(model)
+
+    accuracy = {}
+    per_face = []
+    for name, change in CONDITIONS:
+        faces = [change(face) for face in queries]
+        for face in faces[:10]:
+            start = time.perf_counter()
+            matcher.compute_histograms([normalizer.normalize(face)])
+            per_face.append((time.perf_counter() - start) * 1000)
+        labels, _ = matcher.match([normalizer.normalize(face) for face in faces])
+        accuracy[name] = float(np.mean(labels[:, 0] == np.array(query_ids)))
+    return accuracy, float(np.mean(per_face)), float(np.std(per_face))
+
+def run():
+    faces, ids = load_samples()
+    gallery, gallery_ids = faces[::2], ids[::2]
+    queries, query_ids = faces[1::2], ids[1::2]
+
+    print(f"{len(gallery)} enrolled faces, {len(queries)} queries per condition: as captured, at half and")
+    print("1.5 times the size, darker, brighter with low contrast, and tilted by 10 degrees")
+    header = f"{'Normalization':<30}" + ''.join(f"{name:>10}" for name, _ in CONDITIONS)
+    print(header + f"{'ms/face':>10}{'std':>7}")
+    for name, options in SETTINGS:
+        accuracy, mean_ms, std_ms = evaluate(FaceNormalizer(**options), gallery, gallery_ids, queries, query_ids)
+        print(f"{name:<30}" + ''.join(f"{accuracy[condition]:>10.3f}" for condition, _ in CONDITIONS)
+              + f"{mean_ms:>10.2f}{std_ms:>7.2f}")
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,132 @@
+"""Enroll users while the attendance pipeline runs and measure the hot model reload.
+
+Run from the repository root:
+    python -m benchmarks.bench_reload [seconds to run]
+
+A synthetic camera shows a user who is not enrolled yet. While the pipeline
+runs, the user is added to the model incrementally and later the whole model
+is retrained, and a ModelReloader swaps each published version in. The
+frame rate and the longest gap between frames are compared before and after
+the first reload, and the time from publishing to the first frame in which
+the new user is recognized is reported. The face stays in view, so its
+track only changes identity once TRACK_MIN_VOTES of the re-checks made every
+TRACK_REFRESH_FRAMES frames agree; a face entering the view is recognized
+as soon as the new version is in. A reader that mapped the model before it
+changed is checked to still see the model it loaded.
+"""
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+from benchmarks.common import SAMPLE_FACES_DIR, SyntheticCapture, load_samples, sample_users, synthetic_frame
+from face.matcher import LBPHMatcher
+from face.model_store import load_model, model_version
+from face.pipeline import AttendancePipeline, VideoSource
+from face.reloader import ModelReloader
+from face.trainer import FaceTrainer
+
+CAMERA_FPS = 15
+DURATION = 12.0
+RELOAD_INTERVAL = 0.5
+SEED = 0
+
+def enroll_later(trainer, faces_dir, sample_dir, new_id, duration, published):
+    """Add the new user a quarter into the run and retrain everything at two thirds"""
+    time.sleep(duration / 4)
+    shutil.copytree(sample_dir, os.path.join(faces_dir, str(new_id)))
+    with contextlib.redirect_stdout(io.StringIO()):
+        trainer.add_user_faces(new_id)
+    published.append(time.monotonic())
+
+    time.sleep(duration * 2 / 3 - duration / 4)
+    with contextlib.redirect_stdout(io.StringIO()):
+        trainer.train_face_recognizer(force=True)
+    published.append(time.monotonic())
+
+def check_old_mapping(model_file, trainer, user_id):
+    """Whether a model mapped before a user was removed still reads as it did"""
+    model = load_model(model_file)
+    labels = np.array(model.labels)
+    with contextlib.redirect_stdout(io.StringIO()):
+        trainer.remove_user_faces(user_id)
+    return np.array_equal(model.labels, labels) and len(load_model(model_file)) == len(labels)
+
+def run(duration=DURATION):
+    users = sample_users()
+    new_id = int(users[-1])
+    faces, ids = load_samples()
+    new_faces = [face for face, label in zip(faces, ids) if label == new_id]
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        faces_dir = os.path.join(work_dir, 'faces')
+        model_file = os.path.join(work_dir, 'trainer.lbph')
+        for user in users[:-1]:
+            shutil.copytree(os.path.join(SAMPLE_FACES_DIR, user), os.path.join(faces_dir, user))
+        trainer = FaceTrainer(faces_dir, model_file)
+        with contextlib.redirect_stdout(io.StringIO()):
+            trainer.train_face_recognizer()
+
+        rng = np.random.default_rng(SEED)
+        frames = [synthetic_frame(new_faces, 1, rng) for _ in range(10)]
+        source = VideoSource('camera', SyntheticCapture(frames, CAMERA_FPS, duration), drop_frames=True)
+        pipeline = AttendancePipeline([source], LBPHMatcher(load_model(model_file)))
+
+        reload_times = []
+        def swap(matcher):
+            pipeline.matcher = matcher
+            reload_times.append(time.monotonic())
+        reloader = ModelReloader(lambda: LBPHMatcher(load_model(model_file)), swap, model_file,
+                                 RELOAD_INTERVAL, version=model_version(model_file))
+
+        published = []
+        enroller = threading.Thread(target=enroll_later,
+                                    args=(trainer, faces_dir, os.path.join(SAMPLE_FACES_DIR, str(new_id)),
+                                          new_id, duration, published))
+        start_version = reloader.version
+        pipeline.start()
+        reloader.start()
+        enroller.start()
+
+        arrivals = []
+        recognized_at = None
+        with contextlib.redirect_stdout(io.StringIO()):
+            while True:
+                result = pipeline.read()
+                if result is None:
+                    break
+                arrivals.append(time.monotonic())
+                _, _, _, tracks = result
+                if recognized_at is None and any(t.committed and t.identity == new_id for t in tracks):
+                    recognized_at = arrivals[-1]
+            enroller.join()
+            reloader.stop()
+            pipeline.stop()
+
+        arrivals = np.array(arrivals)
+        first_reload = reload_times[0] if reload_times else arrivals[-1]
+        before = arrivals[arrivals < first_reload]
+        after = arrivals[arrivals >= first_reload]
+        print(f"Camera at {CAMERA_FPS} fps for {duration:.0f}s, model versions {start_version} to {reloader.version}, "
+              f"{reloader.reloads} reloads")
+        print(f"{'':<16} {'Frames':>7} {'FPS':>6} {'Longest gap ms':>15}")
+        for name, times in (("before reload", before), ("after reload", after)):
+            fps = (len(times) - 1) / (times[-1] - times[0]) if len(times) > 1 else 0
+            gap = np.diff(times).max() * 1000 if len(times) > 1 else 0
+            print(f"{name:<16} {len(times):>7} {fps:>6.1f} {gap:>15.1f}")
+        print(f"Frames dropped: {source.frames_dropped} of {source.frames_captured}")
+        for publish, reload in zip(published, reload_times):
+            print(f"Published at {publish - arrivals[0]:.2f}s, swapped in {reload - publish:.2f}s later")
+        if recognized_at is not None and published:
+            print(f"New user first recognized {recognized_at - published[0]:.2f}s after being enrolled")
+        else:
+            print("New user was not recognized")
+
+        print(f"Reader of the previous version unaffected by a change: {check_old_mapping(model_file, trainer, new_id)}")
+
+if __name__ == "__main__":
+    run(*[float(n) for n in sys.argv[1:2]])
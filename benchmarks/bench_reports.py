@@ -0,0 +1,135 @@
+"""Query plans, timings and memory of attendance reports on a generated year of attendance.
+
+Run from the repository root:
+    python -m benchmarks.bench_reports [number of users]
+
+A temporary SQLite database is filled with one year of attendance for every
+user. Month-long, year-long and per-user reports are timed and their query
+plans printed without and with the date index, then a year-long CSV export
+is compared with loading the same rows with fetchall() first.
+"""
+import contextlib
+import datetime
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import db.database
+from db.database import db_cursor, initialize_database
+from db.models import iter_attendance_report, export_to_csv, export_attendance_report
+
+NUM_USERS = 2000
+DAYS = 365
+ATTENDANCE_RATE = 0.8
+START = datetime.date(2024, 1, 1)
+SEED = 0
+
+REPORT_SQL = '''
+SELECT attendance.date, users.name, users.user_id, attendance.time
+FROM attendance JOIN users ON attendance.user_id = users.user_id
+WHERE attendance.date BETWEEN %s AND %s {user_filter}
+ORDER BY attendance.date, attendance.time
+'''
+
+# (name, start date, end date, user ID)
+REPORTS = [
+    ("one day", "2024-06-03", "2024-06-03", None),
+    ("one month", "2024-06-01", "2024-06-30", None),
+    ("one user, whole year", "2024-01-01", "2024-12-31", "100042"),
+]
+
+def generate(num_users, rng):
+    """Insert users and a year of attendance, returning the number of attendance rows"""
+    users = [(f"User {100000 + i}", str(100000 + i)) for i in range(num_users)]
+    rows = 0
+    with db_cursor() as cursor:
+        cursor.executemany('INSERT INTO users (name, user_id) VALUES (%s, %s)', users)
+        for day in range(DAYS):
+            date = (START + datetime.timedelta(days=day)).isoformat()
+            present = np.flatnonzero(rng.random(num_users) < ATTENDANCE_RATE)
+            seconds = rng.integers(7 * 3600, 10 * 3600, len(present))
+            cursor.executemany('INSERT INTO attendance (user_id, date, time) VALUES (%s, %s, %s)',
+                               [(users[i][1], date, f"{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}")
+                                for i, s in zip(present, seconds)])
+            rows += len(present)
+    return rows
+
+def query_plan(start, end, user_id):
+    user_filter = 'AND attendance.user_id = %s' if user_id else ''
+    params = [start, end] + ([user_id] if user_id else [])
+    with db_cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + REPORT_SQL.format(user_filter=user_filter), params)
+        return '; '.join(row[-1] for row in cursor.fetchall())
+
+def time_report(start, end, user_id, repeats=3):
+    """Return the number of rows and the best time in milliseconds to read the whole report"""
+    best = float('inf')
+    for _ in range(repeats):
+        began = time.perf_counter()
+        count = sum(1 for _ in iter_attendance_report(start, end, user_id))
+        best = min(best, (time.perf_counter() - began) * 1000)
+    return count, best
+
+def print_reports(title):
+    print(f"\n{title}")
+    print(f"{'Report':<22} {'Rows':>8} {'ms':>9}  Query plan")
+    for name, start, end, user_id in REPORTS:
+        count, ms = time_report(start, end, user_id)
+        print(f"{name:<22} {count:>8} {ms:>9.1f}  {query_plan(start, end, user_id)}")
+
+def peak_memory(func):
+    """Return the seconds func takes and the peak memory it allocates, in MB"""
+    tracemalloc.start()
+    began = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func()
+    elapsed = time.perf_counter() - began
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024 / 1024
+
+def export_fetchall(filename):
+    """Export the way reports were written before streaming: every row in memory first"""
+    with db_cursor() as cursor:
+        cursor.execute(REPORT_SQL.format(user_filter=''), ('2024-01-01', '2024-12-31'))
+        records = cursor.fetchall()
+    export_to_csv(records, None, ('Date', 'Name', 'User ID', 'Time'), filename)
+
+def run(num_users=NUM_USERS):
+    work_dir = tempfile.mkdtemp()
+    db.database.configure('sqlite', os.path.join(work_dir, 'bench.db'))
+    try:
+        initialize_database()
+        rows = generate(num_users, np.random.default_rng(SEED))
+        print(f"{num_users} users, {rows} attendance rows over {DAYS} days")
+
+        with db_cursor() as cursor:
+            cursor.execute('DROP INDEX attendance_date_time_idx')
+            cursor.execute('ANALYZE')
+        print_reports("Without the date index:")
+        initialize_database()
+        with db_cursor() as cursor:
+            cursor.execute('ANALYZE')
+        print_reports("With the date index:")
+
+        print(f"\n{'Year-long CSV export':<22} {'Seconds':>8} {'Peak MB':>9}")
+        fetchall_file = os.path.join(work_dir, 'fetchall.csv')
+        elapsed, peak = peak_memory(lambda: export_fetchall(fetchall_file))
+        print(f"{'fetchall':<22} {elapsed:>8.2f} {peak:>9.1f}")
+        cwd = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            elapsed, peak = peak_memory(lambda: export_attendance_report('2024-01-01', '2024-12-31'))
+        finally:
+            os.chdir(cwd)
+        print(f"{'streamed':<22} {elapsed:>8.2f} {peak:>9.1f}")
+    finally:
+        db.database.reset_pool()
+        shutil.rmtree(work_dir)
+
+if __name__ == "__main__":
+    run(*[int(n) for n in sys.argv[1:2]])
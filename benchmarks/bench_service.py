@@ -0,0 +1,125 @@
+"""Measure throughput and latency of the recognition service under concurrent uploads.
+
+Run from the repository root:
+    python -m benchmarks.bench_service [seconds per run]
+
+The service runs in a subprocess on a synthetic gallery, without a database.
+A load generator keeps a number of keep-alive connections busy, each sending
+its next JPEG as soon as the previous answer arrives, and reports requests
+per second and latency percentiles. Every concurrency is measured with
+micro-batching turned off (batches of one face) and on.
+"""
+import asyncio
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+from benchmarks.common import build_gallery, load_samples, sample_users, synthetic_frame
+from config.db_config import SERVICE_MAX_BATCH
+from face.matcher import LBPHMatcher
+from face.model_store import load_model
+from face.trainer import FaceTrainer
+
+GALLERY_COPIES = 5
+CONCURRENCY = [1, 4, 16, 32]
+DURATION = 5.0
+NUM_IMAGES = 20
+SEED = 0
+
+def run_server(model_file, max_batch):
+    """Serve the model on a free port, printing the port once listening"""
+    from service import RecognitionService
+
+    async def serve():
+        service = RecognitionService(LBPHMatcher(load_model(model_file)), max_batch=max_batch)
+        port = await service.start(port=0)
+        print(f"PORT {port}", flush=True)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await service.stop()
+
+    asyncio.run(serve())
+
+async def client(port, images, deadline, latencies, errors):
+    """Send images back to back over one connection until the deadline"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    i = 0
+    try:
+        while time.perf_counter() < deadline:
+            body = images[i % len(images)]
+            i += 1
+            start = time.perf_counter()
+            writer.write(f"POST /recognize HTTP/1.1\r\nHost: localhost\r\n"
+                         f"Content-Type: image/jpeg\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line == b'\r\n':
+                    break
+                name, _, value = line.decode().partition(':')
+                if name.lower() == 'content-length':
+                    length = int(value)
+            response = json.loads(await reader.readexactly(length))
+            if status != 200 or 'faces' not in response:
+                errors.append(status)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+async def generate_load(port, images, concurrency, duration):
+    latencies = []
+    errors = []
+    start = time.perf_counter()
+    await asyncio.gather(*[client(port, images[c:] + images[:c], start + duration, latencies, errors)
+                           for c in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    latencies = np.array(latencies) * 1000
+    return len(latencies) / elapsed, np.percentile(latencies, 50), np.percentile(latencies, 99), len(errors)
+
+def measure(model_file, images, max_batch, duration):
+    server = subprocess.Popen([sys.executable, '-m', 'benchmarks.bench_service', '--serve', model_file,
+                               str(max_batch)], stdout=subprocess.PIPE, text=True)
+    try:
+        port = int(server.stdout.readline().split()[1])
+        # The first requests load the detector in every worker thread
+        asyncio.run(generate_load(port, images, 4, 1.0))
+        return [asyncio.run(generate_load(port, images, concurrency, duration)) for concurrency in CONCURRENCY]
+    finally:
+        server.terminate()
+        server.wait()
+
+def run(duration=DURATION):
+    with tempfile.TemporaryDirectory() as work_dir:
+        faces_dir = os.path.join(work_dir, 'faces')
+        model_file = os.path.join(work_dir, 'trainer.lbph')
+        build_gallery(faces_dir, GALLERY_COPIES * len(sample_users()))
+        with contextlib.redirect_stdout(io.StringIO()):
+            FaceTrainer(faces_dir, model_file).train_face_recognizer()
+
+        rng = np.random.default_rng(SEED)
+        faces, _ = load_samples()
+        images = [cv2.imencode('.jpg', synthetic_frame(faces, 1, rng))[1].tobytes() for _ in range(NUM_IMAGES)]
+        print(f"640x480 JPEG uploads of {np.mean([len(image) for image in images]) / 1024:.0f} KB with one face, "
+              f"{len(load_model(model_file).labels)} enrolled faces, {duration}s per run")
+
+        results = {max_batch: measure(model_file, images, max_batch, duration) for max_batch in (1, SERVICE_MAX_BATCH)}
+        print(f"{'Connections':>11} {'Batching':>9} {'Requests/s':>11} {'p50 ms':>8} {'p99 ms':>8} {'Errors':>7}")
+        for i, concurrency in enumerate(CONCURRENCY):
+            for max_batch, label in ((1, 'off'), (SERVICE_MAX_BATCH, 'on')):
+                rate, p50, p99, errors = results[max_batch][i]
+                print(f"{concurrency:>11} {label:>9} {rate:>11.1f} {p50:>8.1f} {p99:>8.1f} {errors:>7}")
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['--serve']:
+        run_server(sys.argv[2], int(sys.argv[3]))
+    else:
+        run(*[float(n) for n in sys.argv[1:2]])
@@ -0,0 +1,84 @@
+"""Compare searching the full gallery with searching the shard of one group.
+
+Run from the repository root:
+    python -m benchmarks.bench_shards [number of groups]
+
+A synthetic gallery is split into groups of equal size. For the full model
+and for a single group's shard, the time to the first recognized face after
+opening the files and the time per face afterwards are measured. Then cameras
+of different groups share one ShardCache whose memory limit holds only some
+of their shards, to show the least recently used shards being closed.
+"""
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+from benchmarks.common import build_gallery, load_samples
+from face.matcher import LBPHMatcher
+from face.model_store import load_model
+from face.shards import ShardCache, ShardedGallery, shard_dir
+from face.trainer import FaceTrainer
+
+NUM_GROUPS = 8
+USERS_PER_GROUP = 30
+QUERIES = 40
+
+def time_search(create, queries):
+    """Return seconds to the first matched face, including opening the gallery, and ms per face after it"""
+    start = time.perf_counter()
+    matcher = create()
+    matcher.match(queries[:1])
+    first = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for query in queries:
+        matcher.match([query])
+    return first, (time.perf_counter() - start) / len(queries) * 1000
+
+def run(num_groups=NUM_GROUPS):
+    work_dir = tempfile.mkdtemp()
+    try:
+        faces_dir = os.path.join(work_dir, 'faces')
+        model_file = os.path.join(work_dir, 'trainer.lbph')
+        build_gallery(faces_dir, num_groups * USERS_PER_GROUP, num_groups)
+        with contextlib.redirect_stdout(io.StringIO()):
+            FaceTrainer(faces_dir, model_file).train_face_recognizer()
+        shards_dir = shard_dir(model_file)
+
+        full_model = load_model(model_file)
+        normalizer = LBPHMatcher(full_model).normalizer
+        faces, _ = load_samples()
+        queries = [normalizer.normalize(face) for face in faces[:QUERIES]]
+
+        print(f"{num_groups} groups of {USERS_PER_GROUP} users, {len(full_model)} enrolled faces")
+        print(f"{'Gallery':<22} {'Faces':>7} {'First match (s)':>16} {'ms/face':>9}")
+        full_first, full_ms = time_search(lambda: LBPHMatcher(load_model(model_file)), queries)
+        print(f"{'full model':<22} {len(full_model):>7} {full_first:>16.3f} {full_ms:>9.2f}")
+        shard_size = len(load_model(os.path.join(shards_dir, 'group0.lbph')))
+        shard_first, shard_ms = time_search(lambda: ShardedGallery(ShardCache(shards_dir), ['group0']), queries)
+        print(f"{'shard of group0':<22} {shard_size:>7} {shard_first:>16.3f} {shard_ms:>9.2f}")
+
+        # Cameras of three groups take turns, with room for two shards
+        shard_mb = 2 * shard_size * full_model.hist_size * 4 / 1024 / 1024
+        cache = ShardCache(shards_dir, memory_limit_mb=2.5 * shard_mb)
+        galleries = [ShardedGallery(cache, [f'group{g}']) for g in range(3)]
+        for _ in range(5):
+            for gallery in galleries:
+                gallery.match(queries[:1])
+        print(f"\n3 cameras of different groups, memory limit {2.5 * shard_mb:.1f} MB "
+              f"({shard_mb:.1f} MB per shard), 5 rounds: {cache.loads} loads, {cache.evictions} evictions")
+
+        cache = ShardCache(shards_dir, memory_limit_mb=3.5 * shard_mb)
+        galleries = [ShardedGallery(cache, [f'group{g}']) for g in range(3)]
+        for _ in range(5):
+            for gallery in galleries:
+                gallery.match(queries[:1])
+        print(f"Same with room for three shards: {cache.loads} loads, {cache.evictions} evictions")
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == "__main__":
+    run(*[int(n) for n in sys.argv[1:2]])
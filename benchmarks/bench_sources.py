@@ -0,0 +1,94 @@
+"""Measure per-source frame rates and memory of one attendance process watching several sources.
+
+Run from the repository root:
+    python -m benchmarks.bench_sources [seconds per run]
+
+Each run starts a fresh process running the attendance pipeline on
+synthetic cameras that deliver frames at a fixed rate, optionally with a
+video file that delivers frames as fast as they are taken. The memory of
+one process watching N cameras is compared with N single-camera processes,
+each of which loads its own copy of OpenCV, NumPy and the model.
+"""
+import contextlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from benchmarks.common import SyntheticCapture, build_gallery, load_samples, sample_users, synthetic_frame
+from face.matcher import LBPHMatcher
+from face.model_store import load_model
+from face.pipeline import AttendancePipeline, VideoSource
+from face.trainer import FaceTrainer
+
+CAMERA_FPS = 15
+NUM_CAMERAS = [1, 2, 4]
+GALLERY_COPIES = 20
+DURATION = 10
+SEED = 0
+
+def run_worker(model_file, num_cameras, with_file, duration):
+    """Run the pipeline in this process and print its statistics as JSON"""
+    rng = np.random.default_rng(SEED)
+    faces, _ = load_samples()
+    frames = [synthetic_frame(faces, 2, rng) for _ in range(10)]
+
+    sources = [VideoSource(f'camera-{i}', SyntheticCapture(frames, CAMERA_FPS, duration), drop_frames=True)
+               for i in range(num_cameras)]
+    if with_file:
+        sources.append(VideoSource('video-file', SyntheticCapture(frames, 0, duration), drop_frames=False))
+
+    pipeline = AttendancePipeline(sources, LBPHMatcher(load_model(model_file)))
+    start = time.monotonic()
+    pipeline.start()
+    while pipeline.read() is not None:
+        pass
+    elapsed = time.monotonic() - start
+    pipeline.stop()
+
+    print(json.dumps({
+        'fps': {source.name: source.frames_processed / elapsed for source in sources},
+        'dropped': {source.name: source.frames_dropped for source in sources},
+        # Kilobytes on Linux
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+
+def measure(model_file, num_cameras, with_file, duration):
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_sources', '--worker', model_file,
+                             str(num_cameras), str(int(with_file)), str(duration)],
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def run(duration=DURATION):
+    with tempfile.TemporaryDirectory() as work_dir:
+        faces_dir = os.path.join(work_dir, 'faces')
+        model_file = os.path.join(work_dir, 'trainer.lbph')
+        build_gallery(faces_dir, GALLERY_COPIES * len(sample_users()))
+        with contextlib.redirect_stdout(io.StringIO()):
+            FaceTrainer(faces_dir, model_file).train_face_recognizer()
+        print(f"Cameras at {CAMERA_FPS} fps with 2 faces per frame, {duration}s per run, "
+              f"{len(load_model(model_file).labels)} enrolled faces")
+
+        single = measure(model_file, 1, False, duration)
+        print(f"{'Sources':<22} {'FPS per camera':>24} {'File FPS':>9} {'Dropped':>8} "
+              f"{'Memory MB':>10} {'Separate processes MB':>22}")
+        for num_cameras in NUM_CAMERAS:
+            for with_file in (False, True):
+                result = measure(model_file, num_cameras, with_file, duration)
+                camera_fps = [fps for name, fps in result['fps'].items() if name != 'video-file']
+                file_fps = f"{result['fps']['video-file']:.1f}" if with_file else '-'
+                separate = single['max_rss_mb'] * (num_cameras + with_file)
+                name = f"{num_cameras} camera{'s' if num_cameras > 1 else ''}" + (" + file" if with_file else "")
+                print(f"{name:<22} {' '.join(f'{fps:.1f}' for fps in camera_fps):>24} "
+                      f"{file_fps:>9} {sum(result['dropped'].values()):>8} "
+                      f"{result['max_rss_mb']:>10.1f} {separate:>22.1f}")
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['--worker']:
+        run_worker(sys.argv[2], int(sys.argv[3]), bool(int(sys.argv[4])), float(sys.argv[5]))
+    else:
+        run(*[float(n) for n in sys.argv[1:2]])
@@ -0,0 +1,142 @@
+"""Measure menu start-up and time to the first recognition, cold and warm.
+
+Run from the repository root:
+    python -m benchmarks.bench_startup [number of runs]
+
+Every run is a fresh process working in a temporary directory with a model
+trained from the bundled sample faces. Time to first recognition is
+measured from choosing attendance to the first frame in which a synthetic
+camera's face is recognized. It covers creating the recognizer where the
+menu does so at that point, starting the pipeline, detection and matching,
+but not opening a real camera or the database. The menu used to create a
+new recognizer for every session; now it keeps one, loaded and warmed in
+the background while the menu waits for input.
+"""
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CAMERA_FPS = 30
+GALLERY_COPIES = 20
+RUNS = 3
+SEED = 0
+# Camera frames showing an enrolled user, written to the work directory for the workers
+FRAMES_FILE = 'frames.npz'
+
+def time_import(module):
+    start = time.perf_counter()
+    __import__(module)
+    return time.perf_counter() - start
+
+def time_session(recognizer, frames, user_id):
+    """Seconds from starting a session to the first frame in which user_id is recognized"""
+    from benchmarks.common import SyntheticCapture
+    from face.pipeline import AttendancePipeline, VideoSource
+
+    start = time.perf_counter()
+    recognizer.refresh_model()
+    source = VideoSource('camera', SyntheticCapture(frames, CAMERA_FPS, 10), drop_frames=True)
+    pipeline = AttendancePipeline([source], recognizer.matcher, detector_pool=recognizer.detectors)
+    pipeline.start()
+    elapsed = None
+    while elapsed is None:
+        result = pipeline.read()
+        if result is None:
+            break
+        if any(track.committed and track.identity == user_id for track in result[3]):
+            elapsed = time.perf_counter() - start
+    pipeline.stop()
+    return elapsed
+
+def run_worker(mode):
+    """Measure in this process, working in the current directory, and print the results as JSON"""
+    if mode in ('menu', 'menu-eager'):
+        seconds = time_import('ui.menu')
+        if mode == 'menu-eager':
+            # What the menu imported before its face imports were made lazy
+            seconds += time_import('face.recognizer') + time_import('face.trainer')
+        print(json.dumps({'import': seconds}))
+        return
+
+    start = time.perf_counter()
+    import numpy as np
+    from face.recognizer import FaceRecognizer
+    imports = time.perf_counter() - start
+
+    with np.load(FRAMES_FILE) as data:
+        frames = list(data['frames'])
+        user_id = int(data['user_id'])
+
+    results = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        # The previous menu: a new recognizer for every session
+        start = time.perf_counter()
+        recognizer = FaceRecognizer()
+        results['cold first'] = imports + time.perf_counter() - start + time_session(recognizer, frames, user_id)
+        start = time.perf_counter()
+        recognizer = FaceRecognizer()
+        results['cold later'] = time.perf_counter() - start + time_session(recognizer, frames, user_id)
+
+        # The menu now: one recognizer, warmed before attendance is chosen
+        recognizer = FaceRecognizer()
+        recognizer.warm()
+        results['warm first'] = time_session(recognizer, frames, user_id)
+        results['warm later'] = time_session(recognizer, frames, user_id)
+    print(json.dumps(results))
+
+def measure(work_dir, mode):
+    env = dict(os.environ, PYTHONPATH=REPO_DIR)
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_startup', '--worker', mode],
+                            cwd=work_dir, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def run(runs=RUNS):
+    import numpy as np
+    from benchmarks.common import FIRST_USER_ID, build_gallery, load_samples, sample_users, synthetic_frame
+    from face.model_store import load_model
+    from face.trainer import FaceTrainer
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        # The relative paths of the configuration resolve inside the work directory
+        faces_dir = os.path.join(work_dir, 'faces')
+        model_file = os.path.join(work_dir, 'trainer.lbph')
+        build_gallery(faces_dir, GALLERY_COPIES * len(sample_users()))
+        with contextlib.redirect_stdout(io.StringIO()):
+            FaceTrainer(faces_dir, model_file).train_face_recognizer()
+
+        # build_gallery enrolls the first sample user as FIRST_USER_ID
+        faces, ids = load_samples()
+        rng = np.random.default_rng(SEED)
+        frames = [synthetic_frame([face for face, label in zip(faces, ids) if label == ids[0]], 1, rng)
+                  for _ in range(10)]
+        np.savez(os.path.join(work_dir, FRAMES_FILE), frames=np.array(frames), user_id=FIRST_USER_ID)
+        print(f"{len(load_model(model_file))} enrolled faces, camera at {CAMERA_FPS} fps, median of {runs} runs")
+
+        eager = median([measure(work_dir, 'menu-eager')['import'] for _ in range(runs)])
+        lazy = median([measure(work_dir, 'menu')['import'] for _ in range(runs)])
+        print(f"\nImporting the menu: {eager * 1000:.0f} ms with eager face imports, "
+              f"{lazy * 1000:.0f} ms with lazy ones")
+
+        sessions = [measure(work_dir, 'sessions') for _ in range(runs)]
+        print(f"\n{'Time to first recognition':<44} {'ms':>7}")
+        for key, label in (('cold first', "new recognizer, first session (cold process)"),
+                           ('cold later', "new recognizer, later session"),
+                           ('warm first', "preloaded recognizer, first session"),
+                           ('warm later', "reused recognizer, later session")):
+            print(f"{label:<44} {median([result[key] for result in sessions]) * 1000:>7.0f}")
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['--worker']:
+        run_worker(sys.argv[2])
+    else:
+        run(*[int(n) for n in sys.argv[1:2]])
@@ -0,0 +1,198 @@
+"""Time the detection, training, recognition and database paths and save the results.
+
+Run from the repository root:
+    python -m benchmarks.bench_suite [--output results.json] [--compare previous.json]
+
+Every benchmark uses the bundled sample faces and synthetic frames built
+from them with a fixed seed, so runs on different commits measure the same
+work. The database benchmarks use a temporary SQLite file. Results are
+written as JSON with the commit and library versions they were measured on.
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import cv2
+import numpy as np
+import db.database
+from benchmarks.common import FACE_SIZE, build_gallery, load_samples, sample_users, synthetic_frame
+from db.models import (add_user, get_user_name, record_attendance, get_attendance_records,
+                       get_attendance_since)
+from face.detector import FaceDetector
+from face.matcher import LBPHMatcher
+from face.model_store import load_model
+from face.trainer import FaceTrainer
+
+FACES_PER_FRAME = [1, 2, 4]
+NUM_FRAMES = 10
+# Passes over the frames and faces for every timing
+ROUNDS = 3
+GALLERY_COPIES = 5
+NUM_DB_USERS = 200
+SEED = 0
+
+def measure(func, repeats, warmup=1):
+    """Call func repeatedly and return summary statistics of its duration in milliseconds"""
+    for _ in range(warmup):
+        func()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    times = np.array(times)
+    return {
+        'unit': 'ms',
+        'repeats': repeats,
+        'mean': round(float(times.mean()), 4),
+        'median': round(float(np.median(times)), 4),
+        'min': round(float(times.min()), 4),
+        'p95': round(float(np.percentile(times, 95)), 4),
+    }
+
+def bench_detection(results, frames_by_count):
+    detector = FaceDetector()
+    for num_faces, frames in frames_by_count.items():
+        found = sum(len(detector.detect_faces(frame)[1]) for frame in frames)
+        print(f"  detect_faces, {num_faces} faces/frame: {found}/{num_faces * len(frames)} faces found")
+        frame_iter = iter(frames * 1000)
+        results[f'detect_faces/{num_faces}_faces'] = measure(
+            lambda: detector.detect_faces(next(frame_iter)), ROUNDS * len(frames))
+
+def bench_training(results, work_dir):
+    faces_dir = os.path.join(work_dir, 'faces')
+    model_file = os.path.join(work_dir, 'trainer.lbph')
+    build_gallery(faces_dir, GALLERY_COPIES * len(sample_users()))
+    trainer = FaceTrainer(faces_dir, model_file)
+
+    def train_cold():
+        # Without the training cache every image is decoded again
+        if os.path.exists(trainer.cache_file):
+            os.remove(trainer.cache_file)
+        trainer.train_face_recognizer(force=True)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        results['train_face_recognizer'] = measure(train_cold, 3)
+        results['train_face_recognizer/unchanged'] = measure(trainer.train_face_recognizer, 3)
+    return model_file
+
+def bench_recognition(results, model_file, faces, frames_by_count, rng):
+    matcher = LBPHMatcher(load_model(model_file))
+    detector = FaceDetector()
+    queries = [cv2.resize(faces[i], (FACE_SIZE, FACE_SIZE)) for i in rng.integers(0, len(faces), 20)]
+    query_iter = iter(queries * 1000)
+    results['recognize/per_face'] = measure(lambda: matcher.predict(matcher.normalizer.normalize(next(query_iter))),
+                                        ROUNDS * len(queries))
+
+    for num_faces, frames in frames_by_count.items():
+        detections = [detector.detect_faces(frame) for frame in frames]
+        crops = [matcher.normalizer.crop(gray, faces_found) for gray, faces_found in detections]
+        crop_iter = iter(crops * 1000)
+        results[f'recognize/per_frame/{num_faces}_faces'] = measure(
+            lambda: matcher.match(next(crop_iter)), ROUNDS * len(frames))
+
+        def detect_and_match(frame_iter=iter(frames * 1000)):
+            gray, faces_found = detector.detect_faces(next(frame_iter))
+            matcher.match(matcher.normalizer.crop(gray, faces_found))
+        results[f'frame_end_to_end/{num_faces}_faces'] = measure(detect_and_match, ROUNDS * len(frames))
+
+def bench_database(results, work_dir):
+    db.database.configure('sqlite', os.path.join(work_dir, 'bench.db'))
+    try:
+        db.database.initialize_database()
+        today = datetime.datetime.now().strftime("%Y-%m-%d")
+        user_ids = iter(str(200000 + i) for i in range(NUM_DB_USERS * 2))
+        added = []
+
+        def add():
+            user_id = next(user_ids)
+            add_user(f"User {user_id}", user_id)
+            added.append(user_id)
+
+        def record(users=iter(added)):
+            record_attendance(next(users))
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            results['db/add_user'] = measure(add, NUM_DB_USERS)
+            results['db/get_user_name'] = measure(lambda: get_user_name(added[len(added) // 2]), NUM_DB_USERS)
+            results['db/record_attendance'] = measure(record, NUM_DB_USERS - 1)
+            results['db/record_attendance_duplicate'] = measure(lambda: record_attendance(added[0]), 50)
+            results['db/get_attendance_records'] = measure(lambda: get_attendance_records(today), 50)
+            results['db/get_attendance_since'] = measure(lambda: get_attendance_since(today), 50)
+    finally:
+        db.database.reset_pool()
+
+def environment():
+    """Describe what the results were measured on"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'seed': SEED,
+    }
+
+def compare(results, previous_file):
+    """Print the change of every median against a previous results file"""
+    with open(previous_file) as f:
+        previous = json.load(f)
+    print(f"\nCompared with {previous['environment'].get('commit') or previous_file}:")
+    print(f"{'Benchmark':<40} {'Before (ms)':>12} {'After (ms)':>12} {'Change':>8}")
+    for name, stats in results.items():
+        before = previous['results'].get(name)
+        if before:
+            change = (stats['median'] - before['median']) / before['median'] * 100
+            print(f"{name:<40} {before['median']:>12.3f} {stats['median']:>12.3f} {change:>+7.1f}%")
+
+def run(output='bench_results.json', previous_file=None):
+    rng = np.random.default_rng(SEED)
+    faces, _ = load_samples()
+    frames_by_count = {n: [synthetic_frame(faces, n, rng) for _ in range(NUM_FRAMES)]
+                       for n in FACES_PER_FRAME}
+
+    results = {}
+    work_dir = tempfile.mkdtemp()
+    try:
+        print("Detection...")
+        bench_detection(results, frames_by_count)
+        print("Training...")
+        model_file = bench_training(results, work_dir)
+        print("Recognition...")
+        bench_recognition(results, model_file, faces, frames_by_count, rng)
+        print("Database...")
+        bench_database(results, work_dir)
+    finally:
+        shutil.rmtree(work_dir)
+
+    print(f"\n{'Benchmark':<40} {'Median (ms)':>12} {'p95 (ms)':>10}")
+    for name, stats in results.items():
+        print(f"{name:<40} {stats['median']:>12.3f} {stats['p95']:>10.3f}")
+
+    with open(output, 'w') as f:
+        json.dump({'environment': environment(), 'results': results}, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if previous_file:
+        compare(results, previous_file)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the benchmark suite")
+    parser.add_argument('--output', default='bench_results.json', help="JSON file for the results")
+    parser.add_argument('--compare', help="results file of an earlier run to compare with")
+    args = parser.parse_args()
+    run(args.output, args.compare)
@@ -0,0 +1,93 @@
+"""Measure local attendance writes and syncing a backlog after a database outage.
+
+Run from the repository root:
+    python -m benchmarks.bench_sync [number of users]
+
+The attendance database is a temporary SQLite file, so the direct inserts
+measured here have no network round trip; against PostgreSQL the gap is
+larger. The outage is simulated by pointing the database at a directory
+that does not exist.
+"""
+import contextlib
+import datetime
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import db.database
+from db.attendance_writer import insert_attendance
+from db.database import db_cursor, initialize_database
+from db.local_buffer import LocalAttendanceBuffer, AttendanceSyncer, PENDING
+from db.models import add_users
+
+NUM_USERS = 2000
+DAYS = 5
+LATENCY_EVENTS = 500
+
+def events(num_users, day):
+    date = (datetime.date(2024, 3, 4) + datetime.timedelta(days=day)).isoformat()
+    return [(str(100000 + i), date, f"08:{i // 60 % 60:02d}:{i % 60:02d}", None) for i in range(num_users)]
+
+def per_event_us(write, batch):
+    """Median microseconds to write one event at a time"""
+    times = []
+    for event in batch:
+        start = time.perf_counter()
+        write([event])
+        times.append((time.perf_counter() - start) * 1e6)
+    return float(np.median(times))
+
+def central_count():
+    with db_cursor() as cursor:
+        cursor.execute('SELECT COUNT(*) FROM attendance')
+        return cursor.fetchone()[0]
+
+def run(num_users=NUM_USERS):
+    work_dir = tempfile.mkdtemp()
+    central_file = os.path.join(work_dir, 'central.db')
+    buffer_file = os.path.join(work_dir, 'buffer.db')
+    try:
+        db.database.configure('sqlite', central_file)
+        initialize_database()
+        add_users([(f"User {100000 + i}", str(100000 + i)) for i in range(num_users)])
+
+        buffer = LocalAttendanceBuffer(buffer_file)
+        local_us = per_event_us(buffer.append, events(LATENCY_EVENTS, 100))
+        direct_us = per_event_us(insert_attendance, events(LATENCY_EVENTS, 101))
+        print(f"Writing one event: {local_us:.0f} us to the local buffer, "
+              f"{direct_us:.0f} us straight to the database")
+
+        # The database goes away while the kiosks keep recording
+        db.database.configure('sqlite', os.path.join(work_dir, 'unreachable', 'central.db'))
+        syncer = AttendanceSyncer(buffer_file)
+        for day in range(DAYS):
+            buffer.append(events(num_users, day))
+        with contextlib.redirect_stdout(io.StringIO()):
+            reachable = syncer.sync()
+        print(f"\nDuring the outage: sync {'succeeded' if reachable else 'failed'}, "
+              f"backlog {syncer.backlog} events, oldest {syncer.lag:.1f} s old")
+
+        db.database.configure('sqlite', central_file)
+        start = time.perf_counter()
+        syncer.sync()
+        elapsed = time.perf_counter() - start
+        print(f"After the outage: {syncer.synced} events synced in {elapsed:.2f} s "
+              f"({syncer.synced / elapsed:.0f} events/s), backlog {syncer.backlog}, "
+              f"{central_count()} rows in the database")
+
+        # A batch sent again, as after a crash before it was marked, changes nothing
+        with buffer._conn:
+            buffer._conn.execute('UPDATE attendance SET synced = ?', (PENDING,))
+        syncer.sync()
+        print(f"All events sent again: {central_count()} rows in the database")
+        syncer.stop(final_sync=False)
+        buffer.close()
+    finally:
+        db.database.reset_pool()
+        shutil.rmtree(work_dir)
+
+if __name__ == "__main__":
+    run(*[int(n) for n in sys.argv[1:2]])
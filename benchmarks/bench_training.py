@@ -0,0 +1,53 @@
+"""Time training without the cache, after one user changes, and with nothing changed.
+
+Run from the repository root:
+    python -m benchmarks.bench_training [number of users ...]
+"""
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+from benchmarks.common import FIRST_USER_ID, build_gallery
+from face.trainer import FaceTrainer
+
+GALLERY_SIZES = [10, 40]
+
+def timed_train(trainer, force=False):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        trainer.train_face_recognizer(force)
+    return time.perf_counter() - start
+
+def run(gallery_sizes=GALLERY_SIZES):
+    """Compare a cold training run with cached retraining for each gallery size"""
+    print(f"{'Users':>6} {'Serial, no cache (s)':>21} {'Parallel, no cache (s)':>23} "
+          f"{'One user changed (s)':>21} {'Unchanged (s)':>14}")
+    for num_users in gallery_sizes:
+        work_dir = tempfile.mkdtemp()
+        try:
+            faces_dir = os.path.join(work_dir, 'faces')
+            model_file = os.path.join(work_dir, 'trainer.lbph')
+            build_gallery(faces_dir, num_users)
+
+            serial_time = timed_train(FaceTrainer(faces_dir, model_file, workers=1), force=True)
+            os.remove(model_file + '.cache')
+            trainer = FaceTrainer(faces_dir, model_file)
+            cold_time = timed_train(trainer, force=True)
+
+            # Replace one user's images so only they are decoded again
+            changed_dir = os.path.join(faces_dir, str(FIRST_USER_ID))
+            shutil.rmtree(changed_dir)
+            shutil.copytree(os.path.join(faces_dir, str(100001)), changed_dir)
+            changed_time = timed_train(trainer)
+
+            unchanged_time = timed_train(trainer)
+            print(f"{num_users:>6} {serial_time:>21.3f} {cold_time:>23.3f} "
+                  f"{changed_time:>21.3f} {unchanged_time:>14.3f}")
+        finally:
+            shutil.rmtree(work_dir)
+
+if __name__ == "__main__":
+    run([int(n) for n in sys.argv[1:]] or GALLERY_SIZES)
@@ -0,0 +1,78 @@
+"""Sample data and synthetic inputs shared by the benchmarks.
+
+Paths are relative to the repository root, which the benchmarks are run from.
+"""
+import glob
+import os
+import shutil
+import time
+import cv2
+import numpy as np
+from PIL import Image
+
+SAMPLE_FACES_DIR = os.path.join('testing', 'faces')
+# Size of synthetic frames and of the faces pasted into them
+FRAME_SIZE = (480, 640)
+FACE_SIZE = 150
+# ID of the first user of a synthetic gallery
+FIRST_USER_ID = 100000
+
+def sample_users():
+    """IDs of the bundled sample users, as their directory names, sorted"""
+    return sorted(os.listdir(SAMPLE_FACES_DIR))
+
+def load_samples():
+    """Load the bundled sample faces with their user IDs"""
+    faces = []
+    ids = []
+    for img_path in sorted(glob.glob(os.path.join(SAMPLE_FACES_DIR, '*', '*.jpg'))):
+        faces.append(np.array(Image.open(img_path).convert('L'), 'uint8'))
+        ids.append(int(os.path.basename(os.path.dirname(img_path))))
+    return faces, ids
+
+def build_gallery(faces_dir, num_users, num_groups=0):
+    """Create a synthetic gallery by cycling through the sample users, with IDs from FIRST_USER_ID
+
+    With num_groups, the users are split evenly into faces_dir/group<g>/
+    directories, each of which starts again from the first sample user.
+    """
+    users = sample_users()
+    users_per_group = num_users // num_groups if num_groups else num_users
+    for i in range(num_users):
+        src = os.path.join(SAMPLE_FACES_DIR, users[i % users_per_group % len(users)])
+        parent = os.path.join(faces_dir, f'group{i // users_per_group}') if num_groups else faces_dir
+        shutil.copytree(src, os.path.join(parent, str(FIRST_USER_ID + i)))
+
+def synthetic_frame(faces, num_faces, rng):
+    """Paste sample faces side by side on a noisy background"""
+    frame = rng.integers(90, 150, FRAME_SIZE, dtype=np.uint8)
+    frame = cv2.GaussianBlur(frame, (9, 9), 0)
+    gap = (FRAME_SIZE[1] - num_faces * FACE_SIZE) // (num_faces + 1)
+    for i in range(num_faces):
+        face = cv2.resize(faces[rng.integers(len(faces))], (FACE_SIZE, FACE_SIZE))
+        x = gap + i * (FACE_SIZE + gap)
+        y = (FRAME_SIZE[0] - FACE_SIZE) // 2
+        frame[y:y+FACE_SIZE, x:x+FACE_SIZE] = face
+    return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+
+class SyntheticCapture:
+    """Stand-in for cv2.VideoCapture delivering synthetic frames, at a fixed rate if fps is set"""
+    def __init__(self, frames, fps, duration):
+        self.frames = frames
+        self.interval = 1 / fps if fps else 0
+        self.end = time.monotonic() + duration
+        self.count = 0
+
+    def isOpened(self):
+        return True
+
+    def read(self):
+        if time.monotonic() >= self.end:
+            return False, None
+        if self.interval:
+            time.sleep(self.interval)
+        self.count += 1
+        return True, self.frames[self.count % len(self.frames)].copy()
+
+    def release(self):
+        pass
@@ -7,6 +7,156 @@ DB_CONFIG = {
     'password': 'admin' 
 }
 
+# Database backend: 'postgresql', or 'sqlite' as a local stand-in
+DB_BACKEND = 'postgresql'
+SQLITE_FILE = 'attendance.db'
+
+# Connection pool: maximum open connections, seconds to wait for a free one,
+# and seconds a connection may sit idle before it is health-checked
+DB_POOL_MAX_SIZE = 4
+DB_POOL_TIMEOUT = 5
+DB_POOL_CHECK_INTERVAL = 30
+
 # Paths
 FACES_DIR = 'faces'
-TRAINER_FILE = 'trainer.yml'
\ No newline at end of file
+TRAINER_FILE = 'trainer.yml'
+MODEL_FILE = 'trainer.lbph'
+INDEX_FILE = 'trainer.lbph.index'
+
+# Background attendance writer: seconds between flushes, maximum rows per
+# INSERT, and whether queued events are written before shutting down
+ATTENDANCE_FLUSH_INTERVAL = 1.0
+ATTENDANCE_BATCH_SIZE = 500
+ATTENDANCE_FLUSH_ON_SHUTDOWN = True
+
+# Seconds between refreshes of the in-memory users and attendance during recognition
+ROSTER_REFRESH_INTERVAL = 60
+
+# Gallery search index, used instead of exact search once the gallery is large
+GALLERY_INDEX_ENABLED = False
+GALLERY_INDEX_MIN_SAMPLES = 5000
+GALLERY_INDEX_DIMENSIONS = 64
+GALLERY_INDEX_PROBES = 8
+GALLERY_INDEX_CANDIDATES = 10
+
+# Face tracking: minimum box overlap to continue a track, frames a track
+# survives without a detection, frames between re-checks of a recognized
+# track, and how many of the last TRACK_VOTE_WINDOW predictions must agree
+# before a track's identity is trusted
+TRACK_IOU_THRESHOLD = 0.3
+TRACK_MAX_MISSED = 10
+TRACK_REFRESH_FRAMES = 30
+TRACK_VOTE_WINDOW = 5
+TRACK_MIN_VOTES = 3
+
+# Attendance pipeline: threads running face detection and recognition, and
+# how many items each stage queue holds before frames are dropped
+PIPELINE_DETECT_WORKERS = 2
+PIPELINE_RECOGNIZE_WORKERS = 2
+PIPELINE_QUEUE_SIZE = 4
+
+# LBPH distance below which a face is accepted as a known user (lower is better)
+RECOGNITION_THRESHOLD = 70
+
+# Recognition loop metrics: served in the Prometheus text format at
+# http://METRICS_HOST:METRICS_PORT/metrics and printed every
+# METRICS_LOG_INTERVAL seconds (0 turns either off)
+METRICS_ENABLED = False
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9108
+METRICS_LOG_INTERVAL = 60
+
+# Threads decoding new or changed face images during training
+TRAINING_WORKERS = 4
+
+# Face detection: frames wider than DETECTION_MAX_WIDTH pixels are
+# downscaled before detection (0 keeps full resolution); faces smaller or
+# larger than the given sizes in pixels are ignored (0 means no limit).
+# With DETECTION_FULL_SCAN_INTERVAL above 1, frames between full scans are
+# only searched around the previous faces, widened by DETECTION_ROI_MARGIN
+# times the face size on every side
+DETECTION_MAX_WIDTH = 640
+DETECTION_MIN_FACE_SIZE = 0
+DETECTION_MAX_FACE_SIZE = 0
+DETECTION_FULL_SCAN_INTERVAL = 1
+DETECTION_ROI_MARGIN = 0.5
+
+# Face detector backend: 'haar' (the bundled Haar cascade, or the cascade in
+# DETECTOR_MODEL_FILE), 'lbp' (an LBP cascade XML file) or 'dnn' (a YuNet
+# ONNX model file). DNN detections scoring below DETECTOR_SCORE_THRESHOLD
+# are ignored
+DETECTOR_BACKEND = 'haar'
+DETECTOR_MODEL_FILE = ''
+DETECTOR_SCORE_THRESHOLD = 0.8
+
+# Face normalization applied to every crop before saving, training and
+# recognition: resize to FACE_SIZE x FACE_SIZE pixels, equalize the
+# histogram, and rotate so the eyes are level
+FACE_SIZE = 100
+FACE_EQUALIZE = True
+FACE_ALIGN = False
+
+# Video sources watched by attendance: camera device indices, video files or
+# stream URLs (rtsp://, http://). All sources share one model and one writer;
+# frames from cameras and streams are dropped when processing falls behind,
+# video files are processed frame by frame
+VIDEO_SOURCES = [0]
+
+# Gallery shards: users saved under faces/<group>/<user_id>/ are trained into
+# one shard per group. GALLERY_GROUPS lists the groups this kiosk recognizes
+# (empty for all of them) and SOURCE_GROUPS overrides it for single entries
+# of VIDEO_SOURCES, e.g. {0: ['engineering']}. Shards are loaded when first
+# needed and the least recently used are closed above SHARD_MEMORY_LIMIT_MB
+GALLERY_GROUPS = []
+SOURCE_GROUPS = {}
+SHARD_MEMORY_LIMIT_MB = 256
+
+# Attendance reports: rows fetched from the database at a time when
+# streaming a report or CSV export
+REPORT_BATCH_SIZE = 1000
+
+# Bulk enrollment: users inserted per statement
+USER_BATCH_SIZE = 1000
+
+# Offline-first attendance: events are written to a local SQLite store in
+# WAL mode and a background syncer sends them to the database every
+# SYNC_INTERVAL seconds, up to SYNC_BATCH_SIZE per INSERT. Events that
+# have been synced are deleted from the local store after
+# LOCAL_BUFFER_RETENTION_DAYS days
+LOCAL_BUFFER_ENABLED = True
+LOCAL_BUFFER_FILE = 'attendance_buffer.db'
+SYNC_INTERVAL = 2.0
+SYNC_BATCH_SIZE = 5000
+LOCAL_BUFFER_RETENTION_DAYS = 7
+
+# Recognition service (python service.py): address it listens on, threads
+# decoding and detecting uploads, and micro-batching of the faces of
+# concurrent requests: a batch is matched once SERVICE_MAX_BATCH faces are
+# waiting or SERVICE_MAX_WAIT_MS after its first request, whichever is first
+SERVICE_HOST = '127.0.0.1'
+SERVICE_PORT = 8080
+SERVICE_WORKERS = 4
+SERVICE_MAX_BATCH = 32
+SERVICE_MAX_WAIT_MS = 2
+SERVICE_MAX_UPLOAD_MB = 8
+
+# Hot model reload: running recognizers check the version stamp of the
+# published model every MODEL_RELOAD_INTERVAL seconds and swap a new
+# version in on a background thread
+MODEL_RELOAD_ENABLED = True
+MODEL_RELOAD_INTERVAL = 2.0
+
+# Face capture: CAPTURE_SAMPLES faces are kept per user. A face is rejected
+# when its sharpness (variance of the Laplacian of the face resized to 100
+# pixels and equalized) is below CAPTURE_MIN_SHARPNESS, when its eyes are not
+# found, off-center by more than CAPTURE_MAX_EYE_OFFSET of the face width
+# (head turned) or tilted by more than CAPTURE_MAX_EYE_TILT degrees, or when
+# its 256-bit difference hash is within CAPTURE_DUPLICATE_DISTANCE bits of a
+# face already kept. Compacting saved faces keeps at least
+# CAPTURE_MIN_SAMPLES per user even if fewer pass
+CAPTURE_SAMPLES = 20
+CAPTURE_MIN_SAMPLES = 5
+CAPTURE_MIN_SHARPNESS = 500
+CAPTURE_MAX_EYE_OFFSET = 0.07
+CAPTURE_MAX_EYE_TILT = 20
+CAPTURE_DUPLICATE_DISTANCE = 20
\ No newline at end of file
@@ -0,0 +1,155 @@
+import datetime
+import queue
+import sqlite3
+import threading
+import time
+import psycopg2
+from config.db_config import (ATTENDANCE_FLUSH_INTERVAL, ATTENDANCE_BATCH_SIZE,
+                              ATTENDANCE_FLUSH_ON_SHUTDOWN)
+from db.database import db_cursor, DatabaseUnavailable
+from utils.metrics import metrics
+
+# Errors after which a batch is kept and retried at the next flush
+RETRYABLE_ERRORS = (DatabaseUnavailable, psycopg2.OperationalError, psycopg2.InterfaceError)
+# SQLite raises OperationalError for missing tables and read-only files too; only these pass
+SQLITE_RETRYABLE_MESSAGES = ('locked', 'busy', 'unable to open')
+
+def is_retryable(error):
+    """Whether a failed write may succeed later, because the database was unreachable or busy"""
+    if isinstance(error, sqlite3.OperationalError):
+        message = str(error).lower()
+        return any(text in message for text in SQLITE_RETRYABLE_MESSAGES)
+    return isinstance(error, RETRYABLE_ERRORS)
+
+def insert_attendance(batch):
+    """Insert (user_id, date, time, name) events in one statement, returning the new (user_id, date) pairs
+
+    Events already in the database are skipped, so a batch can safely be sent again.
+    """
+    placeholders = ', '.join(['(%s, %s, %s)'] * len(batch))
+    params = [value for user_id, date, time_of_day, _ in batch for value in (user_id, date, time_of_day)]
+    with db_cursor() as cursor:
+        cursor.execute(f'''
+        INSERT INTO attendance (user_id, date, time) VALUES {placeholders}
+        ON CONFLICT (user_id, date) DO NOTHING
+        RETURNING user_id, date
+        ''', params)
+        return {(user_id, str(date)) for user_id, date in cursor.fetchall()}
+
+class AttendanceWriter:
+    """Background writer that records attendance in batches
+
+    The recognition loop submits events and returns immediately. A worker
+    thread collects them for up to flush_interval seconds or batch_size
+    events, keeps the earliest event per user and day, and inserts them with
+    one multi-row INSERT ... ON CONFLICT DO NOTHING. Batches that fail
+    because the database is unreachable are retried at the next flush.
+
+    Given a LocalAttendanceBuffer, events are written to that local store
+    instead, and an AttendanceSyncer sends them on to the database.
+    """
+    def __init__(self, flush_interval=ATTENDANCE_FLUSH_INTERVAL, batch_size=ATTENDANCE_BATCH_SIZE,
+                 flush_on_shutdown=ATTENDANCE_FLUSH_ON_SHUTDOWN, buffer=None):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.flush_on_shutdown = flush_on_shutdown
+        self.buffer = buffer
+        self._queue = queue.Queue()
+        self._pending = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the writer thread"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='attendance-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, user_id, name=None, timestamp=None):
+        """Queue an attendance event without waiting for the database"""
+        timestamp = timestamp or datetime.datetime.now()
+        self._queue.put((user_id, timestamp.strftime("%Y-%m-%d"), timestamp.strftime("%H:%M:%S"), name))
+
+    def stop(self):
+        """Stop the writer thread, flushing queued events first if configured to"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+        if self.flush_on_shutdown:
+            self._drain()
+            while self._pending:
+                if not self.flush():
+                    break
+        if self._pending or not self._queue.empty():
+            print(f"{len(self._pending) + self._queue.qsize()} attendance events were not saved")
+
+    def pending_count(self):
+        """Number of events waiting to be written"""
+        return len(self._pending) + self._queue.qsize()
+
+    def _run(self):
+        while not self._stop.is_set():
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._pending) < self.batch_size and not self._stop.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    self._add(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._drain()
+            if self._pending and not self._stop.is_set() and not self.flush():
+                # Wait before trying an unreachable database again
+                self._stop.wait(self.flush_interval)
+
+    def _drain(self):
+        """Move every queued event into the pending batch"""
+        while True:
+            try:
+                self._add(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+    def _add(self, event):
+        # Coalesce repeated events for the same user and day, keeping the earliest
+        user_id, date, time_of_day, name = event
+        key = (user_id, date)
+        if key not in self._pending or time_of_day < self._pending[key][2]:
+            self._pending[key] = event
+
+    def flush(self):
+        """Write up to batch_size pending events, returning False if they must be retried"""
+        batch = list(self._pending.values())[:self.batch_size]
+        try:
+            with metrics.timer('db_write'):
+                recorded = self._insert(batch)
+        except Exception as e:
+            if is_retryable(e):
+                print(f"Error recording attendance, will retry: {e}")
+                return False
+            # A bad row (e.g. a deleted user) must not block the others
+            print(f"Error recording attendance batch: {e}")
+            recorded = set()
+            for event in batch:
+                try:
+                    recorded |= self._insert([event])
+                except Exception as e:
+                    if is_retryable(e):
+                        print(f"Error recording attendance, will retry: {e}")
+                        return False
+                    print(f"Dropping attendance for user {event[0]}: {e}")
+
+        for user_id, date, time_of_day, name in batch:
+            del self._pending[(user_id, date)]
+            if (user_id, date) in recorded:
+                print(f"Attendance recorded for {name or user_id} ({user_id}) at {time_of_day}")
+        return True
+
+    def _insert(self, batch):
+        """Write a batch and return the (user_id, date) pairs that were new"""
+        if self.buffer is not None:
+            return self.buffer.append(batch)
+        return insert_attendance(batch)
@@ -1,8 +1,61 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 import psycopg2
-from config.db_config import DB_CONFIG
+from config.db_config import (DB_CONFIG, DB_BACKEND, SQLITE_FILE, DB_POOL_MAX_SIZE,
+                              DB_POOL_TIMEOUT, DB_POOL_CHECK_INTERVAL)
+
+class DatabaseUnavailable(Exception):
+    """Raised when no database connection can be obtained"""
+
+class SQLiteCursor:
+    """sqlite3 cursor that accepts the PostgreSQL SQL used by the models"""
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        return self._cursor.execute(adapt_sql(sql), params)
+
+    def executemany(self, sql, seq_of_params):
+        return self._cursor.executemany(adapt_sql(sql), seq_of_params)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+class SQLiteConnection:
+    """sqlite3 connection that hands out SQLiteCursor objects"""
+    closed = False
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA foreign_keys = ON')
+
+    def cursor(self, name=None):
+        # sqlite3 cursors already step through their results as rows are fetched
+        return SQLiteCursor(self._conn.cursor())
+
+    def close(self):
+        self._conn.close()
+        self.closed = True
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+def adapt_sql(sql):
+    """Translate PostgreSQL placeholders and types for SQLite"""
+    return sql.replace('%s', '?').replace('SERIAL PRIMARY KEY', 'INTEGER PRIMARY KEY')
 
 def get_connection():
-    """Establish and return a connection to the PostgreSQL database"""
+    """Establish and return a new connection to the configured database"""
+    if DB_BACKEND == 'sqlite':
+        return SQLiteConnection(SQLITE_FILE)
+
     try:
         conn = psycopg2.connect(
             host=DB_CONFIG['host'],
@@ -17,41 +70,219 @@ def get_connection():
         print("Please ensure PostgreSQL is running and connection details are correct.")
         return None
 
+class ConnectionPool:
+    """Bounded pool of reusable database connections
+
+    At most max_size connections are open at once; callers wait up to
+    timeout seconds for a free one. A connection that has been idle for
+    more than check_interval seconds is checked with SELECT 1 before it
+    is handed out, and replaced if the check fails.
+    """
+    def __init__(self, connect=get_connection, max_size=DB_POOL_MAX_SIZE,
+                 timeout=DB_POOL_TIMEOUT, check_interval=DB_POOL_CHECK_INTERVAL):
+        self.connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+        finally:
+            if cursor:
+                try:
+                    cursor.close()
+                except Exception:
+                    pass
+
+    def acquire(self):
+        """Borrow a connection from the pool, opening one if none is idle"""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise DatabaseUnavailable("Timed out waiting for a database connection")
+
+        try:
+            while True:
+                try:
+                    conn, released_at = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                if time.monotonic() - released_at < self.check_interval and not conn.closed:
+                    return conn
+                if self._is_healthy(conn):
+                    return conn
+                self._discard(conn)
+
+            conn = self.connect()
+            if not conn:
+                raise DatabaseUnavailable("Could not connect to the database")
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn, discard=False):
+        """Return a borrowed connection, closing it instead if it is no longer usable"""
+        try:
+            if discard or conn.closed:
+                self._discard(conn)
+            else:
+                self._idle.put((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Return the connection pool of the current process"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        # Connections cannot be shared with a forked child process
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ConnectionPool()
+            _pool_pid = os.getpid()
+        return _pool
+
+@contextmanager
+def db_cursor(name=None):
+    """Borrow a pooled connection and yield a cursor
+
+    The transaction is committed when the block completes and rolled back
+    if it raises. Raises DatabaseUnavailable if no connection can be made.
+    Giving a name opens a server-side cursor on PostgreSQL, which sends the
+    rows of a query in the batches asked for by fetchmany instead of all at
+    once.
+    """
+    pool = get_pool()
+    conn = pool.acquire()
+    cursor = None
+    discard = False
+    try:
+        cursor = conn.cursor(name) if name else conn.cursor()
+        yield cursor
+        if name:
+            # A server-side cursor only exists until the transaction ends
+            cursor.close()
+            cursor = None
+        conn.commit()
+    except BaseException as e:
+        # Also reached when a generator reading from the cursor is closed early
+        try:
+            conn.rollback()
+        except Exception:
+            discard = True
+        # Broken connections are not returned to the pool
+        if isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError, sqlite3.OperationalError)):
+            discard = True
+        raise
+    finally:
+        if cursor:
+            try:
+                cursor.close()
+            except Exception:
+                discard = True
+        pool.release(conn, discard)
+
+ATTENDANCE_UNIQUE_INDEX = '''
+CREATE UNIQUE INDEX IF NOT EXISTS attendance_user_date_idx ON attendance (user_id, date)
+'''
+# Date-range reports read the rows of a period in time order straight from this index;
+# per-user reports use the unique index, which starts with user_id
+ATTENDANCE_DATE_INDEX = '''
+CREATE INDEX IF NOT EXISTS attendance_date_time_idx ON attendance (date, time)
+'''
+
 def initialize_database():
     """Initialize database tables if they don't exist"""
-    conn = get_connection()
-    if not conn:
-        return None, None
-    
-    cursor = conn.cursor()
-    
-    # Create users table if it doesn't exist
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        id SERIAL PRIMARY KEY,
-        name VARCHAR(100) NOT NULL,
-        user_id VARCHAR(50) NOT NULL UNIQUE
-    )
-    ''')
-    
-    # Create attendance table if it doesn't exist
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS attendance (
-        id SERIAL PRIMARY KEY,
-        user_id VARCHAR(50) NOT NULL,
-        date DATE NOT NULL,
-        time TIME NOT NULL,
-        FOREIGN KEY (user_id) REFERENCES users (user_id)
-    )
-    ''')
-    
-    conn.commit()
-    
-    return conn, cursor
-
-def close_connection(conn, cursor=None):
-    """Safely close the database connection and cursor"""
-    if cursor:
-        cursor.close()
-    if conn:
-        conn.close()
\ No newline at end of file
+    try:
+        with db_cursor() as cursor:
+            # Create users table if it doesn't exist
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id SERIAL PRIMARY KEY,
+                name VARCHAR(100) NOT NULL,
+                user_id VARCHAR(50) NOT NULL UNIQUE
+            )
+            ''')
+
+            # Create attendance table if it doesn't exist
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS attendance (
+                id SERIAL PRIMARY KEY,
+                user_id VARCHAR(50) NOT NULL,
+                date DATE NOT NULL,
+                time TIME NOT NULL,
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+            ''')
+
+        # One attendance row per user and day, so concurrent inserts cannot duplicate
+        try:
+            with db_cursor() as cursor:
+                cursor.execute(ATTENDANCE_UNIQUE_INDEX)
+        except (psycopg2.IntegrityError, sqlite3.IntegrityError):
+            # Remove duplicates recorded before the index existed, keeping the earliest
+            with db_cursor() as cursor:
+                cursor.execute('''
+                DELETE FROM attendance WHERE id NOT IN (
+                    SELECT MIN(id) FROM attendance GROUP BY user_id, date
+                )
+                ''')
+                cursor.execute(ATTENDANCE_UNIQUE_INDEX)
+
+        with db_cursor() as cursor:
+            cursor.execute(ATTENDANCE_DATE_INDEX)
+        return True
+    except DatabaseUnavailable:
+        return False
+    except Exception as e:
+        print(f"Error initializing database: {e}")
+        return False
+
+def close_pool():
+    """Close the idle connections of the current process"""
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.close_all()
+
+def reset_pool():
+    """Close the idle connections and open new ones from the current configuration from now on"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.close_all()
+        _pool = None
+
+def configure(backend, path=None):
+    """Use another database than the configured one, such as a SQLite file given by path"""
+    global DB_BACKEND, SQLITE_FILE
+    DB_BACKEND = backend
+    if path is not None:
+        SQLITE_FILE = path
+    reset_pool()
@@ -0,0 +1,212 @@
+"""Offline-first attendance storage.
+
+Attendance is first written to a local SQLite file in WAL mode, which takes
+microseconds and does not depend on the network. An AttendanceSyncer sends
+the events on to the attendance database in large batches. Inserts there
+skip events that are already recorded, so a batch interrupted before it was
+marked as synced is simply sent again. Events wait in the local store for as
+long as the database is unreachable.
+
+Run python -m db.local_buffer to sync once and print the backlog.
+"""
+import datetime
+import sqlite3
+import threading
+import time
+from config.db_config import (LOCAL_BUFFER_FILE, SYNC_INTERVAL, SYNC_BATCH_SIZE,
+                              LOCAL_BUFFER_RETENTION_DAYS)
+from db.attendance_writer import insert_attendance, is_retryable
+from utils.metrics import metrics
+
+# Sync states of a buffered event
+PENDING = 0
+SYNCED = 1
+REJECTED = 2
+# Rows per INSERT into the local store, well under SQLite's limit on parameters
+APPEND_CHUNK_SIZE = 1000
+# Seconds between deletions of old synced events
+PRUNE_INTERVAL = 3600
+
+class LocalAttendanceBuffer:
+    """Attendance events kept in a local SQLite file until they are synced
+
+    The attendance table is the one of the original SQLite version of the
+    system, with the event's name, the time it was buffered and its sync
+    state added. Every instance has its own connection, so the writer and
+    the syncer can work at the same time.
+    """
+    def __init__(self, path=LOCAL_BUFFER_FILE):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            # Readers do not block the writer, and commits need no fsync of the main file
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS attendance (
+                id INTEGER PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                date TEXT NOT NULL,
+                time TEXT NOT NULL,
+                name TEXT,
+                buffered_at REAL NOT NULL,
+                synced INTEGER NOT NULL DEFAULT 0
+            )
+            ''')
+            self._conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS attendance_user_date_idx '
+                               'ON attendance (user_id, date)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS attendance_synced_idx ON attendance (synced, id)')
+            self._conn.commit()
+
+    def append(self, batch):
+        """Store (user_id, date, time, name) events, returning the (user_id, date) pairs that were new"""
+        now = time.time()
+        added = set()
+        with self._lock, self._conn:
+            for start in range(0, len(batch), APPEND_CHUNK_SIZE):
+                chunk = batch[start:start+APPEND_CHUNK_SIZE]
+                placeholders = ', '.join(['(?, ?, ?, ?, ?)'] * len(chunk))
+                rows = self._conn.execute(f'''
+                INSERT INTO attendance (user_id, date, time, name, buffered_at) VALUES {placeholders}
+                ON CONFLICT (user_id, date) DO NOTHING
+                RETURNING user_id, date
+                ''', [value for user_id, date, time_of_day, name in chunk
+                      for value in (user_id, date, time_of_day, name, now)]).fetchall()
+                added.update(rows)
+        return added
+
+    def pending(self, limit):
+        """Return up to limit (id, user_id, date, time, name) events that are not synced yet, oldest first"""
+        with self._lock:
+            return self._conn.execute('SELECT id, user_id, date, time, name FROM attendance '
+                                      'WHERE synced = ? ORDER BY id LIMIT ?', (PENDING, limit)).fetchall()
+
+    def mark(self, ids, state):
+        """Set the sync state of events"""
+        with self._lock, self._conn:
+            self._conn.executemany('UPDATE attendance SET synced = ? WHERE id = ?', [(state, i) for i in ids])
+
+    def backlog(self):
+        """Return the number of events waiting to be synced and the age in seconds of the oldest"""
+        with self._lock:
+            count, oldest = self._conn.execute('SELECT COUNT(*), MIN(buffered_at) FROM attendance '
+                                               'WHERE synced = ?', (PENDING,)).fetchone()
+        return count, time.time() - oldest if oldest else 0.0
+
+    def prune(self, days=LOCAL_BUFFER_RETENTION_DAYS):
+        """Delete events synced or rejected more than days ago, returning how many were deleted"""
+        cutoff = (datetime.date.today() - datetime.timedelta(days=days)).isoformat()
+        with self._lock, self._conn:
+            return self._conn.execute('DELETE FROM attendance WHERE synced != ? AND date < ?',
+                                      (PENDING, cutoff)).rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class AttendanceSyncer:
+    """Background thread sending buffered attendance to the database
+
+    Every interval seconds, pending events are inserted batch_size at a
+    time until none are left. While the database is unreachable the events
+    stay pending and are tried again at the next interval. An event the
+    database refuses, such as one for a user it does not know, is marked as
+    rejected so it does not hold up the others. The backlog and the age of
+    its oldest event are kept in backlog and lag and exported as metrics.
+    """
+    def __init__(self, path=LOCAL_BUFFER_FILE, interval=SYNC_INTERVAL, batch_size=SYNC_BATCH_SIZE):
+        self.buffer = LocalAttendanceBuffer(path)
+        self.interval = interval
+        self.batch_size = batch_size
+        self.backlog = 0
+        self.lag = 0.0
+        self.synced = 0
+        self.last_sync = None
+        self._last_prune = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the syncer thread"""
+        self._stop.clear()
+        self._update_backlog()
+        metrics.set_gauge('attendance_sync_backlog', lambda: self.backlog)
+        metrics.set_gauge('attendance_sync_lag_seconds', lambda: self.lag)
+        self._thread = threading.Thread(target=self._run, name='attendance-syncer', daemon=True)
+        self._thread.start()
+
+    def stop(self, final_sync=True):
+        """Stop the syncer thread, trying once more to send what is left if final_sync is set"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if final_sync:
+            self.sync()
+        if self.backlog:
+            print(f"{self.backlog} attendance events are saved locally and will be synced later")
+        self.buffer.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sync()
+            self._stop.wait(self.interval)
+
+    def sync(self):
+        """Send every pending event, returning False if the database could not be reached"""
+        reachable = True
+        while not self._stop.is_set() or self._thread is None:
+            batch = self.buffer.pending(self.batch_size)
+            if not batch:
+                break
+            if not self._send(batch):
+                reachable = False
+                break
+            if len(batch) < self.batch_size:
+                break
+
+        if reachable and time.monotonic() - self._last_prune >= PRUNE_INTERVAL:
+            self.buffer.prune()
+            self._last_prune = time.monotonic()
+        self._update_backlog()
+        return reachable
+
+    def _send(self, batch):
+        """Insert one batch, returning False if it must be retried"""
+        events = [event[1:] for event in batch]
+        try:
+            with metrics.timer('db_sync'):
+                insert_attendance(events)
+            self.buffer.mark([event[0] for event in batch], SYNCED)
+        except Exception as e:
+            if is_retryable(e):
+                print(f"Attendance database unreachable, will retry: {e}")
+                return False
+            # A bad row must not block the others
+            print(f"Error syncing attendance batch: {e}")
+            for event in batch:
+                try:
+                    insert_attendance([event[1:]])
+                    self.buffer.mark([event[0]], SYNCED)
+                except Exception as e:
+                    if is_retryable(e):
+                        print(f"Attendance database unreachable, will retry: {e}")
+                        return False
+                    print(f"Rejected attendance for user {event[1]} on {event[2]}: {e}")
+                    self.buffer.mark([event[0]], REJECTED)
+
+        self.synced += len(batch)
+        self.last_sync = time.time()
+        metrics.inc('attendance_synced_total', len(batch))
+        return True
+
+    def _update_backlog(self):
+        self.backlog, self.lag = self.buffer.backlog()
+
+if __name__ == "__main__":
+    syncer = AttendanceSyncer()
+    syncer.sync()
+    print(f"Synced {syncer.synced} attendance events; {syncer.backlog} waiting, "
+          f"oldest {syncer.lag:.0f} seconds old")
+    syncer.buffer.close()
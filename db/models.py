@@ -1,149 +1,219 @@
 import datetime
 import csv
-from db.database import get_connection, close_connection
+import os
+from config.db_config import REPORT_BATCH_SIZE, USER_BATCH_SIZE
+from db.database import db_cursor
 
 def add_user(name, user_id):
     """Add a new user to the database"""
-    conn = get_connection()
-    if not conn:
-        return False
-    
-    cursor = conn.cursor()
     try:
-        cursor.execute('INSERT INTO users (name, user_id) VALUES (%s, %s)', (name, user_id))
-        conn.commit()
+        with db_cursor() as cursor:
+            cursor.execute('INSERT INTO users (name, user_id) VALUES (%s, %s)', (name, user_id))
         success = True
     except Exception as e:
-        conn.rollback()
         print(f"Error adding user: {e}")
         success = False
-    finally:
-        close_connection(conn, cursor)
     
     return success
 
+def add_users(users, batch_size=USER_BATCH_SIZE):
+    """Add many (name, user_id) users in one transaction, returning the set of user IDs that were new
+
+    Users are inserted batch_size rows per statement; user IDs already in
+    the database are left as they are. Returns None if the users could not
+    be added.
+    """
+    users = list(users)
+    added = set()
+    try:
+        with db_cursor() as cursor:
+            for start in range(0, len(users), batch_size):
+                batch = users[start:start+batch_size]
+                placeholders = ', '.join(['(%s, %s)'] * len(batch))
+                cursor.execute(f'''
+                INSERT INTO users (name, user_id) VALUES {placeholders}
+                ON CONFLICT (user_id) DO NOTHING
+                RETURNING user_id
+                ''', [value for user in batch for value in user])
+                added.update(user_id for user_id, in cursor.fetchall())
+    except Exception as e:
+        print(f"Error adding users: {e}")
+        return None
+    
+    return added
+
 def delete_user(user_id):
     """Delete a user from the database"""
-    conn = get_connection()
-    if not conn:
-        return False
-    
-    cursor = conn.cursor()
     try:
-        cursor.execute('DELETE FROM users WHERE user_id = %s', (user_id,))
-        conn.commit()
+        with db_cursor() as cursor:
+            cursor.execute('DELETE FROM users WHERE user_id = %s', (user_id,))
         success = True
     except Exception as e:
-        conn.rollback()
         print(f"Error deleting user: {e}")
         success = False
-    finally:
-        close_connection(conn, cursor)
     
     return success
 
-def record_attendance(user_id):
+def record_attendance(user_id, name=None):
     """Record attendance for a user"""
-    conn = get_connection()
-    if not conn:
-        return False
-    
-    cursor = conn.cursor()
     try:
-        today = datetime.datetime.now().strftime("%Y-%m-%d")
-        current_time = datetime.datetime.now().strftime("%H:%M:%S")
-        
-        # Check if user already has attendance for today
-        cursor.execute('SELECT * FROM attendance WHERE user_id = %s AND date = %s', (user_id, today))
-        if cursor.fetchone():
-            print(f"Attendance for user {user_id} already recorded today.")
-            close_connection(conn, cursor)
-            return False
-        
-        cursor.execute('INSERT INTO attendance (user_id, date, time) VALUES (%s, %s, %s)', 
-                      (user_id, today, current_time))
-        conn.commit()
-        
-        # Get user name
-        cursor.execute('SELECT name FROM users WHERE user_id = %s', (user_id,))
-        result = cursor.fetchone()
-        if result:
-            name = result[0]
-            print(f"Attendance recorded for {name} ({user_id}) at {current_time}")
+        with db_cursor() as cursor:
+            today = datetime.datetime.now().strftime("%Y-%m-%d")
+            current_time = datetime.datetime.now().strftime("%H:%M:%S")
+            
+            # The unique index on (user_id, date) makes a second insert a no-op
+            cursor.execute('''
+            INSERT INTO attendance (user_id, date, time) VALUES (%s, %s, %s)
+            ON CONFLICT (user_id, date) DO NOTHING
+            ''', (user_id, today, current_time))
+            if cursor.rowcount == 0:
+                print(f"Attendance for user {user_id} already recorded today.")
+                return False
+            
+            # Get user name unless the caller already knows it
+            if name is None:
+                cursor.execute('SELECT name FROM users WHERE user_id = %s', (user_id,))
+                result = cursor.fetchone()
+                if result:
+                    name = result[0]
+            if name:
+                print(f"Attendance recorded for {name} ({user_id}) at {current_time}")
         
         success = True
     except Exception as e:
-        conn.rollback()
         print(f"Error recording attendance: {e}")
         success = False
-    finally:
-        close_connection(conn, cursor)
     
     return success
 
 def get_user_name(user_id):
     """Get a user's name by their ID"""
-    conn = get_connection()
-    if not conn:
-        return None
-    
-    cursor = conn.cursor()
     try:
-        cursor.execute('SELECT name FROM users WHERE user_id = %s', (user_id,))
-        result = cursor.fetchone()
-        name = result[0] if result else None
+        with db_cursor() as cursor:
+            cursor.execute('SELECT name FROM users WHERE user_id = %s', (user_id,))
+            result = cursor.fetchone()
+            name = result[0] if result else None
     except Exception as e:
         print(f"Error getting user name: {e}")
         name = None
-    finally:
-        close_connection(conn, cursor)
     
     return name
 
+def get_users_since(last_id=0):
+    """Get users added after a row ID as (id, user_id, name) tuples"""
+    try:
+        with db_cursor() as cursor:
+            cursor.execute('SELECT id, user_id, name FROM users WHERE id > %s ORDER BY id', (last_id,))
+            users = cursor.fetchall()
+    except Exception as e:
+        print(f"Error getting users: {e}")
+        users = None
+    
+    return users
+
+def get_attendance_since(date, last_id=0):
+    """Get attendance recorded on a date after a row ID as (id, user_id) tuples"""
+    try:
+        with db_cursor() as cursor:
+            cursor.execute('SELECT id, user_id FROM attendance WHERE date = %s AND id > %s ORDER BY id',
+                           (date, last_id))
+            records = cursor.fetchall()
+    except Exception as e:
+        print(f"Error getting attendance: {e}")
+        records = None
+    
+    return records
+
 def get_attendance_records(date=None):
     """Get attendance records for a specific date"""
     if not date:
         date = datetime.datetime.now().strftime("%Y-%m-%d")
     
-    conn = get_connection()
-    if not conn:
-        return []
-    
-    cursor = conn.cursor()
     try:
-        cursor.execute('''
-        SELECT users.name, users.user_id, attendance.time 
-        FROM attendance 
-        JOIN users ON attendance.user_id = users.user_id 
-        WHERE attendance.date = %s 
-        ORDER BY attendance.time
-        ''', (date,))
-        
-        records = cursor.fetchall()
+        with db_cursor() as cursor:
+            cursor.execute('''
+            SELECT users.name, users.user_id, attendance.time 
+            FROM attendance 
+            JOIN users ON attendance.user_id = users.user_id 
+            WHERE attendance.date = %s 
+            ORDER BY attendance.time
+            ''', (date,))
+            
+            records = cursor.fetchall()
     except Exception as e:
         print(f"Error getting attendance records: {e}")
         records = []
-    finally:
-        close_connection(conn, cursor)
     
     return records
 
-def export_to_csv(records, date):
-    """Export attendance records to a CSV file"""
-    if not records:
-        print("No records to export.")
-        return False
+def iter_attendance_report(start_date, end_date=None, user_id=None, batch_size=REPORT_BATCH_SIZE):
+    """Yield (date, name, user_id, time) attendance records from start_date to end_date, in time order
+
+    Records are fetched batch_size rows at a time as they are read, so
+    reports over months or years run in constant memory. Giving a user_id
+    limits the report to that user. A database error is printed and raised,
+    so a reader can tell a report cut short from a complete one.
+    """
+    sql = '''
+    SELECT attendance.date, users.name, users.user_id, attendance.time 
+    FROM attendance 
+    JOIN users ON attendance.user_id = users.user_id 
+    WHERE attendance.date BETWEEN %s AND %s 
+    '''
+    params = [start_date, end_date or start_date]
+    if user_id:
+        sql += 'AND attendance.user_id = %s '
+        params.append(user_id)
+    sql += 'ORDER BY attendance.date, attendance.time'
     
-    filename = f"attendance_{date}.csv"
     try:
+        with db_cursor('attendance_report') as cursor:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+    except Exception as e:
+        print(f"Error getting attendance report: {e}")
+        raise
+
+def export_to_csv(records, date, header=('Name', 'User ID', 'Time'), filename=None):
+    """Export attendance records to a CSV file, writing each record as it is read
+
+    If reading the records fails partway, the partly written file is removed.
+    """
+    filename = filename or f"attendance_{date}.csv"
+    written = False
+    try:
+        records = iter(records)
+        first = next(records, None)
+        if first is None:
+            print("No records to export.")
+            return False
+        
+        written = True
         with open(filename, 'w', newline='') as csvfile:
             writer = csv.writer(csvfile)
-            writer.writerow(['Name', 'User ID', 'Time'])
+            writer.writerow(header)
+            writer.writerow(first)
+            count = 1
             for record in records:
                 writer.writerow(record)
+                count += 1
         
-        print(f"Attendance exported to {filename}")
+        print(f"Attendance exported to {filename} ({count} records)")
         return True
     except Exception as e:
         print(f"Error exporting to CSV: {e}")
-        return False
\ No newline at end of file
+        if written and os.path.exists(filename):
+            os.remove(filename)
+        return False
+
+def export_attendance_report(start_date, end_date=None, user_id=None):
+    """Stream the attendance records of a date range, and optionally one user, to a CSV file"""
+    end_date = end_date or start_date
+    filename = f"attendance_{start_date}" + (f"_{end_date}" if end_date != start_date else "") \
+        + (f"_{user_id}" if user_id else "") + ".csv"
+    return export_to_csv(iter_attendance_report(start_date, end_date, user_id), start_date,
+                         ('Date', 'Name', 'User ID', 'Time'), filename)
\ No newline at end of file
@@ -0,0 +1,98 @@
+import datetime
+import threading
+import time
+from config.db_config import ROSTER_REFRESH_INTERVAL
+from db.models import get_users_since, get_attendance_since
+from utils.metrics import metrics
+
+# Seconds between checks of whether a refresh is due, so a new day is noticed promptly
+CHECK_INTERVAL = 1.0
+
+class AttendanceRoster:
+    """In-memory copy of the users table and of today's attendance
+
+    The recognition loop looks names and attendance up here instead of
+    querying the database for every face. Both are read from the database,
+    so a restarted process starts from what is already recorded, and
+    refresh() only fetches rows added since the previous call. A failed
+    refresh keeps what was loaded before and is retried after
+    refresh_interval, and start() refreshes on a background thread so the
+    recognition loop never waits for the database.
+    """
+    def __init__(self, refresh_interval=ROSTER_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self.names = {}
+        self.attended = set()
+        self.date = None
+        self.last_refresh = 0
+        # Whether the users have been loaded from the database at least once
+        self.loaded = False
+        self._last_user_row = 0
+        self._last_attendance_row = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start refreshing in the background"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='roster-refresh', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(CHECK_INTERVAL):
+            self.refresh_if_due()
+
+    def refresh(self):
+        """Fetch users and attendance added since the last refresh"""
+        today = datetime.datetime.now().strftime("%Y-%m-%d")
+        if today != self.date:
+            # A new day starts with nobody attended
+            with self._lock:
+                self.date = today
+                self.attended = set()
+                self._last_attendance_row = 0
+
+        # Failures count as a refresh too, so an unreachable database is retried after the interval
+        self.last_refresh = time.monotonic()
+        with metrics.timer('db_refresh'):
+            users = get_users_since(self._last_user_row)
+            records = get_attendance_since(self.date, self._last_attendance_row)
+        if users is None or records is None:
+            return False
+
+        with self._lock:
+            for row_id, user_id, name in users:
+                self.names[user_id] = name
+                self._last_user_row = max(self._last_user_row, row_id)
+            for row_id, user_id in records:
+                self.attended.add(user_id)
+                self._last_attendance_row = max(self._last_attendance_row, row_id)
+            self.loaded = True
+        return True
+
+    def refresh_if_due(self):
+        """Refresh when the refresh interval has passed or the date has changed"""
+        today = datetime.datetime.now().strftime("%Y-%m-%d")
+        if today != self.date or time.monotonic() - self.last_refresh >= self.refresh_interval:
+            return self.refresh()
+        return True
+
+    def get_name(self, user_id):
+        """Get a user's name, or None if the user is unknown"""
+        return self.names.get(user_id)
+
+    def has_attended(self, user_id):
+        """Check if a user's attendance has been recorded today"""
+        return user_id in self.attended
+
+    def mark_attended(self, user_id):
+        """Remember that a user's attendance has been recorded today"""
+        with self._lock:
+            self.attended.add(user_id)
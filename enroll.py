@@ -0,0 +1,217 @@
+"""Bulk enrollment of users from a roster file and a folder of photos per person.
+
+Usage: python enroll.py [--workers N] [--group GROUP] <roster.csv> <photos folder>
+
+The roster is a CSV file with user_id and name columns and an optional
+group column. The photos of every user are read from <photos folder>/<user_id>/.
+The largest face of every photo is cut out, normalized and saved to the
+user's face directory, which replaces any faces saved for them before.
+Photos are processed by a pool of worker processes, then the users with at
+least one face are added in batched INSERT statements and the model is
+trained once for all of them.
+"""
+import argparse
+import csv
+import multiprocessing
+import os
+import re
+import shutil
+import time
+import cv2
+from config.db_config import FACES_DIR
+from db.database import initialize_database
+from db.models import add_users
+from face.detector import FaceDetector
+from face.preprocess import FaceNormalizer
+from face.shards import DEFAULT_GROUP
+from face.trainer import FaceTrainer
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+# A group is a directory in FACES_DIR: plain names only, so faces are never written outside it
+GROUP_NAME = re.compile(r'[A-Za-z0-9_-]+')
+
+# Created once in every worker process by init_worker
+_detector = None
+_normalizer = None
+
+def init_worker():
+    """Create the detector and the normalizer in a worker process"""
+    global _detector, _normalizer
+    # Photos are unrelated, so every photo is searched in full
+    _detector = FaceDetector(full_scan_interval=1)
+    _normalizer = FaceNormalizer()
+
+def read_roster(path, default_group=None):
+    """Read (user_id, name, group) entries from a roster CSV file, or None if it cannot be used"""
+    try:
+        with open(path, newline='') as csvfile:
+            reader = csv.DictReader(csvfile)
+            if not reader.fieldnames or not {'user_id', 'name'} <= set(reader.fieldnames):
+                print(f"{path} needs user_id and name columns")
+                return None
+
+            entries = []
+            seen = set()
+            for line, row in enumerate(reader, start=2):
+                user_id = (row['user_id'] or '').strip()
+                name = (row['name'] or '').strip()
+                group = (row.get('group') or '').strip() or default_group
+                if not user_id.isdigit() or not name:
+                    print(f"Skipping line {line} of {path}: needs a numeric user ID and a name")
+                    continue
+                if user_id in seen:
+                    print(f"Skipping line {line} of {path}: user {user_id} is listed twice")
+                    continue
+                if group and (group.isdigit() or not GROUP_NAME.fullmatch(group)):
+                    print(f"Skipping line {line} of {path}: invalid group {group!r}")
+                    continue
+                seen.add(user_id)
+                entries.append((user_id, name, group))
+            return entries
+    except Exception as e:
+        print(f"Error reading roster {path}: {e}")
+        return None
+
+def user_face_dir(user_id, group):
+    if group and group != DEFAULT_GROUP:
+        return os.path.join(FACES_DIR, group, user_id)
+    return os.path.join(FACES_DIR, user_id)
+
+def extract_faces(task):
+    """Save the largest face of every photo of a user, returning (user_id, photos, faces, CPU seconds)
+
+    old_dir is the user's face directory in another group, if they are
+    moving to a new one; it is removed once the new faces are in place.
+    """
+    user_id, photo_paths, face_dir, old_dir = task
+    start = time.process_time()
+    faces_saved = 0
+    staging_dir = face_dir + '.importing'
+    try:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        os.makedirs(staging_dir)
+        for path in photo_paths:
+            photo = cv2.imread(path)
+            if photo is None:
+                print(f"Cannot read photo {path}")
+                continue
+            gray, faces = _detector.detect_faces(photo)
+            if len(faces) == 0:
+                print(f"No face found in {path}")
+                continue
+
+            # A photo of one person: smaller detections are background faces or false positives
+            x, y, w, h = max(faces, key=lambda face: face[2] * face[3])
+            face_img = _normalizer.normalize(gray[y:y+h, x:x+w])
+            cv2.imwrite(os.path.join(staging_dir, f'face_{faces_saved}.jpg'), face_img)
+            faces_saved += 1
+
+        # The new faces replace the old ones only once all photos are processed
+        if faces_saved:
+            shutil.rmtree(face_dir, ignore_errors=True)
+            os.replace(staging_dir, face_dir)
+            if old_dir:
+                print(f"Moved user {user_id} from {old_dir} to {face_dir}")
+                shutil.rmtree(old_dir, ignore_errors=True)
+    except Exception as e:
+        print(f"Error importing photos of user {user_id}: {e}")
+        faces_saved = 0
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    return user_id, len(photo_paths), faces_saved, time.process_time() - start
+
+def collect_tasks(entries, photos_dir, trainer):
+    """Pair every roster entry with its photos and the face directory to save them to"""
+    tasks = []
+    for user_id, _, group in entries:
+        user_photos = os.path.join(photos_dir, user_id)
+        photos = sorted(os.path.join(user_photos, name) for name in os.listdir(user_photos)
+                        if name.lower().endswith(IMAGE_EXTENSIONS)) if os.path.isdir(user_photos) else []
+        if not photos:
+            print(f"No photos found for user {user_id} in {user_photos}")
+            continue
+
+        face_dir = user_face_dir(user_id, group)
+        # A user moving to another group leaves their old directory, once faces are found in the new photos
+        old_dir, _ = trainer.find_user(user_id)
+        if old_dir and os.path.normpath(old_dir) == os.path.normpath(face_dir):
+            old_dir = None
+        os.makedirs(os.path.dirname(face_dir), exist_ok=True)
+        tasks.append((user_id, photos, face_dir, old_dir))
+    return tasks
+
+def run_enrollment(roster_file, photos_dir, workers=None, default_group=None):
+    """Enroll every user of a roster from their photos and train the model once"""
+    if not os.path.isdir(photos_dir):
+        print(f"Photo folder {photos_dir} not found")
+        return False
+    entries = read_roster(roster_file, default_group)
+    if not entries:
+        print("No users to enroll.")
+        return False
+    if not initialize_database():
+        print("Could not connect to database. Exiting...")
+        return False
+
+    os.makedirs(FACES_DIR, exist_ok=True)
+    trainer = FaceTrainer()
+    tasks = collect_tasks(entries, photos_dir, trainer)
+    if not tasks:
+        print("No users to enroll.")
+        return False
+
+    # Users with many photos first, so no worker is left with a long task at the end
+    tasks.sort(key=lambda task: len(task[1]), reverse=True)
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    extracted = {}
+    photos = faces = 0
+    cpu_seconds = 0.0
+    with multiprocessing.Pool(workers, initializer=init_worker) as pool:
+        for user_id, task_photos, task_faces, task_seconds in pool.imap_unordered(extract_faces, tasks):
+            photos += task_photos
+            faces += task_faces
+            cpu_seconds += task_seconds
+            if task_faces:
+                extracted[user_id] = task_faces
+    extract_seconds = time.perf_counter() - start
+
+    names = {user_id: name for user_id, name, _ in entries}
+    start = time.perf_counter()
+    added = add_users([(names[user_id], user_id) for user_id in sorted(extracted)])
+    insert_seconds = time.perf_counter() - start
+    if added is None:
+        print("Users could not be added to the database; their faces are saved and will be "
+              "trained on the next run.")
+        return False
+
+    start = time.perf_counter()
+    trained = trainer.train_face_recognizer()
+    train_seconds = time.perf_counter() - start
+
+    total = extract_seconds + insert_seconds + train_seconds
+    print(f"\nEnrolled {len(extracted)} of {len(entries)} users ({len(added)} new, "
+          f"{len(extracted) - len(added)} already in the database)")
+    print(f"Face extraction: {photos} photos, {faces} faces in {extract_seconds:.1f} s with {workers} "
+          f"workers: {photos / extract_seconds if extract_seconds else 0:.1f} photos/s overall, "
+          f"{photos / cpu_seconds if cpu_seconds else 0:.1f} photos/s per core")
+    print(f"Database insert: {len(extracted)} users in {insert_seconds:.2f} s")
+    print(f"Training: {train_seconds:.1f} s")
+    print(f"Total: {total:.1f} s, {len(extracted) / total if total else 0:.1f} users/s")
+    return trained
+
+def main():
+    parser = argparse.ArgumentParser(description="Enroll users from a roster file and photo folders")
+    parser.add_argument('roster', help="CSV file with user_id, name and optional group columns")
+    parser.add_argument('photos', help="folder with a subfolder of photos named after each user ID")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument('--group', default=None, help="group of the users the roster gives no group")
+    args = parser.parse_args()
+
+    try:
+        run_enrollment(args.roster, args.photos, args.workers, args.group)
+    except KeyboardInterrupt:
+        print("\nProgram interrupted. Exiting...")
+
+if __name__ == "__main__":
+    main()
@@ -1,51 +1,194 @@
 import cv2
 import os
-from config.db_config import FACES_DIR
+from collections import Counter
+import numpy as np
+from config.db_config import (FACES_DIR, DETECTOR_BACKEND, DETECTOR_MODEL_FILE, DETECTOR_SCORE_THRESHOLD,
+                              DETECTION_MAX_WIDTH, DETECTION_MIN_FACE_SIZE, DETECTION_MAX_FACE_SIZE,
+                              DETECTION_FULL_SCAN_INTERVAL, DETECTION_ROI_MARGIN, CAPTURE_SAMPLES)
+from face.preprocess import FaceNormalizer
+from face.quality import SampleSelector, BLURRY, TURNED, DUPLICATE
+from face.tracker import box_iou
+
+HAAR_CASCADE_FILE = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+# Shown while capturing when a face is skipped
+CAPTURE_HINTS = {BLURRY: "Hold still", TURNED: "Look straight at the camera",
+                 DUPLICATE: "Move your head slightly"}
+
+class CascadeBackend:
+    """Haar or LBP cascade classifier, run on grayscale images"""
+    color = False
+
+    def __init__(self, cascade_file=HAAR_CASCADE_FILE):
+        self.cascade = cv2.CascadeClassifier(cascade_file)
+        if self.cascade.empty():
+            raise ValueError(f"Cannot load cascade {cascade_file}")
+
+    def detect(self, image, min_size=0, max_size=0, fine=False):
+        """Return (x, y, w, h) boxes, searching sizes more finely if fine is set"""
+        faces = self.cascade.detectMultiScale(image, 1.1 if fine else 1.3, 5,
+                                              minSize=(min_size, min_size) if min_size else None,
+                                              maxSize=(max_size, max_size) if max_size else None)
+        return [tuple(int(v) for v in box) for box in faces]
+
+class DNNBackend:
+    """YuNet convolutional face detector (cv2.FaceDetectorYN), run on color images
+
+    The ONNX model is read from a local file; nothing is downloaded.
+    """
+    color = True
+
+    def __init__(self, model_file, score_threshold=DETECTOR_SCORE_THRESHOLD):
+        if not model_file or not os.path.exists(model_file):
+            raise ValueError(f"DNN detector model {model_file!r} not found")
+        self.net = cv2.FaceDetectorYN.create(model_file, "", (320, 320), score_threshold)
+
+    def detect(self, image, min_size=0, max_size=0, fine=False):
+        """Return (x, y, w, h) boxes of the faces scoring above the threshold"""
+        height, width = image.shape[:2]
+        self.net.setInputSize((width, height))
+        _, faces = self.net.detect(image)
+        boxes = []
+        for face in faces if faces is not None else []:
+            x, y, w, h = (int(round(v)) for v in face[:4])
+            x, y = max(0, x), max(0, y)
+            w, h = min(w, width - x), min(h, height - y)
+            size = max(w, h)
+            if w > 0 and h > 0 and size >= min_size and (not max_size or size <= max_size):
+                boxes.append((x, y, w, h))
+        return boxes
+
+def create_backend(name=DETECTOR_BACKEND, model_file=DETECTOR_MODEL_FILE):
+    """Create a detector backend by name: 'haar', 'lbp' or 'dnn'"""
+    if name == 'haar':
+        return CascadeBackend(model_file or HAAR_CASCADE_FILE)
+    if name == 'lbp':
+        if not model_file:
+            raise ValueError("The LBP cascade backend needs DETECTOR_MODEL_FILE")
+        return CascadeBackend(model_file)
+    if name == 'dnn':
+        return DNNBackend(model_file)
+    raise ValueError(f"Unknown detector backend {name!r}")
 
 class FaceDetector:
-    def __init__(self):
-        # Load the Haar cascade for face detection
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    """Face detector with a configurable backend
+
+    Frames wider than max_width are downscaled before detection and the
+    boxes are mapped back to full resolution. Face sizes are given in
+    full-resolution pixels. With full_scan_interval above 1, only the
+    regions around the faces found in the previous frame are searched
+    between full scans of the frame.
+    """
+    def __init__(self, backend=None, max_width=DETECTION_MAX_WIDTH, min_face_size=DETECTION_MIN_FACE_SIZE,
+                 max_face_size=DETECTION_MAX_FACE_SIZE, full_scan_interval=DETECTION_FULL_SCAN_INTERVAL,
+                 roi_margin=DETECTION_ROI_MARGIN):
+        if backend is None:
+            try:
+                backend = create_backend()
+            except Exception as e:
+                print(f"Error loading {DETECTOR_BACKEND} face detector: {e}")
+                print("Falling back to the Haar cascade.")
+                backend = CascadeBackend()
+        self.backend = backend
+        self.max_width = max_width
+        self.min_face_size = min_face_size
+        self.max_face_size = max_face_size
+        self.full_scan_interval = full_scan_interval
+        self.roi_margin = roi_margin
+        self._recent = []
+        self._frames_since_full_scan = 0
+    
+    def reset(self):
+        """Forget the faces found so far, before detecting in another video"""
+        self._recent = []
+        self._frames_since_full_scan = 0
     
     def detect_faces(self, frame):
         """Detect faces in a frame and return their coordinates"""
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = self.face_cascade.detectMultiScale(gray, 1.3, 5)
+        
+        scale = 1.0
+        small = frame if self.backend.color else gray
+        if self.max_width and gray.shape[1] > self.max_width:
+            scale = self.max_width / gray.shape[1]
+            small = cv2.resize(small, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        
+        self._frames_since_full_scan += 1
+        if not self._recent or self._frames_since_full_scan >= self.full_scan_interval:
+            boxes = self._detect(small, scale)
+            self._frames_since_full_scan = 0
+        else:
+            boxes = self._detect_around(small, scale, self._recent)
+        
+        self._recent = [tuple(box) for box in boxes]
+        faces = np.array([[int(round(v / scale)) for v in box] for box in boxes], dtype=np.int32).reshape(-1, 4)
         return gray, faces
     
-    def capture_user_faces(self, user_id, num_images=20):
-        """Capture multiple face images for a new user"""
-        # Create directory for the user
-        user_dir = os.path.join(FACES_DIR, str(user_id))
-        if not os.path.exists(user_dir):
-            os.makedirs(user_dir)
-        
+    def _detect(self, image, scale):
+        """Run the backend on an image, with face size limits scaled to it"""
+        return self.backend.detect(image, int(self.min_face_size * scale), int(self.max_face_size * scale))
+    
+    def _detect_around(self, image, scale, boxes):
+        """Search only the regions around previously found boxes, in downscaled coordinates"""
+        height, width = image.shape[:2]
+        found = []
+        for x, y, w, h in boxes:
+            margin_x, margin_y = int(w * self.roi_margin), int(h * self.roi_margin)
+            x0, y0 = max(0, x - margin_x), max(0, y - margin_y)
+            x1, y1 = min(width, x + w + margin_x), min(height, y + h + margin_y)
+            # A face changes little in size between frames, so a narrow range of sizes is
+            # searched more finely than the full scan can afford
+            min_size = max(int(w * 0.75), int(self.min_face_size * scale))
+            max_size = int(w * 1.35)
+            if self.max_face_size:
+                max_size = min(max_size, int(self.max_face_size * scale))
+            for fx, fy, fw, fh in self.backend.detect(image[y0:y1, x0:x1], min_size, max_size, fine=True):
+                box = (fx + x0, fy + y0, fw, fh)
+                # Regions of nearby faces overlap, so the same face can be found twice
+                if all(box_iou(box, other) < 0.5 for other in found):
+                    found.append(box)
+        return found
+    
+    def capture_user_faces(self, user_id, num_images=CAPTURE_SAMPLES):
+        """Capture sharp, frontal and distinct face images for a new user
+
+        Only the largest face in view is used. Faces that are blurry, turned
+        away or too similar to one already kept are skipped, with a hint on
+        screen, until num_images are kept. They replace any faces saved for
+        the user before.
+        """
         cap = cv2.VideoCapture(0)
         if not cap.isOpened():
             print("Cannot open camera")
             return False
         
-        count = 0
-        while count < num_images:
+        # Faces are saved in the canonical form used for training and recognition
+        normalizer = FaceNormalizer()
+        selector = SampleSelector(num_images)
+        skipped = Counter()
+        hint = ""
+        while not selector.full:
             ret, frame = cap.read()
             if not ret:
                 break
                 
             gray, faces = self.detect_faces(frame)
             
-            for (x, y, w, h) in faces:
+            if len(faces):
+                # The person enrolling is closest to the camera; other faces are passers-by
+                x, y, w, h = max(faces, key=lambda face: face[2] * face[3])
                 cv2.rectangle(frame, (x, y), (x+w, y+h), (255, 0, 0), 2)
-                # Save the face image
-                if count < num_images and len(faces) > 0:
-                    face_img = gray[y:y+h, x:x+w]
-                    face_filename = os.path.join(user_dir, f'face_{count}.jpg')
-                    cv2.imwrite(face_filename, face_img)
-                    count += 1
-                    print(f"Captured image {count}/{num_images}")
+                problem = selector.add(normalizer.normalize(gray[y:y+h, x:x+w]))
+                if problem:
+                    skipped[problem] += 1
+                else:
+                    print(f"Captured image {len(selector.faces)}/{num_images}")
+                hint = CAPTURE_HINTS.get(problem, "")
             
-            # Display counter
-            cv2.putText(frame, f'Captured: {count}/{num_images}', (10, 30), 
+            # Display counter and what to do for the next capture
+            cv2.putText(frame, f'Captured: {len(selector.faces)}/{num_images}', (10, 30), 
                         cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+            if hint:
+                cv2.putText(frame, hint, (10, 65), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
             
             cv2.imshow('Capture Faces', frame)
             
@@ -55,4 +198,18 @@ class FaceDetector:
                 
         cap.release()
         cv2.destroyAllWindows()
-        return count > 0
\ No newline at end of file
+        
+        if skipped:
+            print("Skipped " + ", ".join(f"{count} {reason}" for reason, count in skipped.items()) + " faces")
+        if not selector.faces:
+            return False
+        
+        # Replace the faces saved for the user before
+        user_dir = os.path.join(FACES_DIR, str(user_id))
+        os.makedirs(user_dir, exist_ok=True)
+        for name in os.listdir(user_dir):
+            if name.endswith('.jpg'):
+                os.remove(os.path.join(user_dir, name))
+        for i, face_img in enumerate(selector.faces):
+            cv2.imwrite(os.path.join(user_dir, f'face_{i}.jpg'), face_img)
+        return True
\ No newline at end of file
@@ -0,0 +1,153 @@
+"""Approximate nearest-neighbour index over the LBPH gallery.
+
+Histograms are mapped to sqrt(h), where Euclidean distance is the Hellinger
+distance that bounds the chi-square distance used by LBPH, and reduced with
+PCA. A coarse k-means quantizer splits the reduced vectors into inverted
+lists. A search scans only the lists whose centroids are closest to the
+query and returns the best candidates for exact chi-square re-ranking, so
+the cost grows with the size of the probed lists instead of the gallery.
+"""
+import os
+import numpy as np
+from config.db_config import (GALLERY_INDEX_DIMENSIONS, GALLERY_INDEX_PROBES,
+                              GALLERY_INDEX_CANDIDATES)
+
+# Rows used to fit the PCA projection and the k-means centroids
+TRAINING_SAMPLES = 4096
+KMEANS_ITERATIONS = 10
+CHUNK_SIZE = 1024
+
+def _squared_distances(x, y):
+    """Squared Euclidean distances between the rows of two matrices"""
+    return (np.einsum('ij,ij->i', x, x)[:, np.newaxis] - 2 * (x @ y.T)
+            + np.einsum('ij,ij->i', y, y)[np.newaxis, :])
+
+class GalleryIndex:
+    def __init__(self, dimensions=GALLERY_INDEX_DIMENSIONS, num_probes=GALLERY_INDEX_PROBES,
+                 num_candidates=GALLERY_INDEX_CANDIDATES):
+        self.dimensions = dimensions
+        self.num_probes = num_probes
+        self.num_candidates = num_candidates
+        self.mean = None
+        self.components = None
+        self.centroids = None
+        self.vectors = None
+        self.list_offsets = None
+        self.list_ids = None
+
+    def _reduce(self, histograms):
+        """Project histograms into the reduced Hellinger space"""
+        return (np.sqrt(np.asarray(histograms, dtype=np.float32)) - self.mean) @ self.components.T
+
+    def build(self, histograms, rows=None, seed=0):
+        """Fit the projection and the coarse quantizer, then index the given rows of the histograms
+
+        Search results are positions in rows. Histograms are read a chunk at
+        a time, so a memory-mapped gallery is never loaded as a whole.
+        """
+        rng = np.random.default_rng(seed)
+        rows = np.arange(len(histograms)) if rows is None else np.asarray(rows)
+        num_samples = len(rows)
+        sample = np.sort(rng.choice(num_samples, min(num_samples, TRAINING_SAMPLES), replace=False))
+        training = np.sqrt(np.asarray(histograms[rows[sample]], dtype=np.float32))
+        self.mean = training.mean(axis=0)
+        training -= self.mean
+
+        # Randomized SVD: the top singular vectors of a 16384-wide matrix
+        # are found from a small random projection with two power iterations
+        rank = min(self.dimensions, len(sample))
+        basis = training @ rng.standard_normal((training.shape[1], rank + 10)).astype(np.float32)
+        for _ in range(2):
+            basis, _ = np.linalg.qr(basis)
+            basis = training @ (training.T @ basis)
+        basis, _ = np.linalg.qr(basis)
+        _, _, vt = np.linalg.svd(basis.T @ training, full_matrices=False)
+        self.components = np.ascontiguousarray(vt[:rank], dtype=np.float32)
+
+        self.vectors = np.empty((num_samples, rank), dtype=np.float32)
+        for start in range(0, num_samples, CHUNK_SIZE):
+            self.vectors[start:start+CHUNK_SIZE] = self._reduce(histograms[rows[start:start+CHUNK_SIZE]])
+
+        # Coarse quantizer with about sqrt(n) lists
+        num_lists = max(1, min(int(np.sqrt(num_samples)), len(sample)))
+        reduced_sample = self.vectors[sample]
+        centroids = reduced_sample[rng.choice(len(sample), num_lists, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            assignment = _squared_distances(reduced_sample, centroids).argmin(axis=1)
+            for c in range(num_lists):
+                members = reduced_sample[assignment == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+        self.centroids = centroids
+
+        assignment = np.concatenate([
+            _squared_distances(self.vectors[start:start+CHUNK_SIZE], centroids).argmin(axis=1)
+            for start in range(0, num_samples, CHUNK_SIZE)])
+        self.list_ids = np.argsort(assignment, kind='stable')
+        self.list_offsets = np.searchsorted(assignment[self.list_ids], np.arange(num_lists + 1))
+        return self
+
+    def search(self, queries):
+        """Return the candidate positions of the nearest indexed histograms for every query"""
+        reduced = self._reduce(np.atleast_2d(queries))
+        probes = min(self.num_probes, len(self.centroids))
+        nearest_lists = np.argsort(_squared_distances(reduced, self.centroids), axis=1)[:, :probes]
+
+        results = []
+        for q, lists in enumerate(nearest_lists):
+            ids = np.concatenate([self.list_ids[self.list_offsets[c]:self.list_offsets[c+1]]
+                                  for c in lists])
+            if len(ids) > self.num_candidates:
+                distances = _squared_distances(reduced[q:q+1], self.vectors[ids])[0]
+                ids = ids[np.argpartition(distances, self.num_candidates - 1)[:self.num_candidates]]
+            results.append(np.sort(ids))
+        return results
+
+    def save(self, path, fingerprint):
+        """Save the index together with the fingerprint of the model it was built from"""
+        with open(path, 'wb') as f:
+            np.savez(f, fingerprint=np.array(fingerprint), mean=self.mean,
+                     components=self.components, centroids=self.centroids, vectors=self.vectors,
+                     list_offsets=self.list_offsets, list_ids=self.list_ids)
+
+    def load(self, path, fingerprint):
+        """Load a saved index, returning False if it was built from a different model or cannot be read"""
+        if not os.path.exists(path):
+            return False
+        try:
+            with np.load(path) as data:
+                if str(data['fingerprint']) != fingerprint:
+                    return False
+                arrays = {name: data[name] for name in ('mean', 'components', 'centroids', 'vectors',
+                                                        'list_offsets', 'list_ids')}
+        except Exception as e:
+            # A truncated or corrupt file is rebuilt like an outdated one
+            print(f"Error loading gallery index {path}, rebuilding it: {e}")
+            return False
+        self.mean = arrays['mean']
+        self.components = arrays['components']
+        self.centroids = arrays['centroids']
+        self.vectors = arrays['vectors']
+        self.list_offsets = arrays['list_offsets']
+        self.list_ids = arrays['list_ids']
+        return True
+
+def model_fingerprint(model_file):
+    """Identify a model file version by its size and modification time"""
+    stat = os.stat(model_file)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+def load_or_build_index(histograms, rows, model_file=None, index_file=None):
+    """Load the cached index of a model file, or build it and update the cache"""
+    index = GalleryIndex()
+    fingerprint = model_fingerprint(model_file) if model_file else None
+    if fingerprint and index_file and index.load(index_file, fingerprint):
+        return index
+
+    index.build(histograms, rows)
+    if fingerprint and index_file:
+        try:
+            index.save(index_file, fingerprint)
+        except OSError as e:
+            print(f"Error saving gallery index: {e}")
+    return index
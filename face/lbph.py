@@ -0,0 +1,90 @@
+import numpy as np
+
+# Default parameters of cv2.face.LBPHFaceRecognizer_create()
+RADIUS = 1
+NEIGHBORS = 8
+GRID_X = 8
+GRID_Y = 8
+
+def elbp(src, radius=RADIUS, neighbors=NEIGHBORS):
+    """Compute the extended (circular) local binary pattern image of one or more grayscale images
+
+    src is either a single image or a stack of same-sized images.
+    """
+    src = np.asarray(src)
+    rows, cols = src.shape[-2:]
+    center = src[..., radius:rows-radius, radius:cols-radius].astype(np.float32)
+    dst = np.zeros(center.shape, dtype=np.int32)
+    eps = np.finfo(np.float32).eps
+
+    for n in range(neighbors):
+        # Sample points and bilinear weights are computed in single precision like OpenCV
+        x = np.float32(radius * np.cos(2.0 * np.pi * n / float(neighbors)))
+        y = np.float32(-radius * np.sin(2.0 * np.pi * n / float(neighbors)))
+        fx, fy = int(np.floor(x)), int(np.floor(y))
+        cx, cy = int(np.ceil(x)), int(np.ceil(y))
+        ty = np.float32(y - fy)
+        tx = np.float32(x - fx)
+        w1 = np.float32((1 - tx) * (1 - ty))
+        w2 = np.float32(tx * (1 - ty))
+        w3 = np.float32((1 - tx) * ty)
+        w4 = np.float32(tx * ty)
+
+        def shifted(dy, dx):
+            return src[..., radius+dy:rows-radius+dy, radius+dx:cols-radius+dx].astype(np.float32)
+
+        t = w1 * shifted(fy, fx) + w2 * shifted(fy, cx) + w3 * shifted(cy, fx) + w4 * shifted(cy, cx)
+        dst += (((t > center) | (np.abs(t - center) < eps)).astype(np.int32) << n)
+
+    return dst
+
+def spatial_histogram(lbp_image, num_patterns, grid_x=GRID_X, grid_y=GRID_Y):
+    """Concatenate the normalized pattern histograms of a grid of cells over one or more LBP images"""
+    lbp_image = np.asarray(lbp_image)
+    batch_shape = lbp_image.shape[:-2]
+    rows, cols = lbp_image.shape[-2:]
+    width = cols // grid_x
+    height = rows // grid_y
+    num_images = int(np.prod(batch_shape, dtype=np.int64))
+    num_cells = grid_y * grid_x
+    result = np.zeros((num_images, num_cells, num_patterns), dtype=np.float32)
+    if width == 0 or height == 0:
+        return result.reshape(batch_shape + (-1,))
+
+    # Crop to whole cells and count every cell's patterns with a single bincount
+    cells = lbp_image[..., :grid_y*height, :grid_x*width].reshape(num_images, grid_y, height, grid_x, width)
+    cell_index = (np.arange(num_images).reshape(-1, 1, 1, 1, 1) * num_cells
+                  + np.arange(num_cells).reshape(1, grid_y, 1, grid_x, 1))
+    counts = np.bincount((cell_index * num_patterns + cells).ravel(),
+                         minlength=num_images * num_cells * num_patterns)
+    result[:] = counts.reshape(num_images, num_cells, num_patterns) / np.float32(width * height)
+    return result.reshape(batch_shape + (-1,))
+
+def compute_histogram(face_img, radius=RADIUS, neighbors=NEIGHBORS, grid_x=GRID_X, grid_y=GRID_Y):
+    """Compute the LBPH feature vector of a grayscale face image or a stack of same-sized images"""
+    lbp_image = elbp(face_img, radius, neighbors)
+    return spatial_histogram(lbp_image, 2 ** neighbors, grid_x, grid_y)
+
+def chi_square_distances(histograms, queries, max_elements=1 << 22):
+    """Compute the alternative chi-square distance between every query and every stored histogram
+
+    Returns a (num_queries, num_histograms) matrix, matching
+    cv2.compareHist(stored, query, cv2.HISTCMP_CHISQR_ALT).
+    """
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float64))
+    distances = np.empty((len(queries), len(histograms)), dtype=np.float64)
+    if len(histograms) == 0 or len(queries) == 0:
+        return distances
+
+    # Work through the gallery in chunks to bound temporary memory
+    chunk_size = max(1, max_elements // (len(queries) * queries.shape[1]))
+    eps = np.finfo(np.float64).eps
+    for start in range(0, len(histograms), chunk_size):
+        chunk = np.asarray(histograms[start:start+chunk_size], dtype=np.float64)[np.newaxis, :, :]
+        a = chunk - queries[:, np.newaxis, :]
+        b = chunk + queries[:, np.newaxis, :]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            terms = np.where(b > eps, a * a / b, 0.0)
+        distances[:, start:start+chunk.shape[1]] = 2 * terms.sum(axis=2)
+
+    return distances
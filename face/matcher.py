@@ -0,0 +1,137 @@
+"""Batched LBPH matching.
+
+LBPHFaceRecognizer.predict compares one face with every stored histogram
+using the chi-square distance. LBPHMatcher computes the histograms of all the
+faces in a frame at once and finds their nearest samples with a single
+matrix product, then computes exact chi-square distances only where needed.
+
+The matrix product gives the squared Hellinger distance
+H = sum((sqrt(a) - sqrt(b))^2) of every face to every sample. Term by term
+2 * H <= chi-square <= 4 * H, so once the exact distances of the closest
+samples by H are known, every sample whose lower bound 2 * H is above the
+k-th best exact distance can be skipped. The results are identical to
+LBPHFaceRecognizer.predict.
+
+For large galleries an optional GalleryIndex narrows the search to a fixed
+number of candidates before the exact distances are computed. This trades a
+small loss of recall for a cost that no longer grows with the gallery.
+"""
+import sys
+import numpy as np
+from config.db_config import GALLERY_INDEX_MIN_SAMPLES
+from face.index import load_or_build_index
+from face.lbph import compute_histogram, chi_square_distances
+from face.model_store import DELETED_LABEL
+from face.preprocess import FaceNormalizer
+
+# Relative slack on the lower bound to absorb float32 rounding in the matrix product
+BOUND_SLACK = 1e-3
+
+class LBPHMatcher:
+    def __init__(self, model, use_index=False, model_file=None, index_file=None):
+        self.model = model
+        self.labels = np.asarray(model.labels)
+        self.active = np.flatnonzero(self.labels != DELETED_LABEL)
+        self._sqrt_histograms = None
+        self._histogram_sums = None
+        # Faces must be prepared the way the model's samples were
+        self.normalizer = FaceNormalizer.for_model(model)
+
+        # Small galleries are always searched exactly
+        self.index = None
+        if use_index and len(self.active) >= GALLERY_INDEX_MIN_SAMPLES:
+            self.index = load_or_build_index(model.histograms, self.active, model_file, index_file)
+
+    def _prepare_gallery(self):
+        """Compute the square roots and sums of the stored histograms once"""
+        if self._sqrt_histograms is None:
+            histograms = np.asarray(self.model.histograms[self.active], dtype=np.float32)
+            self._sqrt_histograms = np.sqrt(histograms)
+            self._histogram_sums = histograms.sum(axis=1, dtype=np.float64)
+
+    def warm(self):
+        """Read the gallery and prepare it for searching, so the first search does not wait for it"""
+        if self.index is None:
+            self._prepare_gallery()
+
+    def compute_histograms(self, face_imgs):
+        """Compute the LBPH histograms of a list of face images, batching images of the same size"""
+        model = self.model
+        histograms = np.zeros((len(face_imgs), model.hist_size), dtype=np.float32)
+
+        by_shape = {}
+        for i, face_img in enumerate(face_imgs):
+            by_shape.setdefault(np.shape(face_img), []).append(i)
+
+        for indices in by_shape.values():
+            stack = np.stack([face_imgs[i] for i in indices])
+            histograms[indices] = compute_histogram(stack, model.radius, model.neighbors,
+                                                    model.grid_x, model.grid_y)
+        return histograms
+
+    def match_histograms(self, queries, k=1):
+        """Find the k nearest samples of every query histogram
+
+        Returns (labels, distances), both of shape (len(queries), k), sorted
+        by distance. Slots without a sample under the model threshold hold
+        label -1 and distance sys.float_info.max, like LBPHFaceRecognizer.predict.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        labels = np.full((len(queries), k), -1, dtype=np.int64)
+        distances = np.full((len(queries), k), sys.float_info.max)
+        if len(self.active) == 0 or len(queries) == 0:
+            return labels, distances
+
+        if self.index is not None:
+            for q, candidates in enumerate(self.index.search(queries)):
+                exact = chi_square_distances(self.model.histograms[self.active[candidates]],
+                                             queries[q])[0]
+                self._select(q, candidates, exact, labels, distances)
+            return labels, distances
+
+        self._prepare_gallery()
+        histograms = self.model.histograms
+        query_sums = queries.sum(axis=1, dtype=np.float64)
+        hellinger = (self._histogram_sums[np.newaxis, :] + query_sums[:, np.newaxis]
+                     - 2 * (np.sqrt(queries) @ self._sqrt_histograms.T))
+        lower_bounds = 2 * hellinger
+
+        shortlist_size = min(len(self.active), k)
+        for q in range(len(queries)):
+            # Exact distances of the closest samples by Hellinger distance
+            order = np.argpartition(hellinger[q], shortlist_size - 1)[:shortlist_size]
+            exact = chi_square_distances(histograms[self.active[order]], queries[q])[0]
+            kth = np.sort(exact)[-1]
+
+            # Any other sample that could still beat the k-th best distance
+            remaining = np.ones(len(self.active), dtype=bool)
+            remaining[order] = False
+            extra = np.flatnonzero(remaining & (lower_bounds[q] * (1 - BOUND_SLACK) <= kth))
+            if len(extra):
+                order = np.concatenate([order, extra])
+                exact = np.concatenate([exact, chi_square_distances(histograms[self.active[extra]],
+                                                                    queries[q])[0]])
+
+            self._select(q, order, exact, labels, distances)
+
+        return labels, distances
+
+    def _select(self, q, positions, exact, labels, distances):
+        """Fill the k best of the exactly compared samples into row q of the results"""
+        k = labels.shape[1]
+        # Ties are broken by sample order, like the linear scan in OpenCV
+        best = np.lexsort((positions, exact))[:k]
+        best = best[exact[best] < self.model.threshold]
+        labels[q, :len(best)] = self.labels[self.active[positions[best]]]
+        distances[q, :len(best)] = exact[best]
+
+    def match(self, face_imgs, k=1):
+        """Find the k nearest samples of every face image in one batch"""
+        if len(face_imgs) == 0:
+            return np.empty((0, k), dtype=np.int64), np.empty((0, k))
+        return self.match_histograms(self.compute_histograms(face_imgs), k)
+
+    def predict(self, face_img):
+        """Predict the label and distance of a single face like LBPHFaceRecognizer.predict"""
+        labels, distances = self.match([face_img])
+        return int(labels[0, 0]), float(distances[0, 0])
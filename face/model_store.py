@@ -0,0 +1,293 @@
+"""Binary LBPH model store.
+
+A model file is a fixed-size header followed by every sample histogram as one
+contiguous float32 array and then the int32 label of every sample:
+
+    header | histograms (num_samples x hist_size float32) | labels (num_samples int32)
+
+The arrays are opened with np.memmap, so loading does not depend on the size
+of the gallery and processes reading the same file share its pages. Adding
+samples copies the file with the new samples appended, and removing them
+copies it with their labels set to DELETED_LABEL; the next full training
+writes the file without them.
+
+The header also records how face crops were normalized before training, so
+recognition can prepare faces the same way. Files written before
+normalization existed have zeros there, meaning crops were used as detected.
+
+Model files are never modified in place. Every change is written to a
+temporary file that is renamed over the model once complete, with a version
+stamp in the header one higher than the file it replaces. Readers see either
+the old or the new file, never a partly written one, and a process that has
+the old file mapped keeps reading it unchanged until it loads the new version.
+Publishers hold an exclusive lock on a .lock file next to the model, so
+concurrent changes, e.g. enrolling a user during a retrain, are applied one
+after the other and each gets its own version.
+
+Replacing a model that other processes have mapped is only possible on
+POSIX systems. Windows refuses to replace a file that is open or mapped, so
+there a new version can only be published once no recognizer has the model
+loaded; publishing waits REPLACE_TIMEOUT seconds for that and then fails.
+"""
+import cv2
+import os
+import shutil
+import struct
+import tempfile
+import time
+from contextlib import contextmanager
+import sys
+import numpy as np
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+from face.lbph import RADIUS, NEIGHBORS, GRID_X, GRID_Y
+
+MAGIC = b'LBPHMDL\0'
+FORMAT_VERSION = 1
+# magic, format version, radius, neighbors, grid_x, grid_y, num_samples, hist_size, threshold
+HEADER = struct.Struct('<8sIiiiiQQd')
+# face size, normalization flags; stored in the header padding after HEADER
+PREPROCESSING = struct.Struct('<iI')
+# version stamp, incremented by every change to the file; stored after PREPROCESSING
+VERSION = struct.Struct('<I')
+VERSION_OFFSET = HEADER.size + PREPROCESSING.size
+HEADER_SIZE = 64
+EQUALIZE_FLAG = 1
+ALIGN_FLAG = 2
+DELETED_LABEL = -1
+
+class LBPHModel:
+    """LBPH model parameters with its sample histograms and labels"""
+    def __init__(self, histograms, labels, radius=RADIUS, neighbors=NEIGHBORS,
+                 grid_x=GRID_X, grid_y=GRID_Y, threshold=sys.float_info.max,
+                 face_size=0, equalize=False, align=False, version=0):
+        self.histograms = histograms
+        self.labels = labels
+        self.radius = radius
+        self.neighbors = neighbors
+        self.grid_x = grid_x
+        self.grid_y = grid_y
+        self.threshold = threshold
+        # Normalization applied to face crops before their histograms were computed
+        self.face_size = face_size
+        self.equalize = equalize
+        self.align = align
+        # Version stamp of the file the model was read from
+        self.version = version
+
+    @property
+    def hist_size(self):
+        """Length of a single sample histogram"""
+        return self.grid_x * self.grid_y * 2 ** self.neighbors
+
+    def __len__(self):
+        return len(self.labels)
+
+def _pack_header(model, num_samples):
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, model.radius, model.neighbors,
+                         model.grid_x, model.grid_y, num_samples, model.hist_size, model.threshold)
+    flags = (EQUALIZE_FLAG if model.equalize else 0) | (ALIGN_FLAG if model.align else 0)
+    header += PREPROCESSING.pack(model.face_size, flags)
+    header += VERSION.pack(model.version)
+    return header.ljust(HEADER_SIZE, b'\0')
+
+def _read_header(f):
+    header = f.read(HEADER_SIZE)
+    magic, version, radius, neighbors, grid_x, grid_y, num_samples, hist_size, threshold = \
+        HEADER.unpack(header[:HEADER.size])
+    face_size, flags = PREPROCESSING.unpack(header[HEADER.size:VERSION_OFFSET])
+    stamp, = VERSION.unpack(header[VERSION_OFFSET:VERSION_OFFSET + VERSION.size])
+    if magic != MAGIC:
+        raise ValueError("Not an LBPH model file")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported model format version {version}")
+    params = {'radius': radius, 'neighbors': neighbors, 'grid_x': grid_x,
+              'grid_y': grid_y, 'threshold': threshold, 'face_size': face_size,
+              'equalize': bool(flags & EQUALIZE_FLAG), 'align': bool(flags & ALIGN_FLAG), 'version': stamp}
+    return params, num_samples, hist_size
+
+def model_version(path):
+    """Return the version stamp of a model file, or None if there is no readable model"""
+    try:
+        with open(path, 'rb') as f:
+            return _read_header(f)[0]['version']
+    except (OSError, ValueError, struct.error):
+        return None
+
+# Seconds to keep trying to replace a model file that Windows reports as in use
+REPLACE_TIMEOUT = 5.0
+
+@contextmanager
+def _model_lock(path):
+    """Hold the exclusive publishing lock of a model file"""
+    with open(path + '.lock', 'a+b') as lock:
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        else:
+            # LK_LOCK gives up after about 10 seconds, so keep trying until the lock is ours
+            lock.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+        try:
+            yield
+        finally:
+            if not fcntl:
+                lock.seek(0)
+                msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+
+def _replace(tmp_path, path):
+    """Rename a file over path, retrying while Windows reports path as in use"""
+    deadline = time.monotonic() + REPLACE_TIMEOUT
+    while True:
+        try:
+            os.replace(tmp_path, path)
+            return
+        except PermissionError as e:
+            if os.name != 'nt':
+                raise
+            if time.monotonic() >= deadline:
+                raise PermissionError(f"Cannot replace {path} while another process has it loaded; "
+                                      f"stop recognition to publish a new model") from e
+            time.sleep(0.05)
+
+class _Unchanged(Exception):
+    """Raised in a _publishing block to leave the model file as it is"""
+
+@contextmanager
+def _publishing(path, copy=False):
+    """Yield a temporary path to write a new version of a model file to, then publish it
+
+    With copy set, the temporary file starts as a copy of the current one.
+    When the block completes, the next version stamp is written into the
+    temporary file, which is flushed to disk and renamed over path. The
+    model's lock is held from reading the current version to the rename.
+    """
+    directory = os.path.dirname(path) or '.'
+    with _model_lock(path):
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', prefix=os.path.basename(path) + '.', dir=directory)
+        os.close(fd)
+        try:
+            version = (model_version(path) or 0) + 1
+            if copy:
+                shutil.copyfile(path, tmp_path)
+            if os.path.exists(path):
+                shutil.copymode(path, tmp_path)
+            else:
+                os.chmod(tmp_path, 0o644)
+            try:
+                yield tmp_path
+            except _Unchanged:
+                return
+            with open(tmp_path, 'r+b') as f:
+                f.seek(VERSION_OFFSET)
+                f.write(VERSION.pack(version))
+                f.flush()
+                os.fsync(f.fileno())
+            _replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+def save_model(path, model):
+    """Publish a complete model file"""
+    histograms = np.ascontiguousarray(model.histograms, dtype=np.float32).reshape(-1, model.hist_size)
+    labels = np.ascontiguousarray(model.labels, dtype=np.int32).ravel()
+
+    with _publishing(path) as tmp_path, open(tmp_path, 'wb') as f:
+        f.write(_pack_header(model, len(labels)))
+        f.write(histograms.tobytes())
+        f.write(labels.tobytes())
+
+def load_model(path):
+    """Open a model file with its histograms and labels memory-mapped read-only"""
+    with open(path, 'rb') as f:
+        params, num_samples, hist_size = _read_header(f)
+
+    if num_samples == 0:
+        histograms = np.empty((0, hist_size), dtype=np.float32)
+        labels = np.empty(0, dtype=np.int32)
+    else:
+        histograms = np.memmap(path, dtype=np.float32, mode='r', offset=HEADER_SIZE,
+                               shape=(num_samples, hist_size))
+        labels = np.memmap(path, dtype=np.int32, mode='r',
+                           offset=HEADER_SIZE + num_samples * hist_size * 4, shape=(num_samples,))
+    return LBPHModel(histograms, labels, **params)
+
+def append_samples(path, histograms, labels, replace=False):
+    """Publish a model file with samples appended, without recomputing the stored histograms
+
+    With replace set, samples already stored under the new labels are marked
+    as deleted in the same version.
+    """
+    labels = np.ascontiguousarray(labels, dtype=np.int32).ravel()
+
+    with _publishing(path, copy=True) as tmp_path, open(tmp_path, 'r+b') as f:
+        params, num_samples, hist_size = _read_header(f)
+        histograms = np.ascontiguousarray(histograms, dtype=np.float32)
+        if histograms.size != len(labels) * hist_size:
+            raise ValueError("Histogram size does not match the model")
+
+        # Keep the existing labels, then overwrite them with the new histograms
+        labels_offset = HEADER_SIZE + num_samples * hist_size * 4
+        f.seek(labels_offset)
+        stored_labels = np.frombuffer(f.read(num_samples * 4), dtype=np.int32)
+        if replace:
+            stored_labels = np.where(np.isin(stored_labels, labels), DELETED_LABEL, stored_labels).astype(np.int32)
+
+        f.seek(labels_offset)
+        f.write(histograms.tobytes())
+        f.write(stored_labels.tobytes())
+        f.write(labels.tobytes())
+        f.truncate()
+
+        f.seek(0)
+        f.write(_pack_header(LBPHModel(None, None, **params), num_samples + len(labels)))
+
+def remove_samples(path, label):
+    """Publish a model file with every sample of a label marked as deleted and return how many were removed
+
+    The file is left as it is if the label has no samples.
+    """
+    removed = 0
+    with _publishing(path, copy=True) as tmp_path:
+        with open(tmp_path, 'r+b') as f:
+            _, num_samples, hist_size = _read_header(f)
+            labels_offset = HEADER_SIZE + num_samples * hist_size * 4
+            f.seek(labels_offset)
+            labels = np.frombuffer(f.read(num_samples * 4), dtype=np.int32).copy()
+
+            removed = int(np.count_nonzero(labels == label))
+            labels[labels == label] = DELETED_LABEL
+            f.seek(labels_offset)
+            f.write(labels.tobytes())
+        if not removed:
+            raise _Unchanged()
+    return removed
+
+def convert_yml_model(yml_path, model_path):
+    """Convert a trainer.yml written by LBPHFaceRecognizer.save to the binary format"""
+    face_recognizer = cv2.face.LBPHFaceRecognizer_create()
+    face_recognizer.read(yml_path)
+    histograms = face_recognizer.getHistograms()
+    model = LBPHModel(np.array([h.ravel() for h in histograms], dtype=np.float32),
+                      face_recognizer.getLabels().ravel(),
+                      face_recognizer.getRadius(), face_recognizer.getNeighbors(),
+                      face_recognizer.getGridX(), face_recognizer.getGridY(),
+                      face_recognizer.getThreshold())
+    save_model(model_path, model)
+    return model
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python -m face.model_store <trainer.yml> <model file>")
+        sys.exit(1)
+    converted = convert_yml_model(sys.argv[1], sys.argv[2])
+    print(f"Converted {len(converted)} samples to {sys.argv[2]}")
@@ -0,0 +1,322 @@
+import heapq
+import queue
+import threading
+import time
+import cv2
+from concurrent.futures import ThreadPoolExecutor
+from config.db_config import (PIPELINE_DETECT_WORKERS, PIPELINE_RECOGNIZE_WORKERS,
+                              PIPELINE_QUEUE_SIZE, RECOGNITION_THRESHOLD)
+from face.detector import FaceDetector
+from face.tracker import FaceTracker, UNKNOWN
+from utils.metrics import metrics
+
+# Seconds a stage waits on its queue before checking whether it should stop
+POLL_INTERVAL = 0.1
+# Seconds over which the frame rate of each source is measured
+FPS_INTERVAL = 1.0
+
+def parse_source(spec):
+    """Camera device index for an integer or a string of digits, otherwise a file name or URL"""
+    if isinstance(spec, str) and spec.strip().isdigit():
+        return int(spec)
+    return spec
+
+class VideoSource:
+    """One camera, video file or stream watched by the pipeline, with its own tracker
+
+    Frames from cameras and streams are dropped when processing falls behind,
+    frames from video files are all processed unless drop_frames says otherwise.
+    A source given its own matcher, such as the gallery of the groups seen at
+    its entrance, uses it instead of the pipeline's.
+    """
+    def __init__(self, spec, capture=None, tracker=None, drop_frames=None, matcher=None):
+        self.spec = parse_source(spec)
+        self.name = str(self.spec)
+        self.capture = capture if capture is not None else cv2.VideoCapture(self.spec)
+        self.tracker = tracker or FaceTracker()
+        self.matcher = matcher
+        if drop_frames is None:
+            drop_frames = isinstance(self.spec, int) or '://' in str(self.spec)
+        self.drop_frames = drop_frames
+
+        self.frames_captured = 0
+        self.frames_dropped = 0
+        self.frames_processed = 0
+        self.fps = 0.0
+        self._fps_frames = 0
+        self._fps_start = time.monotonic()
+
+    def is_opened(self):
+        return self.capture.isOpened()
+
+    def release(self):
+        self.capture.release()
+
+    def _count_processed(self):
+        """Count a processed frame and update the frame rate once per interval"""
+        self.frames_processed += 1
+        self._fps_frames += 1
+        elapsed = time.monotonic() - self._fps_start
+        if elapsed >= FPS_INTERVAL:
+            self.fps = self._fps_frames / elapsed
+            self._fps_frames, self._fps_start = 0, time.monotonic()
+            metrics.set_gauge('attendance_fps', self.fps, source=self.name)
+
+class AttendancePipeline:
+    """Capture, detection and recognition for several video sources, running concurrently
+
+    A capture thread per source reads frames into that source's bounded
+    queue, replacing the oldest waiting frame when detection falls behind a
+    live source so latency does not build up. One pool of detection threads,
+    each with its own detector per source, takes frames from the sources in
+    turn, so a fast camera or a video file cannot starve the others. A
+    dispatch thread puts each source's detections back in frame order,
+    updates the source's tracker and hands the faces that need recognition
+    to a shared pool of recognition threads. read() returns the frames of
+    all sources, each source's in order, with their tracks, for the caller
+    to display and record.
+
+    All sources share one matcher, so the model is loaded once however many
+    cameras there are. OpenCV and NumPy release the GIL while they work, so
+    the detection and recognition threads run on several cores. Detectors
+    are taken from detector_pool if given, so a later pipeline reuses the
+    detectors an earlier one loaded.
+    """
+    def __init__(self, sources, matcher, detect_workers=PIPELINE_DETECT_WORKERS,
+                 recognize_workers=PIPELINE_RECOGNIZE_WORKERS, queue_size=PIPELINE_QUEUE_SIZE,
+                 detector_pool=None):
+        self.sources = list(sources)
+        self.matcher = matcher
+        # Detectors are taken from the pool before new ones are loaded, and put back when the workers stop
+        self.detector_pool = detector_pool if detector_pool is not None else queue.SimpleQueue()
+        self.detect_workers = detect_workers
+        self.recognize_workers = recognize_workers
+
+        self.frames = [queue.Queue(queue_size) for _ in self.sources]
+        self.detections = queue.Queue(queue_size * len(self.sources))
+        self.results = queue.Queue(queue_size * len(self.sources))
+        self._reorder = [[] for _ in self.sources]
+
+        self._stop = threading.Event()
+        # Detection threads wait on this for a frame from any source
+        self._frame_ready = threading.Condition()
+        self._next_source = 0
+        self._next_seq = [0] * len(self.sources)
+        self._tracker_lock = threading.Lock()
+        self._executor = None
+        self._capture_threads = []
+        self._detect_threads = []
+        self._dispatch_thread = None
+
+    @property
+    def frames_captured(self):
+        return sum(source.frames_captured for source in self.sources)
+
+    @property
+    def frames_dropped(self):
+        return sum(source.frames_dropped for source in self.sources)
+
+    @property
+    def frames_processed(self):
+        return sum(source.frames_processed for source in self.sources)
+
+    def start(self):
+        """Start the pipeline threads"""
+        self._executor = ThreadPoolExecutor(self.recognize_workers, thread_name_prefix='recognize')
+        self._capture_threads = [
+            threading.Thread(target=self._capture, args=(i,), name=f'capture-{source.name}', daemon=True)
+            for i, source in enumerate(self.sources)
+        ]
+        self._detect_threads = [
+            threading.Thread(target=self._detect, name=f'detect-{i}', daemon=True)
+            for i in range(self.detect_workers)
+        ]
+        self._dispatch_thread = threading.Thread(target=self._dispatch, name='dispatch', daemon=True)
+        for thread in [*self._capture_threads, *self._detect_threads, self._dispatch_thread]:
+            thread.start()
+
+        for stage in self.queue_depths():
+            metrics.set_gauge('attendance_queue_depth', lambda stage=stage: self.queue_depths()[stage],
+                              stage=stage)
+
+    def stop(self):
+        """Stop the pipeline threads, discarding frames still in flight"""
+        self._stop.set()
+        with self._frame_ready:
+            self._frame_ready.notify_all()
+        for thread in [*self._capture_threads, *self._detect_threads, self._dispatch_thread]:
+            if thread:
+                thread.join()
+        if self._executor:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def queue_depths(self):
+        """Number of items waiting in front of each stage"""
+        return {
+            'detect': sum(frames.qsize() for frames in self.frames),
+            'recognize': self.detections.qsize() + sum(len(reorder) for reorder in self._reorder),
+            'display': self.results.qsize(),
+        }
+
+    def read(self, timeout=None):
+        """Return the next processed (source, frame, faces, tracks), or None when all sources have ended
+
+        Raises queue.Empty if no frame is ready within timeout seconds.
+        """
+        item = self.results.get(timeout=timeout)
+        if item is None:
+            # Leave the end marker for any later call
+            self.results.put(None)
+            return None
+
+        source, frame, faces, tracks, pending, future = item
+        if future:
+            try:
+                user_ids, confidences = future.result()
+            except Exception as e:
+                print(f"Error in recognition: {e}")
+                user_ids, confidences = [[UNKNOWN]] * len(pending), [[float('inf')]] * len(pending)
+
+            with self._tracker_lock:
+                for i, (user_id,), (confidence,) in zip(pending, user_ids, confidences):
+                    # Lower confidence is better in LBPH
+                    if confidence >= RECOGNITION_THRESHOLD:
+                        user_id = UNKNOWN
+                    source.tracker.add_prediction(tracks[i], int(user_id), float(confidence))
+
+        source._count_processed()
+        return source, frame, faces, tracks
+
+    def _put(self, target, item):
+        """Put an item on a full queue, waiting until there is room or the pipeline stops"""
+        while not self._stop.is_set():
+            try:
+                target.put(item, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _capture(self, index):
+        source = self.sources[index]
+        frames = self.frames[index]
+        try:
+            while not self._stop.is_set():
+                with metrics.timer('capture'):
+                    ret, frame = source.capture.read()
+                if not ret:
+                    break
+                source.frames_captured += 1
+
+                if not source.drop_frames:
+                    self._put(frames, frame)
+                else:
+                    # Replace the oldest waiting frame rather than fall behind the camera
+                    while True:
+                        try:
+                            frames.put_nowait(frame)
+                            break
+                        except queue.Full:
+                            try:
+                                frames.get_nowait()
+                                source.frames_dropped += 1
+                                metrics.inc('attendance_frames_dropped_total', source=source.name)
+                            except queue.Empty:
+                                pass
+                with self._frame_ready:
+                    self._frame_ready.notify()
+        finally:
+            with self._frame_ready:
+                self._frame_ready.notify_all()
+
+    def _take_frame(self):
+        """Take the next frame, visiting the sources in turn; called holding _frame_ready"""
+        for offset in range(len(self.sources)):
+            index = (self._next_source + offset) % len(self.sources)
+            try:
+                frame = self.frames[index].get_nowait()
+            except queue.Empty:
+                continue
+            self._next_source = index + 1
+            # Frames are numbered as they are taken so the dispatcher can restore their order
+            seq = self._next_seq[index]
+            self._next_seq[index] += 1
+            return index, seq, frame
+        return None
+
+    def _detect(self):
+        # Each source keeps its own detector, which remembers where that source's faces were
+        detectors = {}
+        try:
+            while not self._stop.is_set():
+                with self._frame_ready:
+                    item = self._take_frame()
+                    if item is None:
+                        if not any(thread.is_alive() for thread in self._capture_threads) \
+                                and all(frames.empty() for frames in self.frames):
+                            return
+                        self._frame_ready.wait(POLL_INTERVAL)
+                        continue
+                index, seq, frame = item
+
+                if index not in detectors:
+                    detectors[index] = self._take_detector()
+                try:
+                    with metrics.timer('detect'):
+                        gray, faces = detectors[index].detect_faces(frame)
+                except Exception as e:
+                    # The frame still goes through so the frames behind it are not held up
+                    print(f"Error in detection: {e}")
+                    gray, faces = None, []
+                self._put(self.detections, (index, seq, frame, gray, faces))
+        finally:
+            for detector in detectors.values():
+                self.detector_pool.put(detector)
+
+    def _take_detector(self):
+        try:
+            detector = self.detector_pool.get_nowait()
+        except queue.Empty:
+            return FaceDetector()
+        detector.reset()
+        return detector
+
+    def _dispatch(self):
+        expected = [0] * len(self.sources)
+        while not self._stop.is_set():
+            try:
+                index, seq, frame, gray, faces = self.detections.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if not any(thread.is_alive() for thread in self._detect_threads) and self.detections.empty():
+                    break
+                continue
+
+            reorder = self._reorder[index]
+            heapq.heappush(reorder, (seq, frame, gray, faces))
+            while reorder and reorder[0][0] == expected[index]:
+                _, frame, gray, faces = heapq.heappop(reorder)
+                expected[index] += 1
+                self._put(self.results, self._recognize(self.sources[index], frame, gray, faces))
+        self._put(self.results, None)
+
+    def _recognize(self, source, frame, gray, faces):
+        """Update the source's tracker and start recognizing the faces that need it"""
+        tracker = source.tracker
+        with self._tracker_lock:
+            tracks = tracker.update(faces)
+            pending = [i for i, track in enumerate(tracks) if tracker.needs_recognition(track)]
+            for i in pending:
+                tracker.start_recognition(tracks[i])
+
+        future = None
+        if pending:
+            matcher = source.matcher or self.matcher
+            face_imgs = matcher.normalizer.crop(gray, [faces[i] for i in pending])
+            metrics.inc('attendance_recognitions_total', len(pending))
+            future = self._executor.submit(self._match, matcher, face_imgs)
+        return source, frame, faces, tracks, pending, future
+
+    def _match(self, matcher, face_imgs):
+        with metrics.timer('recognize'):
+            return matcher.match(face_imgs)
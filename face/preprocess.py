@@ -0,0 +1,104 @@
+import math
+import cv2
+from config.db_config import FACE_SIZE, FACE_EQUALIZE, FACE_ALIGN
+
+EYE_CASCADE_FILE = cv2.data.haarcascades + 'haarcascade_eye.xml'
+# Larger tilts between the detected eyes are taken to be false eye detections
+MAX_ALIGN_ANGLE = 30
+
+_eye_cascade = None
+
+def _eye_classifier():
+    global _eye_cascade
+    if _eye_cascade is None:
+        _eye_cascade = cv2.CascadeClassifier(EYE_CASCADE_FILE)
+    return _eye_cascade
+
+def find_eyes(face_img, top=0.5, scale_factor=1.1, min_neighbors=5):
+    """Return the centers of the left and right eye of a grayscale face crop, or None if both are not found
+
+    Eyes are searched in the top fraction of the crop; of several
+    detections, the two largest are taken to be the eyes.
+    """
+    height, width = face_img.shape[:2]
+    min_eye = max(8, width // 10)
+    eyes = _eye_classifier().detectMultiScale(face_img[:int(height * top)], scale_factor, min_neighbors,
+                                              minSize=(min_eye, min_eye))
+    if len(eyes) < 2:
+        return None
+
+    # The two largest detections, from left to right
+    eyes = sorted(sorted(eyes, key=lambda eye: eye[2] * eye[3], reverse=True)[:2], key=lambda eye: eye[0])
+    (lx, ly, lw, lh), (rx, ry, rw, rh) = eyes
+    left = (lx + lw / 2, ly + lh / 2)
+    right = (rx + rw / 2, ry + rh / 2)
+    if right[0] - left[0] < width / 5:
+        # Both detections are on the same eye
+        return None
+    return left, right
+
+class FaceNormalizer:
+    """Canonical preprocessing of face crops, shared by capture, training and recognition
+
+    Crops are optionally rotated so the eyes are level, resized to a square
+    of size pixels and optionally histogram-equalized. A size of 0 leaves
+    crops at their detected size, which is what models trained before
+    normalization existed expect.
+    """
+    def __init__(self, size=FACE_SIZE, equalize=FACE_EQUALIZE, align=FACE_ALIGN):
+        self.size = size
+        self.equalize = equalize
+        self.align = align
+        if align:
+            # Loaded now so the first face does not wait for it
+            _eye_classifier()
+
+    @classmethod
+    def for_model(cls, model):
+        """Create the normalizer a model's samples were prepared with"""
+        return cls(model.face_size, model.equalize, model.align)
+
+    def settings(self):
+        """(size, equalize, align), for comparing normalizers"""
+        return self.size, bool(self.equalize), bool(self.align)
+
+    def matches(self, model):
+        """Whether a model was trained with these settings"""
+        return self.settings() == (model.face_size, bool(model.equalize), bool(model.align))
+
+    def apply_to(self, model):
+        """Record these settings in a model that is about to be saved"""
+        model.face_size, model.equalize, model.align = self.settings()
+        return model
+
+    def normalize(self, face_img):
+        """Return the canonical version of a grayscale face crop"""
+        if self.align:
+            face_img = self._align(face_img)
+        if self.size and face_img.shape[:2] != (self.size, self.size):
+            shrinking = face_img.shape[0] > self.size
+            face_img = cv2.resize(face_img, (self.size, self.size),
+                                  interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR)
+        if self.equalize:
+            face_img = cv2.equalizeHist(face_img)
+        return face_img
+
+    def crop(self, gray, faces):
+        """Cut the detected faces out of a grayscale frame and normalize them"""
+        return [self.normalize(gray[y:y+h, x:x+w]) for (x, y, w, h) in faces]
+
+    def _align(self, face_img):
+        """Rotate a face crop so that its eyes are level, if both eyes are found"""
+        height, width = face_img.shape[:2]
+        eyes = find_eyes(face_img)
+        if eyes is None:
+            return face_img
+
+        left, right = eyes
+        angle = math.degrees(math.atan2(right[1] - left[1], right[0] - left[0]))
+        if abs(angle) > MAX_ALIGN_ANGLE:
+            return face_img
+        center = ((left[0] + right[0]) / 2, (left[1] + right[1]) / 2)
+        matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
+        return cv2.warpAffine(face_img, matrix, (width, height), flags=cv2.INTER_LINEAR,
+                              borderMode=cv2.BORDER_REPLICATE)
@@ -0,0 +1,198 @@
+"""Quality scoring and selection of face samples.
+
+Every extra sample of a user adds a histogram that each LBPH prediction
+compares against, so a user's samples should be few, sharp, frontal and
+different from each other. Faces are scored on a standardized copy, resized
+to QUALITY_SIZE pixels and equalized, so scores do not depend on the face
+size or the normalization settings:
+
+- sharpness is the variance of the Laplacian, which drops when a face is
+  out of focus or moved during the exposure;
+- pose is judged from the eyes: both must be found, level and centered,
+  which fails when the head is turned or tilted;
+- near-duplicates are found with a difference hash, one bit per pair of
+  neighbouring pixels of a HASH_SIZE x HASH_SIZE thumbnail, compared by the
+  number of differing bits.
+
+Run python -m face.quality to compact the saved faces of every user.
+"""
+import argparse
+import os
+import cv2
+import numpy as np
+from config.db_config import (FACES_DIR, MODEL_FILE, CAPTURE_SAMPLES, CAPTURE_MIN_SAMPLES,
+                              CAPTURE_MIN_SHARPNESS, CAPTURE_MAX_EYE_OFFSET, CAPTURE_MAX_EYE_TILT,
+                              CAPTURE_DUPLICATE_DISTANCE)
+from face.preprocess import find_eyes
+
+QUALITY_SIZE = 100
+HASH_SIZE = 16
+
+# Reasons a face is not kept
+BLURRY = 'blurry'
+TURNED = 'turned'
+DUPLICATE = 'duplicate'
+
+def standardize(face_img):
+    """Resize and equalize a grayscale face crop for scoring"""
+    if face_img.shape[:2] != (QUALITY_SIZE, QUALITY_SIZE):
+        face_img = cv2.resize(face_img, (QUALITY_SIZE, QUALITY_SIZE), interpolation=cv2.INTER_AREA)
+    return cv2.equalizeHist(face_img)
+
+def sharpness(face_img):
+    """Variance of the Laplacian of a standardized face"""
+    return float(cv2.Laplacian(face_img, cv2.CV_64F).var())
+
+def eye_pose(face_img):
+    """Return (offset, tilt) of the eyes of a standardized face, or None if two eyes are not found
+
+    offset is the horizontal distance of the point between the eyes from the
+    middle of the face, as a fraction of its width, and tilt the angle of the
+    line through the eyes in degrees.
+    """
+    # A finer search than alignment's, which also finds eyes that are partly closed or in shadow
+    eyes = find_eyes(face_img, top=0.6, scale_factor=1.05, min_neighbors=3)
+    if eyes is None:
+        return None
+    left, right = eyes
+    size = face_img.shape[1]
+    offset = ((left[0] + right[0]) / 2 - size / 2) / size
+    tilt = float(np.degrees(np.arctan2(right[1] - left[1], right[0] - left[0])))
+    return offset, tilt
+
+def face_hash(face_img):
+    """Difference hash of a standardized face, as packed bits"""
+    thumbnail = cv2.resize(face_img, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA).astype(np.int16)
+    return np.packbits(thumbnail[:, 1:] > thumbnail[:, :-1])
+
+def hash_distance(a, b):
+    """Number of differing bits of two hashes"""
+    return int(np.unpackbits(np.bitwise_xor(a, b)).sum())
+
+class FaceScore:
+    """Sharpness, pose and hash of one face"""
+    def __init__(self, face_img):
+        face_img = standardize(face_img)
+        self.sharpness = sharpness(face_img)
+        self.pose = eye_pose(face_img)
+        self.hash = face_hash(face_img)
+
+    def problem(self, min_sharpness=CAPTURE_MIN_SHARPNESS, max_eye_offset=CAPTURE_MAX_EYE_OFFSET,
+                max_eye_tilt=CAPTURE_MAX_EYE_TILT):
+        """Return BLURRY or TURNED if the face is not good enough to keep, or None"""
+        if self.sharpness < min_sharpness:
+            return BLURRY
+        if self.pose is None or abs(self.pose[0]) > max_eye_offset or abs(self.pose[1]) > max_eye_tilt:
+            return TURNED
+        return None
+
+class SampleSelector:
+    """A fixed budget of sharp, frontal and distinct faces of one user
+
+    add() keeps faces that pass the quality checks and are not within
+    duplicate_distance bits of a face already kept, until budget faces are
+    kept.
+    """
+    def __init__(self, budget=CAPTURE_SAMPLES, duplicate_distance=CAPTURE_DUPLICATE_DISTANCE):
+        self.budget = budget
+        self.duplicate_distance = duplicate_distance
+        self.faces = []
+        self.scores = []
+
+    @property
+    def full(self):
+        return len(self.faces) >= self.budget
+
+    def is_duplicate(self, score):
+        return any(hash_distance(score.hash, kept.hash) <= self.duplicate_distance for kept in self.scores)
+
+    def add(self, face_img, score=None):
+        """Keep a face if it is good and new, returning None if kept or the reason it was not"""
+        score = score or FaceScore(face_img)
+        problem = score.problem()
+        if problem:
+            return problem
+        if self.is_duplicate(score):
+            return DUPLICATE
+        if not self.full:
+            self.faces.append(face_img)
+            self.scores.append(score)
+        return None
+
+def select_samples(face_imgs, budget=CAPTURE_SAMPLES, min_samples=CAPTURE_MIN_SAMPLES,
+                   duplicate_distance=CAPTURE_DUPLICATE_DISTANCE):
+    """Return the indices of the faces to keep out of a user's saved faces
+
+    Faces passing the quality checks are taken sharpest first, skipping
+    near-duplicates of those already taken, up to budget. If fewer than
+    min_samples pass, the sharpest of the others that are not duplicates
+    are added, so no user is left without samples.
+    """
+    scores = [FaceScore(face_img) for face_img in face_imgs]
+    order = sorted(range(len(scores)), key=lambda i: (scores[i].problem() is not None, -scores[i].sharpness))
+
+    selector = SampleSelector(budget, duplicate_distance)
+    kept = []
+    for i in order:
+        if selector.full:
+            break
+        if scores[i].problem() is not None and len(kept) >= min_samples:
+            break
+        if not selector.is_duplicate(scores[i]):
+            selector.faces.append(face_imgs[i])
+            selector.scores.append(scores[i])
+            kept.append(i)
+    return sorted(kept)
+
+def compact_user_faces(user_dir, budget=CAPTURE_SAMPLES, dry_run=False):
+    """Delete the saved faces of a user that select_samples does not keep, returning (kept, removed)"""
+    paths = sorted(os.path.join(user_dir, name) for name in os.listdir(user_dir) if name.endswith('.jpg'))
+    readable = []
+    face_imgs = []
+    for path in paths:
+        face_img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if face_img is None:
+            print(f"Cannot read {path}")
+            continue
+        readable.append(path)
+        face_imgs.append(face_img)
+
+    kept = set(select_samples(face_imgs, budget))
+    removed = [path for i, path in enumerate(readable) if i not in kept]
+    if not dry_run:
+        for path in removed:
+            os.remove(path)
+    return len(kept), len(removed)
+
+def compact_faces(faces_dir=FACES_DIR, model_file=MODEL_FILE, budget=CAPTURE_SAMPLES, dry_run=False):
+    """Compact the saved faces of every user and retrain the model if any were removed"""
+    # Imported here so that capturing faces does not load the trainer
+    from face.trainer import FaceTrainer
+    trainer = FaceTrainer(faces_dir, model_file)
+    user_dirs = sorted({os.path.dirname(path) for path, _, _, _ in trainer.scan_faces()})
+
+    total_kept = total_removed = 0
+    for user_dir in user_dirs:
+        kept, removed = compact_user_faces(user_dir, budget, dry_run)
+        if removed:
+            print(f"{user_dir}: keeping {kept}, {'would remove' if dry_run else 'removed'} {removed}")
+        total_kept += kept
+        total_removed += removed
+    print(f"{len(user_dirs)} users: {total_kept} faces kept, {total_removed} "
+          f"{'would be removed' if dry_run else 'removed'}")
+
+    if total_removed and not dry_run:
+        trainer.train_face_recognizer()
+    return total_kept, total_removed
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep only sharp, frontal and distinct saved faces of every user")
+    parser.add_argument('--samples', type=int, default=CAPTURE_SAMPLES, help="faces to keep per user at most")
+    parser.add_argument('--dry-run', action='store_true', help="report what would be removed without removing it")
+    parser.add_argument('--model', default=MODEL_FILE, help="model file to retrain")
+    parser.add_argument('faces_dir', nargs='?', default=FACES_DIR, help="faces directory")
+    args = parser.parse_args()
+    compact_faces(args.faces_dir, args.model, args.samples, args.dry_run)
+
+if __name__ == "__main__":
+    main()
@@ -1,98 +1,268 @@
 import cv2
 import os
-from config.db_config import TRAINER_FILE
-from db.models import record_attendance, get_user_name
+import queue
+import time
+import numpy as np
+from config.db_config import (TRAINER_FILE, MODEL_FILE, INDEX_FILE, GALLERY_INDEX_ENABLED, VIDEO_SOURCES,
+                              GALLERY_GROUPS, SOURCE_GROUPS, LOCAL_BUFFER_ENABLED, MODEL_RELOAD_ENABLED,
+                              PIPELINE_DETECT_WORKERS)
+from db.attendance_writer import AttendanceWriter
+from db.local_buffer import LocalAttendanceBuffer, AttendanceSyncer
+from db.roster import AttendanceRoster
 from face.detector import FaceDetector
+from face.matcher import LBPHMatcher
+from face.model_store import load_model, convert_yml_model, model_version
+from face.pipeline import AttendancePipeline, VideoSource
+from face.preprocess import FaceNormalizer
+from face.reloader import ModelReloader
+from face.shards import ShardCache, ShardedGallery, shard_dir, list_shards
+from face.tracker import UNKNOWN
 from face.trainer import FaceTrainer
+from utils.metrics import metrics, MetricsExporter, FACES_BUCKETS, STAGE_SECONDS
 
 class FaceRecognizer:
     def __init__(self):
-        self.detector = FaceDetector()
+        # Detectors kept between attendance sessions, so their cascades are only loaded once
+        self.detectors = queue.SimpleQueue()
         
-        # Load the face recognizer
-        self.face_recognizer = cv2.face.LBPHFaceRecognizer_create()
+        self.matcher = None
+        # Users and today's attendance, kept so a session can start from them if the database is down
+        self.roster = None
+        # Version stamp of the model the matcher was loaded from
+        self.model_version = None
         
-        # Check if trainer file exists
-        if os.path.exists(TRAINER_FILE):
-            self.face_recognizer.read(TRAINER_FILE)
+        # Convert a model saved by an older version in trainer.yml
+        if not os.path.exists(MODEL_FILE) and os.path.exists(TRAINER_FILE):
+            try:
+                convert_yml_model(TRAINER_FILE, MODEL_FILE)
+                print(f"Converted {TRAINER_FILE} to {MODEL_FILE}")
+            except Exception as e:
+                print(f"Error converting {TRAINER_FILE}: {e}")
+        
+        # A model trained with other normalization settings is retrained from the saved faces;
+        # if that fails it is still used, with the normalization it was trained with
+        if os.path.exists(MODEL_FILE) and not FaceNormalizer().matches(load_model(MODEL_FILE)):
+            print("Face normalization settings changed, retraining the model")
+            FaceTrainer().train_face_recognizer()
+        
+        # Check if model file exists
+        if os.path.exists(MODEL_FILE):
+            self.model_version = model_version(MODEL_FILE)
+            self.matcher = self.load_matcher()
             self.model_loaded = True
         else:
             # If not, try to train it
             trainer = FaceTrainer()
             if trainer.train_face_recognizer():
-                self.face_recognizer.read(TRAINER_FILE)
+                self.model_version = model_version(MODEL_FILE)
+                self.matcher = self.load_matcher()
                 self.model_loaded = True
             else:
                 self.model_loaded = False
     
+    def load_matcher(self):
+        """Search the shards of the configured groups, or the full model if it has no shards"""
+        shards_dir = shard_dir(MODEL_FILE)
+        if list_shards(shards_dir):
+            # Shards are only loaded once faces are searched
+            return ShardedGallery(ShardCache(shards_dir), GALLERY_GROUPS)
+        return LBPHMatcher(load_model(MODEL_FILE), GALLERY_INDEX_ENABLED, MODEL_FILE, INDEX_FILE)
+    
+    def refresh_model(self):
+        """Load the published model if it is newer than the one in use, returning whether a model is loaded"""
+        version = model_version(MODEL_FILE)
+        if version is not None and version != self.model_version:
+            try:
+                matcher = self.load_matcher()
+                matcher.warm()
+            except Exception as e:
+                print(f"Error loading model version {version}: {e}")
+            else:
+                self.matcher = matcher
+                self.model_loaded = True
+            self.model_version = version
+        return self.model_loaded
+    
+    def warm(self):
+        """Prepare the model and load a detector for every detection thread, so the first frames do not wait"""
+        if self.matcher is not None:
+            self.matcher.warm()
+        blank = np.zeros((480, 640, 3), dtype=np.uint8)
+        for _ in range(PIPELINE_DETECT_WORKERS * len(VIDEO_SOURCES) - self.detectors.qsize()):
+            detector = FaceDetector()
+            detector.detect_faces(blank)
+            self.detectors.put(detector)
+    
+    def source_matcher(self, spec, matcher):
+        """Matcher of the groups configured for one video source, or None to use the kiosk's"""
+        # A camera can recognize other groups than the kiosk's, from the same loaded shards
+        if spec in SOURCE_GROUPS and isinstance(matcher, ShardedGallery):
+            return matcher.subset(SOURCE_GROUPS[spec])
+        return None
+    
     def is_model_loaded(self):
         """Check if the face recognition model is loaded"""
         return self.model_loaded
     
     def perform_attendance(self):
         """Perform attendance using face recognition"""
-        if not self.model_loaded:
+        # Users enrolled since the last session are in a newer model
+        if not self.refresh_model():
             print("No trained model found. Please add users first.")
             return
         
-        cap = cv2.VideoCapture(0)
-        if not cap.isOpened():
+        # Every configured camera, file and stream shares the loaded model and one writer
+        sources = []
+        specs = []
+        for spec in VIDEO_SOURCES:
+            source = VideoSource(spec, matcher=self.source_matcher(spec, self.matcher))
+            if source.is_opened():
+                sources.append(source)
+                specs.append(spec)
+            else:
+                print(f"Cannot open video source {spec}")
+                source.release()
+        if not sources:
             print("Cannot open camera")
             return
         
-        recognized_users = set()  # To track recognized users in this session
+        # Load users and today's attendance once instead of querying them for every face
+        if self.roster is None:
+            self.roster = AttendanceRoster()
+        roster = self.roster
+        if not roster.refresh():
+            if not LOCAL_BUFFER_ENABLED:
+                print("Could not load users from the database")
+                for source in sources:
+                    source.release()
+                return
+            # Attendance goes to the local buffer anyway; names are filled in once the database is back
+            print("Could not load users from the database, recording attendance locally")
+        # Later refreshes run in the background so a slow database never stalls the display
+        roster.start()
+        
+        # Attendance is written in the background so the database never stalls frames
+        # With the local buffer, attendance survives database outages and is synced when it is back
+        syncer = None
+        if LOCAL_BUFFER_ENABLED:
+            writer = AttendanceWriter(buffer=LocalAttendanceBuffer())
+            syncer = AttendanceSyncer()
+            syncer.start()
+        else:
+            writer = AttendanceWriter()
+        writer.start()
+        
+        # Capture, detection and recognition run on their own threads
+        pipeline = AttendancePipeline(sources, self.matcher, detector_pool=self.detectors)
+        pipeline.start()
+        
+        def swap_matcher(matcher):
+            # Workers pick the new matcher up with their next frame
+            for spec, source in zip(specs, sources):
+                source.matcher = self.source_matcher(spec, matcher)
+            pipeline.matcher = self.matcher = matcher
+        
+        # Models published by the trainer, e.g. after enrolling a user, are swapped in while running
+        reloader = None
+        if MODEL_RELOAD_ENABLED:
+            reloader = ModelReloader(self.load_matcher, swap_matcher, version=self.model_version)
+            reloader.start()
+        
+        # Stage latencies, FPS and queue depths, if metrics are enabled
+        exporter = MetricsExporter()
+        exporter.start()
         
         while True:
-            ret, frame = cap.read()
-            if not ret:
+            try:
+                result = pipeline.read(timeout=0.1)
+            except queue.Empty:
+                # Keep the windows responsive while waiting for a frame
+                if cv2.waitKey(1) == 27:
+                    break
+                continue
+            if result is None:
                 break
-                
-            gray, faces = self.detector.detect_faces(frame)
+            source, frame, faces, tracks = result
+            
+            metrics.inc('attendance_frames_total', source=source.name)
+            metrics.inc('attendance_faces_total', len(faces))
+            metrics.observe('attendance_faces_per_frame', len(faces), FACES_BUCKETS)
             
-            for (x, y, w, h) in faces:
+            names = []
+            with metrics.timer('attendance'):
+                for track in tracks:
+                    user_id = track.identity
+                    name = None
+                    if track.committed and user_id != UNKNOWN:
+                        # Until the users are loaded, recognized users are shown and recorded by ID
+                        name = roster.get_name(str(user_id)) or (None if roster.loaded else str(user_id))
+                    names.append(name)
+                    
+                    # Record attendance if not already done
+                    if name and not roster.has_attended(str(user_id)):
+                        writer.submit(str(user_id), name)
+                        roster.mark_attended(str(user_id))
+            
+            render_start = time.perf_counter()
+            for (x, y, w, h), track, name in zip(faces, tracks, names):
                 cv2.rectangle(frame, (x, y), (x+w, y+h), (255, 0, 0), 2)
                 
-                face_img = gray[y:y+h, x:x+w]
-                
-                try:
-                    # Recognize the face
-                    user_id, confidence = self.face_recognizer.predict(face_img)
-                    
-                    # Lower confidence is better in LBPH
-                    if confidence < 70:  # Confidence threshold
-                        name = get_user_name(str(user_id))
-                        
-                        if name:
-                            # Record attendance if not already done
-                            if str(user_id) not in recognized_users:
-                                success = record_attendance(str(user_id))
-                                if success:
-                                    recognized_users.add(str(user_id))
-                            
-                            # Display name and confidence
-                            cv2.putText(frame, f"{name} ({user_id})", (x, y-10), 
-                                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-                            cv2.putText(frame, f"Conf: {round(100-confidence)}%", (x, y+h+30), 
-                                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-                        else:
-                            cv2.putText(frame, "Unknown", (x, y-10), 
-                                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
-                    else:
-                        # Unknown face
-                        cv2.putText(frame, "Unknown", (x, y-10), 
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
-                except Exception as e:
-                    print(f"Error in recognition: {e}")
+                if not track.committed:
+                    # Not enough agreeing predictions yet
+                    cv2.putText(frame, "Recognizing...", (x, y-10), 
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 255), 2)
+                elif name:
+                    # Display name and confidence
+                    cv2.putText(frame, f"{name} ({track.identity})", (x, y-10), 
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+                    cv2.putText(frame, f"Conf: {round(100-track.distance)}%", (x, y+h+30), 
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+                else:
+                    # Unknown face
+                    cv2.putText(frame, "Unknown", (x, y-10), 
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+            
+            # Display the source's frame rate and the queue depths in front of each stage
+            depths = pipeline.queue_depths()
+            cv2.putText(frame, f"FPS: {source.fps:.1f}  Queues D/R/S: {depths['detect']}/"
+                        f"{depths['recognize']}/{depths['display']}  Dropped: {source.frames_dropped}",
+                        (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
+            if syncer and syncer.backlog:
+                cv2.putText(frame, f"Not synced: {syncer.backlog} ({syncer.lag:.0f}s)", (10, 80), 
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
             
             # Display instructions
             cv2.putText(frame, "Press 'ESC' to exit", (10, 30), 
                         cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
             
-            cv2.imshow('Attendance System', frame)
+            cv2.imshow(f'Attendance System - {source.name}', frame)
             
             # Break on ESC key
-            if cv2.waitKey(1) == 27:
+            key = cv2.waitKey(1)
+            metrics.observe(STAGE_SECONDS, time.perf_counter() - render_start, stage='render')
+            if key == 27:
                 break
                 
-        cap.release()
-        cv2.destroyAllWindows()
\ No newline at end of file
+        if reloader:
+            reloader.stop()
+            self.model_version = reloader.version
+        pipeline.stop()
+        roster.stop()
+        exporter.stop()
+        for source in sources:
+            source.release()
+        cv2.destroyAllWindows()
+        writer.stop()
+        if syncer:
+            syncer.stop()
+        
+        for source in sources:
+            tracker = source.tracker
+            print(f"Source {source.name}: processed {source.frames_processed} of {source.frames_captured} "
+                  f"frames ({source.frames_dropped} dropped)")
+            if tracker.faces_seen:
+                print(f"  Recognized {tracker.recognitions} of {tracker.faces_seen} detected faces")
+        if isinstance(self.matcher, ShardedGallery):
+            cache = self.matcher.cache
+            print(f"Loaded gallery shards {cache.loads} times ({cache.evictions} evicted to stay under "
+                  f"the memory limit)")
\ No newline at end of file
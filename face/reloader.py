@@ -0,0 +1,74 @@
+"""Hot reload of published models.
+
+The trainer publishes every new model by renaming a complete file over the
+old one, with a version stamp one higher in its header (see
+face.model_store). A ModelReloader polls that stamp and, when it changes,
+builds and warms a new matcher on its own thread before handing it over.
+Recognition keeps using the previous matcher until then: its memory-mapped
+file stays readable after being replaced, so no frame waits for the load.
+"""
+import threading
+import time
+from config.db_config import MODEL_FILE, MODEL_RELOAD_INTERVAL
+from face.model_store import model_version
+from utils.metrics import metrics, STAGE_SECONDS
+
+class ModelReloader:
+    """Background thread swapping in new versions of a model file
+
+    load() returns a matcher for the model file as it is now, and
+    on_reload(matcher) receives it once it is ready to search. version is
+    the version of the model already in use; by default it is read from the
+    file when the reloader is created. A version that fails to load is
+    reported once and skipped until a newer one is published.
+    """
+    def __init__(self, load, on_reload, model_file=MODEL_FILE, interval=MODEL_RELOAD_INTERVAL, version=None):
+        self.load = load
+        self.on_reload = on_reload
+        self.model_file = model_file
+        self.interval = interval
+        self.version = version if version is not None else model_version(model_file)
+        self.reloads = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start watching the model file"""
+        self._stop.clear()
+        metrics.set_gauge('attendance_model_version', lambda: self.version or 0)
+        self._thread = threading.Thread(target=self._run, name='model-reloader', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def check(self):
+        """Load the model if a new version has been published, returning True if it was swapped in"""
+        version = model_version(self.model_file)
+        if version is None or version == self.version:
+            return False
+
+        start = time.perf_counter()
+        try:
+            matcher = self.load()
+            matcher.warm()
+        except Exception as e:
+            print(f"Error loading model version {version}: {e}")
+            self.version = version
+            return False
+        self.on_reload(matcher)
+        elapsed = time.perf_counter() - start
+
+        self.version = version
+        self.reloads += 1
+        metrics.inc('attendance_model_reloads_total')
+        metrics.observe(STAGE_SECONDS, elapsed, stage='model_reload')
+        print(f"Loaded model version {version} in {elapsed:.2f}s")
+        return True
@@ -0,0 +1,150 @@
+"""Gallery shards per group of users.
+
+Users saved as faces/<group>/<user_id>/ belong to that group, users saved
+directly as faces/<user_id>/ to DEFAULT_GROUP. Training writes one model
+file per group next to the full model, so a kiosk that only ever sees one
+department or campus loads and searches only that part of the gallery.
+
+ShardCache loads shards when they are first searched and keeps the most
+recently used ones under a memory limit. ShardedGallery searches the shards
+of a set of groups and offers the matching interface of LBPHMatcher, so the
+pipeline can use either.
+"""
+import os
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+from config.db_config import GALLERY_INDEX_ENABLED, SHARD_MEMORY_LIMIT_MB
+from face.matcher import LBPHMatcher
+from face.model_store import load_model
+from face.preprocess import FaceNormalizer
+from utils.metrics import metrics
+
+DEFAULT_GROUP = 'default'
+SHARD_SUFFIX = '.lbph'
+
+def shard_dir(model_file):
+    """Directory holding the group shards trained along with a model file"""
+    return model_file + '.shards'
+
+def shard_file(shards_dir, group):
+    return os.path.join(shards_dir, group + SHARD_SUFFIX)
+
+def list_shards(shards_dir):
+    """Names of the groups with a shard, sorted"""
+    if not os.path.isdir(shards_dir):
+        return []
+    return sorted(name[:-len(SHARD_SUFFIX)] for name in os.listdir(shards_dir) if name.endswith(SHARD_SUFFIX))
+
+class ShardCache:
+    """Loaded group shards, least recently used first
+
+    A shard's size is the memory its search needs: the stored histograms
+    and their square roots. When loading a shard takes the total over
+    memory_limit_mb, the least recently used shards are closed, but the
+    shard being searched is always kept.
+    """
+    def __init__(self, shards_dir, memory_limit_mb=SHARD_MEMORY_LIMIT_MB, use_index=GALLERY_INDEX_ENABLED):
+        self.shards_dir = shards_dir
+        self.memory_limit = memory_limit_mb * 1024 * 1024
+        self.use_index = use_index
+        self._matchers = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def groups(self):
+        return list_shards(self.shards_dir)
+
+    def memory_used(self):
+        return sum(self._sizes.values())
+
+    def get(self, group):
+        """Return the matcher of a group's shard, loading it if needed, or None if it has no shard"""
+        with self._lock:
+            matcher = self._matchers.get(group)
+            if matcher is not None:
+                self._matchers.move_to_end(group)
+                return matcher
+
+            path = shard_file(self.shards_dir, group)
+            if not os.path.exists(path):
+                return None
+            model = load_model(path)
+            matcher = LBPHMatcher(model, self.use_index, path, path + '.index')
+            self._matchers[group] = matcher
+            self._sizes[group] = 2 * len(matcher.active) * model.hist_size * 4
+            self.loads += 1
+            metrics.inc('attendance_shard_loads_total', group=group)
+
+            while self.memory_used() > self.memory_limit and len(self._matchers) > 1:
+                evicted, _ = self._matchers.popitem(last=False)
+                del self._sizes[evicted]
+                self.evictions += 1
+                metrics.inc('attendance_shard_evictions_total', group=evicted)
+            metrics.set_gauge('attendance_shard_memory_bytes', self.memory_used())
+            return matcher
+
+    def clear(self):
+        with self._lock:
+            self._matchers.clear()
+            self._sizes.clear()
+
+class ShardedGallery:
+    """Search of the shards of some groups, with the matching interface of LBPHMatcher
+
+    groups=None searches every shard there is. All shards of a training run
+    share their LBPH parameters and normalization, so the histograms of the
+    faces are computed once and compared with each shard in turn.
+    """
+    def __init__(self, cache, groups=None):
+        self.cache = cache
+        available = cache.groups()
+        self.groups = list(groups) if groups else available
+        for group in self.groups:
+            if group not in available:
+                print(f"No trained faces for group {group}")
+        self.groups = [group for group in self.groups if group in available]
+
+        # Read from a header only, so no shard is loaded until faces are searched
+        self.normalizer = (FaceNormalizer.for_model(load_model(shard_file(cache.shards_dir, self.groups[0])))
+                           if self.groups else FaceNormalizer())
+
+    def subset(self, groups):
+        """A gallery of other groups that shares this one's loaded shards"""
+        return ShardedGallery(self.cache, groups)
+
+    def warm(self):
+        """Load and prepare the shards of the groups, as far as the memory limit allows"""
+        for group in self.groups:
+            matcher = self.cache.get(group)
+            if matcher is not None:
+                matcher.warm()
+
+    def match(self, face_imgs, k=1):
+        """Find the k nearest samples of every face image over all the groups"""
+        labels = np.full((len(face_imgs), k), -1, dtype=np.int64)
+        distances = np.full((len(face_imgs), k), sys.float_info.max)
+        histograms = None
+        for group in self.groups:
+            matcher = self.cache.get(group)
+            if matcher is None or len(face_imgs) == 0:
+                continue
+            if histograms is None:
+                histograms = matcher.compute_histograms(face_imgs)
+            group_labels, group_distances = matcher.match_histograms(histograms, k)
+
+            # Keep the k best of the results so far and this group's
+            all_labels = np.concatenate([labels, group_labels], axis=1)
+            all_distances = np.concatenate([distances, group_distances], axis=1)
+            best = np.argsort(all_distances, axis=1, kind='stable')[:, :k]
+            labels = np.take_along_axis(all_labels, best, axis=1)
+            distances = np.take_along_axis(all_distances, best, axis=1)
+        return labels, distances
+
+    def predict(self, face_img):
+        """Predict the label and distance of a single face like LBPHFaceRecognizer.predict"""
+        labels, distances = self.match([face_img])
+        return int(labels[0, 0]), float(distances[0, 0])
@@ -0,0 +1,118 @@
+from collections import Counter, deque
+from config.db_config import (TRACK_IOU_THRESHOLD, TRACK_MAX_MISSED, TRACK_REFRESH_FRAMES,
+                              TRACK_VOTE_WINDOW, TRACK_MIN_VOTES)
+
+UNKNOWN = -1
+
+def box_iou(a, b):
+    """Intersection over union of two (x, y, w, h) boxes"""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = min(ax + aw, bx + bw) - max(ax, bx)
+    ih = min(ay + ah, by + bh) - max(ay, by)
+    if iw <= 0 or ih <= 0:
+        return 0.0
+    intersection = iw * ih
+    return intersection / float(aw * ah + bw * bh - intersection)
+
+class Track:
+    """A face followed across frames with its recent recognition votes"""
+    def __init__(self, track_id, box, frame_index, vote_window):
+        self.track_id = track_id
+        self.box = box
+        self.last_seen = frame_index
+        self.last_recognized = None
+        self.votes = deque(maxlen=vote_window)
+        self.identity = None
+        self.distance = None
+
+    @property
+    def committed(self):
+        """Whether enough votes agree to trust the identity"""
+        return self.identity is not None
+
+class FaceTracker:
+    """Associate detections across frames by box overlap
+
+    A track is recognized on every frame until TRACK_MIN_VOTES of its last
+    TRACK_VOTE_WINDOW predictions agree, which commits its identity (a user
+    ID or UNKNOWN). After that it is only re-checked every
+    TRACK_REFRESH_FRAMES frames, so a person standing in front of the camera
+    costs a few recognitions instead of one per frame, and a single wrong
+    prediction cannot change who the track is.
+    """
+    def __init__(self, iou_threshold=TRACK_IOU_THRESHOLD, max_missed=TRACK_MAX_MISSED,
+                 refresh_frames=TRACK_REFRESH_FRAMES, vote_window=TRACK_VOTE_WINDOW,
+                 min_votes=TRACK_MIN_VOTES):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.refresh_frames = refresh_frames
+        self.vote_window = vote_window
+        self.min_votes = min_votes
+        self.tracks = []
+        self.frame_index = 0
+        self.faces_seen = 0
+        self.recognitions = 0
+        self._next_id = 1
+
+    def update(self, boxes):
+        """Match this frame's detections to tracks and return the track of every detection"""
+        self.frame_index += 1
+        boxes = [tuple(int(v) for v in box) for box in boxes]
+        self.faces_seen += len(boxes)
+
+        # Greedily pair the most overlapping track and detection first
+        pairs = sorted(((box_iou(track.box, box), t, d)
+                        for t, track in enumerate(self.tracks)
+                        for d, box in enumerate(boxes)), reverse=True)
+        assigned = [None] * len(boxes)
+        used_tracks = set()
+        for iou, t, d in pairs:
+            if iou < self.iou_threshold:
+                break
+            if t in used_tracks or assigned[d] is not None:
+                continue
+            track = self.tracks[t]
+            track.box = boxes[d]
+            track.last_seen = self.frame_index
+            assigned[d] = track
+            used_tracks.add(t)
+
+        for d, box in enumerate(boxes):
+            if assigned[d] is None:
+                track = Track(self._next_id, box, self.frame_index, self.vote_window)
+                self._next_id += 1
+                self.tracks.append(track)
+                assigned[d] = track
+
+        # Forget tracks that have not been seen for a while
+        self.tracks = [track for track in self.tracks
+                       if self.frame_index - track.last_seen <= self.max_missed]
+        return assigned
+
+    def needs_recognition(self, track):
+        """Whether a track should be recognized on this frame"""
+        if not track.committed:
+            return True
+        return self.frame_index - track.last_recognized >= self.refresh_frames
+
+    def start_recognition(self, track):
+        """Note that a track is being recognized, so a re-check is not requested twice"""
+        track.last_recognized = self.frame_index
+
+    def add_prediction(self, track, label, distance):
+        """Record a recognition result for a track and update its identity
+
+        label is UNKNOWN when the face was not confidently recognized.
+        """
+        self.recognitions += 1
+        track.last_recognized = self.frame_index
+        track.votes.append((label, distance))
+
+        counts = Counter(vote_label for vote_label, _ in track.votes)
+        best_label, best_count = counts.most_common(1)[0]
+        if best_count >= self.min_votes:
+            track.identity = best_label
+            matching = [vote_distance for vote_label, vote_distance in track.votes
+                        if vote_label == best_label]
+            track.distance = sum(matching) / len(matching)
@@ -1,49 +1,258 @@
-import cv2
 import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from PIL import Image
-from config.db_config import FACES_DIR, TRAINER_FILE
+from config.db_config import FACES_DIR, MODEL_FILE, TRAINING_WORKERS
+from face.lbph import compute_histogram
+from face.model_store import LBPHModel, load_model, save_model, append_samples, remove_samples
+from face.preprocess import FaceNormalizer
+from face.shards import DEFAULT_GROUP, shard_dir, shard_file, list_shards
+from face.training_cache import TrainingCache
+
+# Images decoded and histogrammed together by one loader thread
+LOAD_CHUNK_SIZE = 32
 
 class FaceTrainer:
-    def __init__(self):
-        self.face_recognizer = cv2.face.LBPHFaceRecognizer_create()
-    
-    def train_face_recognizer(self):
-        """Train the face recognizer with saved faces"""
+    def __init__(self, faces_dir=FACES_DIR, model_file=MODEL_FILE, cache_file=None, workers=TRAINING_WORKERS,
+                 normalizer=None, shards_dir=None):
+        self.faces_dir = faces_dir
+        self.model_file = model_file
+        self.normalizer = normalizer or FaceNormalizer()
+        # Histograms of the training images and the shards of every group are kept next to the model
+        self.cache_file = cache_file or model_file + '.cache'
+        self.shards_dir = shards_dir or shard_dir(model_file)
+        self.workers = workers
+
+    def find_user(self, user_id):
+        """Return the face directory and group of a user, or (None, None) if they have no saved faces"""
+        user_dir = os.path.join(self.faces_dir, str(user_id))
+        if os.path.isdir(user_dir):
+            return user_dir, DEFAULT_GROUP
+        for group in self.scan_groups():
+            user_dir = os.path.join(self.faces_dir, group, str(user_id))
+            if os.path.isdir(user_dir):
+                return user_dir, group
+        return None, None
+
+    def scan_groups(self):
+        """Names of the group directories in the faces directory, sorted"""
+        return sorted(name for name in os.listdir(self.faces_dir)
+                      if not name.isdigit() and os.path.isdir(os.path.join(self.faces_dir, name)))
+
+    def group_of(self, img_path):
+        """Group of a face image listed by scan_faces"""
+        parts = os.path.relpath(img_path, self.faces_dir).split(os.sep)
+        return parts[0] if len(parts) == 3 else DEFAULT_GROUP
+
+    def load_user_faces(self, user_id):
+        """Load the saved face images of a single user"""
         faces = []
         ids = []
-        
+
+        user_dir, _ = self.find_user(user_id)
+        if user_dir is None:
+            return faces, ids
+
+        for img_file in os.listdir(user_dir):
+            if img_file.endswith('.jpg'):
+                img_path = os.path.join(user_dir, img_file)
+                try:
+                    # Read, convert and normalize image
+                    pil_img = Image.open(img_path).convert('L')
+                    img_np = self.normalizer.normalize(np.array(pil_img, 'uint8'))
+
+                    faces.append(img_np)
+                    ids.append(int(user_id))
+                except Exception as e:
+                    print(f"Error processing {img_path}: {e}")
+
+        return faces, ids
+
+    def compute_histograms(self, faces):
+        """Compute the LBPH histogram of every face image"""
+        return np.array([compute_histogram(face) for face in faces], dtype=np.float32)
+
+    def scan_faces(self):
+        """List (path, size, mtime_ns, label) for every saved face image, sorted by path
+
+        Users are saved as faces/<user_id>/ or, in a group, as faces/<group>/<user_id>/.
+        """
+        manifest = []
+        for name in sorted(os.listdir(self.faces_dir)):
+            if name.isdigit():
+                manifest.extend(self._scan_user(os.path.join(self.faces_dir, name), name))
+                continue
+
+            group_dir = os.path.join(self.faces_dir, name)
+            if not os.path.isdir(group_dir):
+                continue
+            for user_id in sorted(os.listdir(group_dir)):
+                user_dir = os.path.join(group_dir, user_id)
+                if not os.path.isdir(user_dir):
+                    continue
+                if not user_id.isdigit():
+                    print(f"Skipping {user_dir}: user IDs must be numeric")
+                    continue
+                manifest.extend(self._scan_user(user_dir, user_id))
+        return manifest
+
+    def _scan_user(self, user_dir, user_id):
+        entries = []
+        if not os.path.isdir(user_dir):
+            return entries
+        for img_file in sorted(os.listdir(user_dir)):
+            if img_file.endswith('.jpg'):
+                img_path = os.path.join(user_dir, img_file)
+                stat = os.stat(img_path)
+                entries.append((img_path, stat.st_size, stat.st_mtime_ns, int(user_id)))
+        return entries
+
+    def load_histograms(self, paths):
+        """Decode face images and compute their histograms, with None for unreadable images"""
+        faces = {}
+        for i, img_path in enumerate(paths):
+            try:
+                faces[i] = self.normalizer.normalize(np.array(Image.open(img_path).convert('L'), 'uint8'))
+            except Exception as e:
+                print(f"Error processing {img_path}: {e}")
+
+        # Images of the same size are histogrammed in one batch
+        by_shape = {}
+        for i, face in faces.items():
+            by_shape.setdefault(face.shape, []).append(i)
+        histograms = [None] * len(paths)
+        for indices in by_shape.values():
+            for i, histogram in zip(indices, compute_histogram(np.stack([faces[i] for i in indices]))):
+                histograms[i] = histogram
+        return histograms
+
+    def train_face_recognizer(self, force=False):
+        """Train the face recognizer with saved faces
+
+        Images whose path, size and modification time are unchanged reuse
+        their cached histograms, and training is skipped entirely when no
+        image has changed since the model was written, unless force is set.
+        """
         # Check if faces directory exists
-        if not os.path.exists(FACES_DIR) or not os.listdir(FACES_DIR):
+        if not os.path.exists(self.faces_dir) or not os.listdir(self.faces_dir):
             print("No face data found for training")
             return False
-        
-        # Traverse all user directories
-        for user_id in os.listdir(FACES_DIR):
-            user_dir = os.path.join(FACES_DIR, str(user_id))
-            if os.path.isdir(user_dir):
-                for img_file in os.listdir(user_dir):
-                    if img_file.endswith('.jpg'):
-                        img_path = os.path.join(user_dir, img_file)
-                        try:
-                            # Read and convert image
-                            pil_img = Image.open(img_path).convert('L')
-                            img_np = np.array(pil_img, 'uint8')
-                            
-                            faces.append(img_np)
-                            ids.append(int(user_id))
-                        except Exception as e:
-                            print(f"Error processing {img_path}: {e}")
-        
-        if not faces or not ids:
+
+        manifest = self.scan_faces()
+        if not manifest:
             print("No face data found for training")
             return False
-        
-        try:
-            self.face_recognizer.train(faces, np.array(ids))
-            self.face_recognizer.save(TRAINER_FILE)
-            print("Face recognizer trained and saved")
+
+        cache = TrainingCache(self.cache_file, self.normalizer.settings())
+        cache.load()
+        groups = sorted({self.group_of(entry[0]) for entry in manifest})
+        if not force and cache.is_current(manifest, self.model_file) and list_shards(self.shards_dir) == groups:
+            print("Face data unchanged, trained model is up to date")
             return True
+
+        histograms = [cache.lookup(entry) for entry in manifest]
+        missing = [i for i, histogram in enumerate(histograms) if histogram is None]
+        if missing:
+            # Decode and histogram the new or changed images in parallel
+            chunks = [missing[start:start+LOAD_CHUNK_SIZE] for start in range(0, len(missing), LOAD_CHUNK_SIZE)]
+            with ThreadPoolExecutor(self.workers) as pool:
+                loaded = pool.map(self.load_histograms, [[manifest[i][0] for i in chunk] for chunk in chunks])
+                for chunk, chunk_histograms in zip(chunks, loaded):
+                    for i, histogram in zip(chunk, chunk_histograms):
+                        histograms[i] = histogram
+
+        # Unreadable images are left out of the model
+        samples = [(label, histogram, self.group_of(path))
+                   for (path, _, _, label), histogram in zip(manifest, histograms) if histogram is not None]
+        if not samples:
+            print("No face data found for training")
+            return False
+
+        try:
+            ids = np.array([label for label, _, _ in samples])
+            model = LBPHModel(np.array([h for _, h, _ in samples], dtype=np.float32), ids)
+            # The full model is published last, so recognizers that see its new version find the shards current
+            self.save_shards(model, [group for _, _, group in samples])
+            save_model(self.model_file, self.normalizer.apply_to(model))
+            print(f"Face recognizer trained and saved ({len(missing)} of {len(manifest)} images decoded)")
         except Exception as e:
             print(f"Error training face recognizer: {e}")
-            return False
\ No newline at end of file
+            return False
+
+        try:
+            cache.update(manifest, histograms, self.model_file)
+        except Exception as e:
+            print(f"Error saving training cache: {e}")
+        return True
+
+    def save_shards(self, model, groups):
+        """Write the samples of every group to its own shard and delete the shards of groups that are gone"""
+        os.makedirs(self.shards_dir, exist_ok=True)
+        groups = np.array(groups)
+        for group in np.unique(groups):
+            rows = np.flatnonzero(groups == group)
+            shard = LBPHModel(model.histograms[rows], model.labels[rows])
+            save_model(shard_file(self.shards_dir, group), self.normalizer.apply_to(shard))
+        for group in set(list_shards(self.shards_dir)) - set(groups.tolist()):
+            os.remove(shard_file(self.shards_dir, group))
+
+    def add_user_faces(self, user_id):
+        """Add a single user's faces to the existing model without a full retrain"""
+        # Without an existing model there is nothing to update
+        if not os.path.exists(self.model_file):
+            return self.train_face_recognizer()
+
+        # Samples prepared differently cannot be mixed into the model
+        if not self.normalizer.matches(load_model(self.model_file)):
+            print("Face normalization settings changed, retraining the whole model")
+            return self.train_face_recognizer()
+
+        faces, ids = self.load_user_faces(user_id)
+        if not faces:
+            print(f"No face data found for user {user_id}")
+            return False
+
+        try:
+            histograms = self.compute_histograms(faces)
+
+            # A model trained before shards existed is searched whole; a shard of only this
+            # user would make recognizers search it instead, so shards are left to the next training
+            shards = list_shards(self.shards_dir)
+            if shards:
+                # The user may also have moved to another group
+                _, group = self.find_user(user_id)
+                for other in shards:
+                    if other != group:
+                        remove_samples(shard_file(self.shards_dir, other), int(user_id))
+                group_file = shard_file(self.shards_dir, group)
+                if os.path.exists(group_file):
+                    append_samples(group_file, histograms, np.array(ids), replace=True)
+                else:
+                    save_model(group_file, self.normalizer.apply_to(LBPHModel(histograms, np.array(ids))))
+
+            # Re-enrolling a user replaces their previous samples, in one new version of the model
+            append_samples(self.model_file, histograms, np.array(ids), replace=True)
+            print(f"Face recognizer updated with user {user_id}")
+            return True
+        except Exception as e:
+            print(f"Error updating face recognizer: {e}")
+            return False
+
+    def remove_user_faces(self, user_id):
+        """Remove a single user's samples from the existing model without a full retrain"""
+        if not os.path.exists(self.model_file):
+            print("No trained model found")
+            return False
+
+        try:
+            for group in list_shards(self.shards_dir):
+                remove_samples(shard_file(self.shards_dir, group), int(user_id))
+            if not remove_samples(self.model_file, int(user_id)):
+                print(f"User {user_id} is not in the trained model")
+                return False
+
+            print(f"User {user_id} removed from face recognizer")
+            return True
+        except Exception as e:
+            print(f"Error removing user from face recognizer: {e}")
+            return False
@@ -0,0 +1,88 @@
+import os
+import numpy as np
+from face.index import model_fingerprint
+
+class TrainingCache:
+    """Histograms of the face images used in the last training run
+
+    Every image is identified by its path, size and modification time, so
+    an image that has not changed is never decoded again. The cache also
+    records the fingerprint of the model file trained from it, which tells
+    whether training can be skipped altogether. Unreadable images are kept
+    in the manifest without a histogram, so they do not force a retrain.
+    Histograms computed with other normalization settings are not reused.
+    """
+    def __init__(self, path, settings=()):
+        self.path = path
+        self.settings = str(tuple(settings))
+        self.manifest = []
+        self.histograms = None
+        self.readable = None
+        self.fingerprint = None
+        self._rows = {}
+
+    def load(self):
+        """Load the cache, returning False if there is none or it cannot be read"""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with np.load(self.path) as data:
+                if 'settings' not in data.files or str(data['settings']) != self.settings:
+                    return False
+                paths = [str(path) for path in data['paths']]
+                self.manifest = list(zip(paths, data['sizes'].tolist(), data['mtimes'].tolist(),
+                                         data['labels'].tolist()))
+                self.histograms = data['histograms']
+                self.readable = data['readable']
+                self.fingerprint = str(data['fingerprint'])
+        except Exception as e:
+            print(f"Ignoring unreadable training cache {self.path}: {e}")
+            self.manifest = []
+            self.histograms = None
+            self.readable = None
+            self.fingerprint = None
+            return False
+        self._rows = {entry: row for row, entry in enumerate(self.manifest)}
+        return True
+
+    def lookup(self, entry):
+        """Return the cached histogram of a (path, size, mtime_ns, label) entry, or None"""
+        row = self._rows.get(tuple(entry))
+        if row is None or not self.readable[row]:
+            return None
+        return self.histograms[row]
+
+    def is_current(self, manifest, model_file):
+        """Whether the images and the model file are exactly those of the last training run"""
+        if not os.path.exists(model_file) or self.fingerprint is None:
+            return False
+        return manifest == self.manifest and model_fingerprint(model_file) == self.fingerprint
+
+    def update(self, manifest, histograms, model_file):
+        """Replace the cache with the images and model of a new training run
+
+        histograms holds one histogram per manifest entry, or None for an
+        image that could not be read.
+        """
+        paths, sizes, mtimes, labels = zip(*manifest) if manifest else ([], [], [], [])
+        readable = np.array([histogram is not None for histogram in histograms], dtype=bool)
+        stored = np.zeros((len(histograms), max([len(h) for h in histograms if h is not None], default=0)),
+                          dtype=np.float32)
+        for row, histogram in enumerate(histograms):
+            if histogram is not None:
+                stored[row] = histogram
+
+        # Write a temporary file first so an interrupted save never leaves a broken cache
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, paths=np.array(paths, dtype=str), sizes=np.array(sizes, dtype=np.int64),
+                     mtimes=np.array(mtimes, dtype=np.int64), labels=np.array(labels, dtype=np.int64),
+                     histograms=stored, readable=readable, settings=np.array(self.settings),
+                     fingerprint=np.array(model_fingerprint(model_file)))
+        os.replace(tmp_path, self.path)
+
+        self.manifest = list(manifest)
+        self.histograms = stored
+        self.readable = readable
+        self.fingerprint = model_fingerprint(model_file)
+        self._rows = {entry: row for row, entry in enumerate(self.manifest)}
@@ -0,0 +1,351 @@
+"""HTTP recognition service for thin clients such as door tablets and phones.
+
+Usage: python service.py [--host HOST] [--port PORT]
+
+POST /recognize with a JPEG (or PNG) image as the request body returns the
+faces found in it as JSON:
+
+    {"faces": [{"box": [x, y, w, h], "user_id": "1001", "name": "Ann", "distance": 41.2}]}
+
+user_id and name are null for faces that are not recognized. Adding
+?record=1 also records attendance for the recognized users. GET /health
+reports whether the service is up and GET /metrics serves the metrics.
+
+Requests are handled by an asyncio server. Decoding and detection run on a
+thread pool, and the faces of all requests arriving together are matched
+in one batch: while a batch is being matched, the faces of new requests
+collect for the next one, so batches grow with the load.
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+import cv2
+import numpy as np
+from config.db_config import (SERVICE_HOST, SERVICE_PORT, SERVICE_WORKERS, SERVICE_MAX_BATCH,
+                              SERVICE_MAX_WAIT_MS, SERVICE_MAX_UPLOAD_MB, RECOGNITION_THRESHOLD,
+                              ROSTER_REFRESH_INTERVAL, LOCAL_BUFFER_ENABLED, MODEL_RELOAD_ENABLED)
+from db.attendance_writer import AttendanceWriter
+from db.database import initialize_database
+from db.local_buffer import LocalAttendanceBuffer, AttendanceSyncer
+from db.roster import AttendanceRoster
+from face.detector import FaceDetector
+from face.reloader import ModelReloader
+from utils.metrics import metrics, STAGE_SECONDS, FACES_BUCKETS
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error'}
+# Seconds an idle keep-alive connection stays open
+KEEP_ALIVE_TIMEOUT = 30
+
+class MicroBatcher:
+    """Match the faces of concurrent requests together
+
+    The first waiting request starts a batch. Requests arriving within
+    max_wait seconds, or while the previous batch is being matched, join it,
+    up to max_batch faces. Matching runs on the executor so the event loop
+    keeps accepting requests meanwhile.
+    """
+    def __init__(self, matcher, executor, max_batch=SERVICE_MAX_BATCH, max_wait=SERVICE_MAX_WAIT_MS / 1000):
+        self.matcher = matcher
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = 0
+        self.faces = 0
+        self._queue = None
+        self._task = None
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def match(self, face_imgs):
+        """Return (labels, distances) of some normalized face images, matched along with other requests'"""
+        if not face_imgs:
+            return [], []
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((face_imgs, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self._queue.get()]
+            count = len(items[0][0])
+            deadline = loop.time() + self.max_wait
+            while count < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                items.append(item)
+                count += len(item[0])
+
+            face_imgs = [face for faces, _ in items for face in faces]
+            try:
+                labels, distances = await loop.run_in_executor(self.executor, self._match, face_imgs)
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.faces += len(face_imgs)
+            metrics.observe('service_batch_faces', len(face_imgs), FACES_BUCKETS)
+            start = 0
+            for faces, future in items:
+                if not future.done():
+                    future.set_result((labels[start:start+len(faces), 0], distances[start:start+len(faces), 0]))
+                start += len(faces)
+
+    def _match(self, face_imgs):
+        with metrics.timer('recognize'):
+            return self.matcher.match(face_imgs)
+
+class RecognitionService:
+    """Recognize faces in uploaded images over HTTP
+
+    With a roster, recognized users are returned with their names, and with
+    a writer their attendance can be recorded.
+    """
+    def __init__(self, matcher, roster=None, writer=None, workers=SERVICE_WORKERS,
+                 max_batch=SERVICE_MAX_BATCH, max_wait_ms=SERVICE_MAX_WAIT_MS,
+                 max_upload_mb=SERVICE_MAX_UPLOAD_MB):
+        self.matcher = matcher
+        self.roster = roster
+        self.writer = writer
+        self.max_upload = int(max_upload_mb * 1024 * 1024)
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='service')
+        self.batcher = MicroBatcher(matcher, self.executor, max_batch, max_wait_ms / 1000)
+        self._detectors = threading.local()
+        self._server = None
+        self._roster_task = None
+
+    def set_matcher(self, matcher):
+        """Search another matcher from the next batch on, such as a newly published model"""
+        self.batcher.matcher = self.matcher = matcher
+
+    async def start(self, host=SERVICE_HOST, port=SERVICE_PORT):
+        """Start accepting connections and return the port listened on"""
+        self.batcher.start()
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        if self.roster is not None:
+            self._roster_task = asyncio.get_running_loop().create_task(self._refresh_roster())
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._roster_task:
+            self._roster_task.cancel()
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        await self.batcher.stop()
+        self.executor.shutdown(wait=True)
+
+    async def serve_forever(self, host=SERVICE_HOST, port=SERVICE_PORT):
+        port = await self.start(host, port)
+        print(f"Recognition service listening on http://{host}:{port}/recognize")
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def _refresh_roster(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(ROSTER_REFRESH_INTERVAL)
+            await loop.run_in_executor(self.executor, self.roster.refresh_if_due)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), KEEP_ALIVE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if request is None:
+                    break
+                method, target, headers, body, error = request
+                if error:
+                    status, payload = error, {'error': REASONS[error]}
+                else:
+                    start = time.perf_counter()
+                    status, payload = await self._route(method, target, body)
+                    metrics.observe(STAGE_SECONDS, time.perf_counter() - start, stage='request')
+
+                keep_alive = headers.get('connection', '').lower() != 'close' and not error
+                self._write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        """Return (method, target, headers, body, error status), or None when the client has closed"""
+        try:
+            line = await reader.readline()
+        except (ValueError, asyncio.LimitOverrunError):
+            # Longer than the stream's limit
+            return None, None, {}, b'', 413
+        if not line:
+            return None
+        try:
+            method, target, _ = line.decode('latin-1').split()
+        except ValueError:
+            return None, None, {}, b'', 400
+
+        headers = {}
+        while True:
+            try:
+                line = await reader.readline()
+            except (ValueError, asyncio.LimitOverrunError):
+                return method, target, headers, b'', 413
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            return method, target, headers, b'', 400
+        if length < 0:
+            return method, target, headers, b'', 400
+        if length > self.max_upload:
+            return method, target, headers, b'', 413
+        body = await reader.readexactly(length) if length else b''
+        return method, target, headers, body, None
+
+    def _write_response(self, writer, status, payload, keep_alive):
+        if isinstance(payload, str):
+            body, content_type = payload.encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            body, content_type = json.dumps(payload).encode('utf-8'), 'application/json'
+        writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                     f"Content-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\n"
+                     f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + body)
+
+    async def _route(self, method, target, body):
+        url = urlsplit(target)
+        if url.path == '/recognize':
+            if method != 'POST':
+                return 405, {'error': "Use POST with an image as the body"}
+            record = parse_qs(url.query).get('record', ['0'])[0] in ('1', 'true', 'yes')
+            try:
+                return 200, await self.recognize(body, record)
+            except ValueError as e:
+                return 400, {'error': str(e)}
+            except Exception as e:
+                print(f"Error in recognition: {e}")
+                return 500, {'error': "Recognition failed"}
+        if url.path == '/health' and method == 'GET':
+            return 200, {'status': 'ok', 'batches': self.batcher.batches, 'faces': self.batcher.faces}
+        if url.path == '/metrics' and method == 'GET':
+            return 200, metrics.render()
+        return 404, {'error': "Not found"}
+
+    async def recognize(self, image_bytes, record=False):
+        """Detect and recognize the faces in an encoded image"""
+        loop = asyncio.get_running_loop()
+        faces, face_imgs = await loop.run_in_executor(self.executor, self._detect, image_bytes)
+        labels, distances = await self.batcher.match(face_imgs)
+
+        results = []
+        for (x, y, w, h), label, distance in zip(faces, labels, distances):
+            # Lower distance is better in LBPH
+            user_id = str(int(label)) if label >= 0 and distance < RECOGNITION_THRESHOLD else None
+            name = self.roster.get_name(user_id) if user_id and self.roster is not None else None
+            results.append({'box': [int(x), int(y), int(w), int(h)], 'user_id': user_id, 'name': name,
+                            'distance': round(float(distance), 2) if label >= 0 else None})
+            if record and user_id and self.writer is not None and self.roster is not None \
+                    and not self.roster.has_attended(user_id):
+                self.writer.submit(user_id, name)
+                self.roster.mark_attended(user_id)
+        return {'faces': results}
+
+    def _detect(self, image_bytes):
+        """Decode an image and return its face boxes and normalized face crops"""
+        image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR) if image_bytes else None
+        if image is None:
+            raise ValueError("The body is not a JPEG or PNG image")
+
+        # Each thread keeps its own detector; uploads are unrelated, so every image is searched in full
+        detector = getattr(self._detectors, 'detector', None)
+        if detector is None:
+            detector = self._detectors.detector = FaceDetector(full_scan_interval=1)
+        with metrics.timer('detect'):
+            gray, faces = detector.detect_faces(image)
+        return faces, self.matcher.normalizer.crop(gray, faces)
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve face recognition over HTTP")
+    parser.add_argument('--host', default=SERVICE_HOST, help="address to listen on")
+    parser.add_argument('--port', type=int, default=SERVICE_PORT, help="port to listen on")
+    args = parser.parse_args()
+
+    # Imported here so that importing this module does not load a model
+    from face.recognizer import FaceRecognizer
+    recognizer = FaceRecognizer()
+    if not recognizer.is_model_loaded():
+        print("No trained model found. Please add users first.")
+        return
+
+    roster = writer = syncer = None
+    if initialize_database():
+        roster = AttendanceRoster()
+        if roster.refresh():
+            if LOCAL_BUFFER_ENABLED:
+                writer = AttendanceWriter(buffer=LocalAttendanceBuffer())
+                syncer = AttendanceSyncer()
+                syncer.start()
+            else:
+                writer = AttendanceWriter()
+            writer.start()
+        else:
+            roster = None
+    if roster is None:
+        print("Database unavailable: names are not returned and attendance is not recorded")
+
+    service = RecognitionService(recognizer.matcher, roster, writer)
+    reloader = None
+    if MODEL_RELOAD_ENABLED:
+        reloader = ModelReloader(recognizer.load_matcher, service.set_matcher, version=recognizer.model_version)
+        reloader.start()
+    try:
+        asyncio.run(service.serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        print("\nService stopped.")
+    finally:
+        if reloader:
+            reloader.stop()
+        if writer:
+            writer.stop()
+        if syncer:
+            syncer.stop()
+
+if __name__ == "__main__":
+    main()
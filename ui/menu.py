@@ -1,24 +1,56 @@
 import datetime
-from db.models import add_user, delete_user, get_attendance_records, export_to_csv
+import os
+import threading
+from config.db_config import MODEL_FILE, TRAINER_FILE
+from db.models import add_user, delete_user, iter_attendance_report, export_attendance_report
 from db.database import initialize_database
-from face.detector import FaceDetector
-from face.recognizer import FaceRecognizer
-from face.trainer import FaceTrainer
 from utils.helpers import create_directories
 
+# The face modules, which import OpenCV and NumPy, are imported when first used so the menu starts at once
+
 class Menu:
     def __init__(self):
         # Initialize database
-        conn, cursor = initialize_database()
-        if not conn:
+        if not initialize_database():
             print("Could not connect to database. Exiting...")
             self.db_initialized = False
         else:
-            conn.close()
             self.db_initialized = True
             
         # Create necessary directories
         create_directories()
+        
+        # One recognizer serves every attendance session. It is loaded in the background while the
+        # menu waits for input; without a model yet, it is created when attendance is first taken
+        self._recognizer = None
+        self._preload_thread = None
+        if self.db_initialized and (os.path.exists(MODEL_FILE) or os.path.exists(TRAINER_FILE)):
+            self._preload_thread = threading.Thread(target=self._preload, name='recognizer-preload', daemon=True)
+            self._preload_thread.start()
+    
+    def _preload(self):
+        try:
+            self._recognizer = self._create_recognizer()
+        except Exception as e:
+            print(f"Error loading face recognizer: {e}")
+    
+    def _create_recognizer(self):
+        from face.recognizer import FaceRecognizer
+        recognizer = FaceRecognizer()
+        recognizer.warm()
+        return recognizer
+    
+    def _wait_for_preload(self):
+        if self._preload_thread:
+            self._preload_thread.join()
+            self._preload_thread = None
+    
+    def get_recognizer(self):
+        """Return the recognizer kept between attendance sessions, loading it if it is not loaded yet"""
+        self._wait_for_preload()
+        if self._recognizer is None:
+            self._recognizer = self._create_recognizer()
+        return self._recognizer
     
     def display_main_menu(self):
         """Display the main menu and handle user choices"""
@@ -48,8 +80,8 @@ class Menu:
     
     def perform_attendance(self):
         """Handle attendance operation"""
-        recognizer = FaceRecognizer()
-        if not recognizer.is_model_loaded():
+        recognizer = self.get_recognizer()
+        if not recognizer.refresh_model():
             print("No users added yet. Please add users first.")
             return
             
@@ -63,13 +95,17 @@ class Menu:
         # Add user to database
         success = add_user(name, user_id)
         if success:
+            from face.detector import FaceDetector
+            from face.trainer import FaceTrainer
             print(f"Capturing face data for {name}...")
             detector = FaceDetector()
             if detector.capture_user_faces(user_id):
                 print(f"User {name} ({user_id}) added successfully")
-                # Retrain the recognizer
+                # Training must not run alongside the preload, which may itself retrain
+                self._wait_for_preload()
+                # Add the new user's faces to the existing model; the recognizer loads it at the next session
                 trainer = FaceTrainer()
-                trainer.train_face_recognizer()
+                trainer.add_user_faces(user_id)
             else:
                 print("Failed to capture face data. User not added.")
                 # Remove user from database
@@ -80,23 +116,37 @@ class Menu:
         date = input("Enter date (YYYY-MM-DD) or press Enter for today: ")
         if not date:
             date = datetime.datetime.now().strftime("%Y-%m-%d")
-            
-        records = get_attendance_records(date)
+        end_date = input("Enter end date (YYYY-MM-DD) for a range or press Enter for one day: ") or date
+        user_id = input("Enter user ID or press Enter for all users: ") or None
         
-        if not records:
-            print(f"No attendance records found for {date}")
-        else:
-            print(f"\nAttendance Records for {date}:")
-            print("-" * 50)
-            print(f"{'Name':<20} {'User ID':<10} {'Time':<10}")
-            print("-" * 50)
-            for record in records:
-                name, user_id, time = record
-                print(f"{name:<20} {user_id:<10} {time}")
-            print("-" * 50)
-            print(f"Total: {len(records)} records")
+        period = date if end_date == date else f"{date} to {end_date}"
+        if user_id:
+            period += f", user {user_id}"
+        
+        # Records are printed as they are read rather than loaded all at once
+        count = 0
+        try:
+            for record in iter_attendance_report(date, end_date, user_id):
+                if count == 0:
+                    print(f"\nAttendance Records for {period}:")
+                    print("-" * 62)
+                    print(f"{'Date':<12} {'Name':<20} {'User ID':<10} {'Time':<10}")
+                    print("-" * 62)
+                record_date, name, record_user_id, time = record
+                print(f"{str(record_date):<12} {name:<20} {record_user_id:<10} {time}")
+                count += 1
+        except Exception:
+            # The error has been printed; the records shown are incomplete
+            print(f"Attendance records for {period} could not be read completely")
+            return
+        
+        if not count:
+            print(f"No attendance records found for {period}")
+            return
+        print("-" * 62)
+        print(f"Total: {count} records")
         
         # Option to export to CSV
         export = input("Export to CSV? (y/n): ")
         if export.lower() == 'y':
-            export_to_csv(records, date)
\ No newline at end of file
+            export_attendance_report(date, end_date, user_id)
\ No newline at end of file
@@ -0,0 +1,250 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config.db_config import METRICS_ENABLED, METRICS_HOST, METRICS_PORT, METRICS_LOG_INTERVAL
+
+# Upper bounds of the latency buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+FACES_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16)
+
+STAGE_SECONDS = 'attendance_stage_seconds'
+METRIC_HELP = {
+    STAGE_SECONDS: ('histogram', "Time spent in each stage of the attendance loop"),
+    'attendance_faces_per_frame': ('histogram', "Faces detected per frame"),
+    'attendance_frames_total': ('counter', "Frames processed"),
+    'attendance_faces_total': ('counter', "Faces detected"),
+    'attendance_recognitions_total': ('counter', "Faces sent to recognition"),
+    'attendance_frames_dropped_total': ('counter', "Frames dropped because detection fell behind"),
+    'attendance_fps': ('gauge', "Frames processed per second over the last second, per video source"),
+    'attendance_queue_depth': ('gauge', "Items waiting in front of each pipeline stage"),
+    'attendance_shard_loads_total': ('counter', "Gallery shards loaded, per group"),
+    'attendance_shard_evictions_total': ('counter', "Gallery shards closed to stay under the memory limit, per group"),
+    'attendance_shard_memory_bytes': ('gauge', "Memory used by the loaded gallery shards"),
+    'attendance_model_version': ('gauge', "Version stamp of the model in use"),
+    'attendance_model_reloads_total': ('counter', "New model versions swapped in while running"),
+}
+
+class Histogram:
+    """Cumulative histogram with fixed buckets, like a Prometheus histogram"""
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile"""
+        with self._lock:
+            target = q * self.count
+            seen = 0
+            for bound, count in zip(self.buckets, self.counts):
+                seen += count
+                if seen >= target and seen:
+                    return bound
+        return float('inf')
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+class Metrics:
+    """Thread-safe counters, gauges and histograms for the recognition loop
+
+    Recording a value takes a lock and a few additions, so instrumenting
+    every frame costs microseconds. When disabled every call returns at once.
+    """
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        """Add a value to a histogram"""
+        if not self.enabled:
+            return
+        key = (name, _labels(labels))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram(buckets))
+        histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        """Increase a counter"""
+        if not self.enabled:
+            return
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        """Set a gauge to a value, or to a function called whenever the gauge is read"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[(name, _labels(labels))] = value
+
+    @contextmanager
+    def timer(self, stage):
+        """Time a block as one run of a stage"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(STAGE_SECONDS, time.perf_counter() - start, stage=stage)
+
+    def _gauge_values(self):
+        with self._lock:
+            gauges = list(self._gauges.items())
+        values = []
+        for key, value in gauges:
+            try:
+                values.append((key, value() if callable(value) else value))
+            except Exception:
+                pass
+        return values
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+        gauges = sorted(self._gauge_values())
+
+        lines = []
+        described = set()
+
+        def describe(name):
+            if name not in described and name in METRIC_HELP:
+                kind, text = METRIC_HELP[name]
+                lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+            described.add(name)
+
+        for (name, labels), value in counters + gauges:
+            describe(name)
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            describe(name)
+            with histogram._lock:
+                counts = list(histogram.counts)
+                total, count = histogram.sum, histogram.count
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """Return a one-line summary of stage latencies, FPS and queue depths for the log"""
+        parts = []
+        with self._lock:
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+        for (name, labels), histogram in histograms:
+            if name == STAGE_SECONDS and histogram.count:
+                stage = dict(labels)['stage']
+                others = _format_labels((key, value) for key, value in labels if key != 'stage')
+                mean_ms = histogram.sum / histogram.count * 1000
+                parts.append(f"{stage}{others} {mean_ms:.1f}ms (p95<={histogram.quantile(0.95) * 1000:g}ms)")
+        # Every label is shown, so e.g. the FPS of each source can be told apart
+        for (name, labels), value in sorted(self._gauge_values()):
+            parts.append(f"{name.replace('attendance_', '')}{_format_labels(labels)}={value:g}")
+        return ', '.join(parts)
+
+    def reset(self):
+        """Forget every recorded value"""
+        with self._lock:
+            self._histograms = {}
+            self._counters = {}
+            self._gauges = {}
+
+# Shared by every stage of the recognition loop
+metrics = Metrics()
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class MetricsExporter:
+    """Serve the metrics over HTTP at /metrics and print snapshots periodically
+
+    Either output is turned off by setting its port or interval to 0.
+    """
+    def __init__(self, host=METRICS_HOST, port=METRICS_PORT, log_interval=METRICS_LOG_INTERVAL):
+        self.host = host
+        self.port = port
+        self.log_interval = log_interval
+        self._server = None
+        self._threads = []
+        self._stop = threading.Event()
+
+    def start(self):
+        """Start the HTTP endpoint and the snapshot logger if metrics are enabled"""
+        if not metrics.enabled:
+            return
+        self._stop.clear()
+        if self.port:
+            try:
+                self._server = ThreadingHTTPServer((self.host, self.port), _MetricsHandler)
+                self._server.daemon_threads = True
+                self._threads.append(threading.Thread(target=self._server.serve_forever,
+                                                      name='metrics-http', daemon=True))
+                print(f"Metrics available at http://{self.host}:{self._server.server_port}/metrics")
+            except OSError as e:
+                print(f"Could not start the metrics endpoint: {e}")
+                self._server = None
+        if self.log_interval:
+            self._threads.append(threading.Thread(target=self._log, name='metrics-log', daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def _log(self):
+        while not self._stop.wait(self.log_interval):
+            snapshot = metrics.snapshot()
+            if snapshot:
+                print(f"[metrics] {snapshot}")
+
+    def stop(self):
+        """Stop the endpoint and the logger"""
+        self._stop.set()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        for thread in self._threads:
+            thread.join()
+        self._threads = []